@@ -0,0 +1,115 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''pySICM.backsteps plans the backsteps of a hopping scan from a prescan.
+
+The prescan is interpolated bilinearly to the resolution of the scan.
+For every pixel and every direction (dx, dy) of the move to the next
+pixel, the backstep is the highest rise of the interpolated surface
+within a neighbourhood of the pixel, plus a margin for noise and for
+features the prescan has missed. The neighbourhood extends radius pixels
+in each direction, but only towards the side of the move: for a move in
++x it covers the pixels from x to x + radius (and y - radius to
+y + radius).
+
+All computations are vectorised. The maximum filter combines maxima of
+windows of doubling length, so its cost grows with the logarithm of the
+radius only, and planning takes milliseconds even for 1024 x 1024
+pixels.'''
+
+import numpy as np
+
+
+def interpolate(prescan, xpx, ypx):
+    '''Interpolates prescan (indexed [x, y]) bilinearly to xpx x ypx
+    pixels covering the same field.'''
+    prescan = np.asarray(prescan, np.float64)
+    for axis, n in ((0, xpx), (1, ypx)):
+        m = prescan.shape[axis]
+        # Pixel i of the scan lies at i*m/n in units of prescan pixels
+        c = np.clip(np.arange(n) * m / float(n), 0, m - 1)
+        i0 = np.floor(c).astype(int)
+        i1 = np.minimum(i0 + 1, m - 1)
+        w = c - i0
+        shape = [1, 1]
+        shape[axis] = n
+        w = w.reshape(shape)
+        prescan = (np.take(prescan, i0, axis) * (1 - w) +
+                   np.take(prescan, i1, axis) * w)
+    return prescan
+
+# Index of the window of maxFilters for a move by -1, 0 or +1
+_WINDOW = {-1: 0, 0: 2, 1: 1}
+
+def _slice(a, axis, start, stop):
+    index = [slice(None)] * a.ndim
+    index[axis] = slice(start, stop)
+    return a[tuple(index)]
+
+def maxFilters(a, radius, axis):
+    '''Returns the maxima of a over the windows [i - radius, i],
+    [i, i + radius] and [i - radius, i + radius] along axis for each i.
+    The windows are clipped at the borders.'''
+    a = np.asarray(a)
+    n = a.shape[axis]
+    if radius == 0:
+        return a, a, a
+    shape = list(a.shape)
+    shape[axis] = n + 2 * radius
+    padded = np.empty(shape, a.dtype)
+    padded.fill(-np.inf)
+    _slice(padded, axis, radius, radius + n)[...] = a
+    # Maxima over windows of doubling length k, then over radius + 1
+    cur, k = padded, 1
+    while 2 * k <= radius + 1:
+        l = cur.shape[axis]
+        cur = np.maximum(_slice(cur, axis, 0, l - k),
+                         _slice(cur, axis, k, l))
+        k *= 2
+    l = cur.shape[axis]
+    rest = radius + 1 - k
+    m = np.maximum(_slice(cur, axis, 0, l - rest),
+                   _slice(cur, axis, rest, l))
+    # m[j] is the maximum of padded[j:j + radius + 1]
+    before = _slice(m, axis, 0, n)
+    after = _slice(m, axis, radius, radius + n)
+    return before, after, np.maximum(before, after)
+
+def plan(prescan, xpx, ypx, radius, margin, minimum = 0):
+    '''Returns the backsteps in nm as array [dx+1, dy+1, x, y].
+
+    Params:
+    =======
+    prescan: Heights of the prescan in nm, indexed [x, y]
+    xpx, ypx: Number of pixels of the scan
+    radius: Size of the neighbourhood in pixels of the scan
+    margin: Added to the rise, in nm
+    minimum: Minimum backstep in nm, also used if there is no move
+        (dx, dy) = (0, 0)
+    '''
+    surface = interpolate(prescan, xpx, ypx).astype(np.float32)
+    bs = np.empty((3, 3, xpx, ypx), np.float32)
+    bs[1, 1] = minimum
+    rows = maxFilters(surface, radius, 0)
+    for dx in (-1, 0, 1):
+        tops = maxFilters(rows[_WINDOW[dx]], radius, 1)
+        for dy in (-1, 0, 1):
+            if dx == 0 and dy == 0:
+                continue
+            out = bs[dx+1, dy+1]
+            np.subtract(tops[_WINDOW[dy]], surface, out = out)
+            out += margin
+            np.maximum(out, minimum, out = out)
+    return bs
@@ -0,0 +1,108 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''pySICM.checkpoint saves the state of long scans to disk, so that a scan
+can be resumed (command RESUME) after the client has disconnected, the
+scan has been stopped or the server has crashed.
+
+A checkpoint is a numpy .npz file in CHECKPOINTDIR (option checkpointdir
+in the [pySICM] section of setup.ini). It holds the name of the scan
+mode, its settings (as JSON) and the state returned by the mode, a dict
+of numbers and arrays. There is only one checkpoint, the one of the last
+scan; it is removed when a scan is completed.
+
+Checkpoints are written to a temporary file which is renamed, so that a
+crash while writing leaves the previous checkpoint intact.'''
+
+import json, os, time
+import numpy as np
+from pySICM.error import PySICMError
+
+CHECKPOINTDIR = '/var/pySICM/checkpoints/'
+FILENAME = 'checkpoint.npz'
+# Minimum interval of periodic checkpoints in seconds
+# (option checkpointinterval)
+INTERVAL = 60.0
+
+
+def filename():
+    return os.path.join(CHECKPOINTDIR, FILENAME)
+
+def save(mode, settings, state):
+    '''Saves the checkpoint of a scan in mode with settings and state.'''
+    if not os.path.isdir(CHECKPOINTDIR):
+        os.makedirs(CHECKPOINTDIR)
+    fname = filename()
+    # np.savez appends .npz to names without it
+    tmp = fname + '.tmp.npz'
+    np.savez(tmp, mode = mode, settings = json.dumps(settings), **state)
+    os.rename(tmp, fname)
+
+def load():
+    '''Returns mode, settings and state of the checkpoint. Raises a
+    PySICMError if there is none.'''
+    fname = filename()
+    if not os.path.exists(fname):
+        raise PySICMError('No checkpoint found in ' + CHECKPOINTDIR)
+    f = np.load(fname)
+    try:
+        state = dict((k, f[k]) for k in f.files)
+    finally:
+        f.close()
+    mode = str(state.pop('mode'))
+    settings = json.loads(str(state.pop('settings')))
+    return mode, settings, state
+
+def clear():
+    '''Removes the checkpoint.'''
+    if os.path.exists(filename()):
+        os.remove(filename())
+
+
+class Checkpointer(object):
+    '''Saves the checkpoints of a scan.
+
+    Params:
+    =======
+    mode: Name of the scan mode
+    settings: Settings of the scan, as passed to the scan mode
+    getState: Callable returning the state of the scan
+    '''
+
+    def __init__(self, mode, settings, getState):
+        self.mode = mode
+        self.settings = settings
+        self.getState = getState
+        self._last = time.time()
+
+    def save(self):
+        '''Saves a checkpoint. Errors are reported, but do not stop the
+        scan.'''
+        self._last = time.time()
+        try:
+            save(self.mode, self.settings, self.getState())
+        except (IOError, OSError) as e:
+            print "Saving checkpoint failed: " + str(e)
+
+    def periodic(self):
+        '''Saves a checkpoint if the last one is older than INTERVAL.'''
+        if time.time() - self._last >= INTERVAL:
+            self.save()
+
+    def clear(self):
+        try:
+            clear()
+        except OSError as e:
+            print "Removing checkpoint failed: " + str(e)
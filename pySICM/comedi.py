@@ -0,0 +1,42 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+
+'''pySICM.comedi provides the modules of pycomedi (device, subdevice,
+channel, constant, utility) and PyComediError. If pycomedi is not
+installed, those of the simulated backend (pySICM.simulation) are used
+instead and SIMULATED is True; only simulated and replay devices can be
+used then.
+
+All of pySICM imports pycomedi through this module, e.g.
+
+  from pySICM.comedi import constant as CONSTANTS, utility as Util
+'''
+
+try:
+    import pycomedi.device as device
+    import pycomedi.subdevice as subdevice
+    import pycomedi.channel as channel
+    import pycomedi.constant as constant
+    import pycomedi.utility as utility
+    SIMULATED = False
+except ImportError:
+    import pySICM.simulation.device as device
+    import pySICM.simulation.subdevice as subdevice
+    import pySICM.simulation.channel as channel
+    import pySICM.simulation.constant as constant
+    import pySICM.simulation.utility as utility
+    SIMULATED = True
+from pySICM.simulation import PyComediError
@@ -1,17 +1,25 @@
 import pySICM.commands as Com
-import json
+import json, base64
 import pySICM.helpers as Helpers
+import pySICM.checkpoint as Checkpoint
+import pySICM.jobqueue as JobQueue
+from pySICM.error import PySICMError
 
 from pySICM.setup import pysicmsetup as SETUP
 from twisted.internet import utils, defer
 from subprocess import check_output
 
+Helpers.SCANMODESDIR = SETUP.files['scanmodesdir']
+Helpers.TOOLSDIR = SETUP.files['toolsdir']
 
 class CmdStop(Com.Command):
     def __init__(self, cmgr):
         super(CmdStop, self).__init__('STOP', self.stop, cmgr)
 
     def stop(self):
+        queue = JobQueue.getQueue()
+        if queue.isRunning():
+            return queue.stop()
         if self.cmgr.modeobj is not None:
             return self.cmgr.modeobj.setStop()
         else:
@@ -36,13 +44,117 @@ class CmdScan(Com.Command):
         tmp = []
         for t in SETUP.tools:
             tmp.append('tool'+t[0].upper()+t[1:])
+        if JobQueue.getQueue().isBusy():
+            print "A scan is running."
+            return self.nack()
         if mode in tmp+SETUP.modes:
             self.cmgr.modeobj = Helpers.getScanmodeObject(mode, self._isTool(mode))()
-            return self.cmgr.modeobj.scan(self.cmgr.settings, self.cmgr.writeResponse)
+            JobQueue.getQueue().scanStarted(self.cmgr.modeobj)
+            try:
+                return self.cmgr.modeobj.scan(self.cmgr.settings, self.cmgr.writeResponse)
+            except:
+                JobQueue.getQueue().scanAborted(self.cmgr.modeobj)
+                raise
         else:
             print "Going to return NACK (2)"
             return self.nack()
 
+class CmdResume(Com.Command):
+    '''Resumes the scan saved in the last checkpoint (see
+    pySICM.checkpoint). Answers with the mode, the settings and the
+    position (phase and number of pixels already scanned) as JSON, followed
+    by the data of the remaining pixels, or NACK.'''
+    def __init__(self, cmgr):
+        super(CmdResume, self).__init__('RESUME', self.resume, cmgr)
+
+    def resume(self):
+        if JobQueue.getQueue().isBusy():
+            print "A scan is running."
+            return self.nack()
+        try:
+            mode, settings, state = Checkpoint.load()
+        except PySICMError as e:
+            print str(e)
+            return self.nack()
+        modeobj = Helpers.getScanmodeObject(mode)()
+        if not hasattr(modeobj, 'resume'):
+            print "Scan mode " + str(mode) + " can not be resumed."
+            return self.nack()
+        self.cmgr.settings.update(settings)
+        self.cmgr.modeobj = modeobj
+        JobQueue.getQueue().scanStarted(modeobj)
+        info = {'mode': mode,
+                'settings': settings[mode],
+                'prescan': int(state['prescan']),
+                'cursor': int(state['cursor'])}
+        d = self._succesfulWriteDefered(info, jsonify = True)
+        if not modeobj.resume(settings, state, self.cmgr.writeResponse):
+            JobQueue.getQueue().scanAborted(modeobj)
+            return self.nack()
+        return d
+
+class CmdQueue(Com.Command):
+    '''Manages the job queue (see pySICM.jobqueue). Parameters:
+
+    ADD: Adds a job with the current mode and settings. Answers with the
+        id of the job as JSON, or NACK if the mode can not be queued.
+    LIST: Answers with the status of all jobs as JSON.
+    START: Continues a queue held by STOP.
+    CLEAR: Removes all jobs but the running one.
+    START and CLEAR answer like LIST, unknown parameters with NACK.
+    RESULT <id>: Answers with the data of a job, base64 encoded.
+
+    Every QUEUE command attaches the connection to the queue, so that a
+    client receives the data of the running job after a reconnect.'''
+    def __init__(self, cmgr):
+        super(CmdQueue, self).__init__('QUEUE', None, cmgr)
+
+    def execute(self, param = '', _id = None):
+        queue = JobQueue.getQueue()
+        queue.attach(self.cmgr.writeResponse)
+        tmp = param.split(" ", 1)
+        param = tmp[0].upper()
+        if param == 'ADD':
+            return self._execute(self.add(queue), _id)
+        elif param == 'LIST':
+            return self._execute(self.list(queue), _id)
+        elif param == 'START':
+            queue.start()
+            return self._execute(self.list(queue), _id)
+        elif param == 'CLEAR':
+            queue.clear()
+            return self._execute(self.list(queue), _id)
+        elif param == 'RESULT' and len(tmp) > 1:
+            return self._execute(self.result(queue, tmp[1]), _id)
+        else:
+            print ('Parameter '+str(param)+' not defined for command '+
+                   str(self.command))
+            return self._execute(self.nack(), _id)
+
+    def list(self, queue):
+        return self._succesfulWriteDefered(
+            [job.info() for job in queue.jobs], jsonify = True)
+
+    def add(self, queue):
+        mode = self.cmgr.settings.get('mode')
+        if mode not in SETUP.modes:
+            print "Mode " + str(mode) + " is unknown."
+            return self.nack()
+        if not Helpers.getScanmodeObject(mode).queueable:
+            print "Scan mode " + str(mode) + " can not be queued."
+            return self.nack()
+        job = queue.add(mode, self.cmgr.settings)
+        return self._succesfulWriteDefered({'id': job.jobid}, jsonify = True)
+
+    def result(self, queue, jobid):
+        try:
+            job = queue.get(int(jobid))
+        except ValueError:
+            job = None
+        if job is None:
+            return self.nack()
+        return self._succesfulWriteDefered(base64.b64encode(job.result()))
+
 class CmdGet(Com.CommandWithParam):
     def __init__(self, cmgr):
         super(CmdGet, self).__init__('GET', cmgr)
@@ -127,6 +239,8 @@ class CmdSet(Com.CommandWithParamValue):
 def add_command_list(cmgr):
     cmgr.addCommand(CmdStop(cmgr))
     cmgr.addCommand(CmdScan(cmgr))
+    cmgr.addCommand(CmdResume(cmgr))
+    cmgr.addCommand(CmdQueue(cmgr))
     cmgr.addCommand(CmdGet(cmgr))
     cmgr.addCommand(CmdSet(cmgr))
     
@@ -70,7 +70,7 @@ class CommandWithParamValue(Command):
         super(CommandWithParamValue, self).__init__(command, cb, cmgr)
  
     def execute(self, param, _id = None):
-        key, value = param.split("=")
+        key, value = param.split("=", 1)
         self.setValue(key, value)
         
     def setValue(self, key, value):
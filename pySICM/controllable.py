@@ -85,9 +85,9 @@ class Controllable(object):
             try:
                 kwargs['ycoarse'].up
                 kwargs['ycoarse'].down
-                self._axes['zcoarse'] = kwargs['ycoarse']
+                self._axes['ycoarse'] = kwargs['ycoarse']
             except AttributeError:
-                PySICMError("coarse Y-Axis ' does not implement methods 'up' and 'down'")
+                raise PySICMError("coarse Y-Axis ' does not implement methods 'up' and 'down'")
 
         if('zfine' in kwargs):
             self._axes['zfine'] = kwargs['zfine']
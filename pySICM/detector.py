@@ -0,0 +1,125 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''pySICM.detector detects the surface in the ion current recorded during
+an approach.
+
+The samples are averaged in windows of a fixed number of samples (the
+output filter of the approach). The surface is detected at the first run
+of count consecutive window averages at or below the threshold. With a
+hysteresis, a run is only broken by an average above threshold +
+hysteresis; averages in between continue it.
+
+All of this is done with numpy on whole blocks of samples, so that the
+approach loops only have to read blocks and pass them to feed().'''
+
+import numpy as np
+
+
+class ThresholdDetector(object):
+    '''Detects the first run of count consecutive window averages at or
+    below threshold.
+
+    Params:
+    =======
+    threshold: Stop threshold in bits
+    count: Number of consecutive averages required (default 3)
+    hysteresis: Hysteresis in bits (default 0)
+    average: Number of samples averaged per window (default 1)
+    size: Maximum number of averages that are stored (default 0: none)
+    '''
+
+    def __init__(self, threshold, count = 3, hysteresis = 0, average = 1,
+                 size = 0):
+        self.threshold = threshold
+        self.count = max(1, int(count))
+        self.hysteresis = max(0, hysteresis)
+        self.average = max(1, int(average))
+        self.values = np.zeros(int(size), np.uint16)
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.detected = False
+        self._rest = np.zeros(0, np.float64)
+        self._run = 0
+        self._below = False
+
+    def feed(self, samples):
+        '''Processes a block of samples. Samples that do not complete a
+        window are kept for the next call. Returns True if the surface
+        has been detected; the averages after the detection are
+        dropped.'''
+        if self.detected:
+            return True
+        samples = np.asarray(samples, np.float64)
+        if len(self._rest):
+            samples = np.concatenate((self._rest, samples))
+        nwin = len(samples) // self.average
+        self._rest = samples[nwin * self.average:]
+        if nwin == 0:
+            return False
+        means = samples[:nwin * self.average].reshape(
+            nwin, self.average).mean(axis = 1)
+
+        # 1: below threshold, 0: above threshold + hysteresis, -1: keep
+        # the state of the previous average
+        state = np.where(means <= self.threshold, 1, np.where(
+            means > self.threshold + self.hysteresis, 0, -1))
+        state = np.concatenate(([1 if self._below else 0], state))
+        last = np.where(state >= 0, np.arange(len(state)), 0)
+        state = state[np.maximum.accumulate(last)][1:]
+
+        # Length of the run of 1s ending at each average
+        total = np.cumsum(state)
+        runs = total - np.maximum.accumulate(np.where(state == 0, total, 0))
+        runs[:np.argmin(state) if not state.all() else len(runs)] += (
+            self._run)
+
+        hit = np.flatnonzero(runs >= self.count)
+        if len(hit):
+            nwin = hit[0] + 1
+            means = means[:nwin]
+            self.detected = True
+        self._store(means)
+        self._run = runs[nwin - 1]
+        self._below = state[nwin - 1] == 1
+        return self.detected
+
+    def _store(self, means):
+        k = min(len(means), len(self.values) - self.n)
+        if k > 0:
+            self.values[self.n:self.n + k] = np.floor(means[:k])
+        self.n += len(means)
+
+    def samples(self):
+        '''Number of samples up to the end of the last processed window.'''
+        return self.n * self.average
+
+    def data(self):
+        '''The stored averages (floored).'''
+        return self.values[:min(self.n, len(self.values))]
+
+
+def parseThresholds(text):
+    '''Returns the thresholds given in text as comma separated percentages
+    (like the option Threshold of the scan modes) as fractions. Empty
+    entries and zeros are ignored, so that "0" means no thresholds.'''
+    thresholds = []
+    for t in str(text).split(','):
+        t = t.strip()
+        if t and float(t) != 0:
+            thresholds.append(float(t) / 100)
+    return thresholds
@@ -3,7 +3,7 @@
 # This file belongs to the pySICM package.
 # The file is free software.
 
-from pycomedi.device import Device
+from pySICM.comedi import device as Comedi
 
 class Device:
     _device
@@ -1,13 +1,82 @@
 
 
+import collections
+import numpy as np
+import pySICM.recorder as Recorder
+
+class ReadRate(object):
+    '''Estimate of the rate (in Hz) at which samples of an input signal
+    can be read by software.
+
+    The rate is measured once by reading CALIBRATIONREADS single samples
+    and is then updated from the reads done during approaches (see
+    update). The estimate is based on the last WINDOW observations.
+    Time is taken by pySICM.recorder.now, so that replays give the
+    recorded estimates.
+    '''
+
+    CALIBRATIONREADS = 2**15
+    WINDOW = 32
+
+    def __init__(self, signal):
+        self.signal = signal
+        self._obs = collections.deque(maxlen = self.WINDOW)
+
+    def measure(self):
+        '''Measures the rate by reading single samples.'''
+        c = 0
+        start = Recorder.now()
+        while c < self.CALIBRATIONREADS:
+            self.signal.read()
+            c += 1
+        self.update(c, Recorder.now() - start)
+        print('frequency: ' + str(self.mean()))
+
+    def update(self, n, duration):
+        '''Adds the observation that n samples were read in duration
+        seconds.'''
+        if n > 0 and duration > 0:
+            self._obs.append((n, duration))
+
+    def frequency(self):
+        '''The current estimate. Measures the rate if there is none yet.'''
+        if not self._obs:
+            self.measure()
+        return self.mean()
+
+    def mean(self):
+        '''Samples read per second, over all observations.'''
+        n = sum(o[0] for o in self._obs)
+        t = sum(o[1] for o in self._obs)
+        return float(n) / t
+
+    def jitter(self):
+        '''Standard deviation of the rates of the single observations.'''
+        return float(np.std([o[0] / o[1] for o in self._obs]))
+
+    def confidence(self):
+        '''1 - relative standard error of the mean rate (0 if there is only
+        one observation).'''
+        if len(self._obs) < 2:
+            return 0.0
+        sem = self.jitter() / np.sqrt(len(self._obs) - 1)
+        return max(0.0, 1.0 - sem / self.mean())
+
+    def upper(self):
+        '''A rate that is unlikely to be exceeded (mean + 3 jitter).'''
+        return self.mean() + 3 * self.jitter()
+
+
 class InputSignal(object):
     channel = None
     name = None
     converter = None
+    rate = None
     def __init__(self, name, channel):
-        self.channel = channel
+        self.channel = Recorder.wrap(channel)
         self.name = name
         self.converter = self.channel.get_converter()
+        self.rate = ReadRate(self)
     def read(self):
         return self.channel.data_read()
 
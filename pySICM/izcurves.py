@@ -0,0 +1,186 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''pySICM.izcurves stores the approach curves (current over z) of all
+pixels of a scan in compact form.
+
+Of the current recorded during an approach (the averages over one filter
+period, see pySICM.detector), the last tail values before the stop are
+kept as they are, since they contain the interaction of pipette and
+sample. The values before, recorded far from the surface, are reduced to
+an envelope: the minimum and the maximum of each run of decimation
+values. The averages are taken at equidistant z positions between the
+start and the end of the approach, so the z of every value follows from
+the two positions and the number of values.
+
+A curve is transmitted as one record of uint16:
+
+  x, y, start (2), end (2), n (2), m, k, m (min, max) pairs, k tail values
+
+start and end are the z positions of the approach in nm and n the number
+of recorded values, as 32 bit numbers (high word first, as in
+Approach._detectSurface). m is the number of envelope pairs and k the
+number of tail values, so the records differ in length. When transmitted, a record is
+followed by STOP, the end sequence of Approach.writeData.
+
+A CurveMap collects the records of a scan in a ragged array: all values
+in one flat array and, per curve, the header and the offset of its
+values. It is saved with numpy.savez and can be loaded for offline
+analysis without the GUI.'''
+
+import numpy as np
+
+# Number of uint16 in the header of a record
+HEADER = 10
+# End of a transmitted record
+STOP = np.array([0, 2**16 - 1] * 3, np.uint16)
+# Fields of the index of a CurveMap
+FIELDS = ('x', 'y', 'start', 'end', 'n', 'envelope', 'tail', 'offset')
+
+
+def compress(data, tail, decimation):
+    '''Returns the envelope (array of shape (m, 2) with the minimum and the
+    maximum of each run of decimation values) of data without the last
+    tail values, and these last values.'''
+    data = np.asarray(data, np.uint16)
+    tail = min(max(int(tail), 0), len(data))
+    decimation = max(int(decimation), 1)
+    head = data[:len(data) - tail]
+    m = -(-len(head) // decimation)
+    if m == 0:
+        envelope = np.zeros((0, 2), np.uint16)
+    else:
+        bounds = np.arange(0, len(head), decimation)
+        envelope = np.column_stack((np.minimum.reduceat(head, bounds),
+                                    np.maximum.reduceat(head, bounds)))
+    return envelope, data[len(data) - tail:]
+
+
+def _split(number):
+    number = int(number)
+    return [number // 2**16, number % 2**16]
+
+def _join(high, low):
+    return int(high) * 2**16 + int(low)
+
+
+def encode(x, y, start, end, n, envelope, tail):
+    '''Returns the record (uint16 array) of a curve.'''
+    header = ([x, y] + _split(start) + _split(end) + _split(n) +
+              [len(envelope), len(tail)])
+    return np.concatenate((np.array(header, np.uint16),
+                           np.asarray(envelope, np.uint16).ravel(),
+                           np.asarray(tail, np.uint16)))
+
+def decode(record):
+    '''Returns the curve of a record as a tuple (x, y, start, end, n,
+    envelope, tail) and the number of uint16 used by the record.'''
+    record = np.asarray(record, np.uint16)
+    if len(record) < HEADER:
+        raise ValueError('Record too short')
+    m, k = int(record[8]), int(record[9])
+    size = HEADER + 2 * m + k
+    if len(record) < size:
+        raise ValueError('Record too short')
+    envelope = record[HEADER:HEADER + 2 * m].reshape(m, 2)
+    return ((int(record[0]), int(record[1]), _join(*record[2:4]),
+             _join(*record[4:6]), _join(*record[6:8]), envelope,
+             record[HEADER + 2 * m:size]), size)
+
+
+class CurveMap(object):
+    '''The approach curves of a scan in a ragged array.
+
+    Params:
+    =======
+    decimation: Number of values per envelope pair
+    '''
+
+    def __init__(self, decimation):
+        self.decimation = int(decimation)
+        self._index = []
+        self._values = []
+        self._size = 0
+        self._data = None
+
+    def __len__(self):
+        return len(self._index)
+
+    def add(self, record):
+        '''Adds the curve of a record (see encode). Returns the number of
+        uint16 used by the record.'''
+        (x, y, start, end, n, envelope, tail), size = decode(record)
+        values = np.concatenate((envelope.ravel(), tail))
+        self._index.append((x, y, start, end, n, len(envelope),
+                            len(tail), self._size))
+        self._values.append(values)
+        self._size += len(values)
+        self._data = None
+        return size
+
+    def index(self):
+        '''Returns the index as an int64 array with one row per curve and
+        the columns FIELDS.'''
+        return np.array(self._index, np.int64).reshape(-1, len(FIELDS))
+
+    def data(self):
+        '''Returns the values of all curves as one uint16 array.'''
+        if self._data is None:
+            if self._values:
+                self._data = np.concatenate(self._values)
+            else:
+                self._data = np.zeros(0, np.uint16)
+            self._values = [self._data]
+        return self._data
+
+    def heights(self, xpx, ypx):
+        '''Returns the end positions of the approaches in nm as array
+        [y, x], NaN where no curve has been added.'''
+        h = np.empty((ypx, xpx))
+        h.fill(np.nan)
+        index = self.index()
+        h[index[:, 1], index[:, 0]] = index[:, 3]
+        return h
+
+    def curve(self, i):
+        '''Returns curve number i as a tuple (z, current, zenv, envelope):
+        the z positions (in nm) and values of the tail, and the z
+        positions of the centres of the envelope pairs with the pairs.'''
+        x, y, start, end, n, m, k, offset = self._index[i]
+        values = self.data()[offset:offset + 2 * m + k]
+        z = start + (end - start) * np.arange(1, n + 1) / float(n)
+        zenv = z[:n - k]
+        if m:
+            bounds = np.arange(0, len(zenv), self.decimation)
+            zenv = np.add.reduceat(zenv, bounds) / np.diff(
+                np.append(bounds, len(zenv)))
+        return (z[n - k:], values[2 * m:], zenv,
+                values[:2 * m].reshape(m, 2))
+
+    def save(self, f):
+        '''Saves the curves to f (file name or file object).'''
+        np.savez(f, index = self.index(), data = self.data(),
+                 decimation = np.array([self.decimation]))
+
+    @classmethod
+    def load(cls, f):
+        '''Returns the CurveMap saved to f.'''
+        saved = np.load(f)
+        curves = cls(int(saved['decimation'][0]))
+        curves._index = [tuple(row) for row in saved['index']]
+        curves._data = saved['data']
+        curves._values = [curves._data]
+        curves._size = len(curves._data)
+        return curves
@@ -0,0 +1,263 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''pySICM.jobqueue runs scan jobs back to back on the server.
+
+A job is a scan mode together with a snapshot of its settings, taken when
+the job is added (command QUEUE ADD). The jobs are run in the order in
+which they were added; the next job is started as soon as the previous
+one has finished, without waiting for the client.
+
+The queue belongs to the server, not to a connection: a client may
+disconnect while jobs are running or waiting, the queue continues. The
+data of each job is written to the file job<id>.dat in the checkpoint
+directory (see pySICM.checkpoint) and can be fetched later (QUEUE
+RESULT); QUEUE CLEAR removes the files of the removed jobs. While a
+client is attached, the data is also streamed to it as usual, and each
+change of the status of a job is reported in a line
+
+  JOB {"id": ..., "mode": ..., "status": ..., "bytes": ...}
+
+STOP stops the running job and holds the queue, QUEUE START continues
+with the next job. Jobs added to a held queue wait for QUEUE START.
+
+A job is not started while a scan started by SCAN or RESUME is running
+(see scanStarted); it waits until that scan has finished.
+
+Only modes which report the end of a scan (queueable, see
+pySICM.sicm._SICMMeasurement.whenFinished) can be queued.'''
+
+import copy, json, os
+import pySICM.helpers as Helpers
+import pySICM.checkpoint as Checkpoint
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+STOPPED = 'stopped'
+FAILED = 'failed'
+
+QUEUE = None
+
+
+class Job(object):
+    '''A scan job.
+
+    Params:
+    =======
+    jobid: Number of the job
+    mode: Name of the scan mode
+    settings: Settings of the scan, as sent by SET (only mode and the
+        settings of mode are used)
+    '''
+
+    def __init__(self, jobid, mode, settings):
+        self.jobid = jobid
+        self.mode = mode
+        self.settings = {'mode': mode,
+                         mode: copy.deepcopy(settings.get(mode, {}))}
+        self.status = QUEUED
+        self.nbytes = 0
+        self._file = None
+
+    def info(self):
+        return {'id': self.jobid,
+                'mode': self.mode,
+                'status': self.status,
+                'bytes': self.nbytes}
+
+    def filename(self):
+        return os.path.join(Checkpoint.CHECKPOINTDIR,
+                            'job' + str(self.jobid) + '.dat')
+
+    def open(self):
+        '''Opens the file of the data, called when the job is started.'''
+        if not os.path.isdir(Checkpoint.CHECKPOINTDIR):
+            os.makedirs(Checkpoint.CHECKPOINTDIR)
+        self._file = open(self.filename(), 'wb')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def record(self, message, newline):
+        message = str(message)
+        if newline:
+            message += "\r\n"
+        if self._file is not None:
+            self._file.write(message)
+        self.nbytes += len(message)
+
+    def result(self):
+        '''Returns the data recorded so far.'''
+        if self._file is not None:
+            self._file.flush()
+        if not os.path.exists(self.filename()):
+            return ''
+        f = open(self.filename(), 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def remove(self):
+        '''Removes the file of the data.'''
+        self.close()
+        if os.path.exists(self.filename()):
+            os.remove(self.filename())
+
+
+class JobQueue(object):
+    '''The queue of scan jobs.'''
+
+    def __init__(self):
+        self.jobs = []
+        self.current = None
+        self.modeobj = None
+        self.held = False
+        # Scan started by SCAN or RESUME, see scanStarted
+        self.direct = None
+        self.writeResponse = None
+        self._nextId = 1
+
+    def attach(self, writeResponse):
+        '''Streams data and status lines to writeResponse (of the
+        connected client).'''
+        self.writeResponse = writeResponse
+
+    def detach(self):
+        self.writeResponse = None
+
+    def add(self, mode, settings):
+        '''Adds a job and starts it if the queue is idle and not held.
+        Returns the job.'''
+        job = Job(self._nextId, mode, settings)
+        self._nextId += 1
+        self.jobs.append(job)
+        self._report(job)
+        self._next()
+        return job
+
+    def get(self, jobid):
+        for job in self.jobs:
+            if job.jobid == jobid:
+                return job
+        return None
+
+    def isRunning(self, modeobj = None):
+        '''Whether a job is running (with modeobj, if given).'''
+        return self.current is not None and (
+            modeobj is None or modeobj is self.modeobj)
+
+    def isBusy(self):
+        '''Whether a scan is running on the hardware, a job or a scan
+        started by SCAN or RESUME.'''
+        return self.current is not None or self.direct is not None
+
+    def scanStarted(self, modeobj):
+        '''Notes a scan started by SCAN or RESUME, so that no job is
+        started until it has finished. Only the end of queueable modes is
+        known, the others are not noted.'''
+        if not getattr(modeobj, 'queueable', False):
+            return
+        self.direct = modeobj
+        modeobj.whenFinished().addBoth(self._directFinished, modeobj)
+
+    def scanAborted(self, modeobj):
+        '''Forgets a scan noted by scanStarted that could not be
+        started.'''
+        self._directFinished(None, modeobj)
+
+    def _directFinished(self, result, modeobj):
+        if self.direct is modeobj:
+            self.direct = None
+        self._next()
+
+    def clear(self):
+        '''Removes all jobs but the running one.'''
+        for job in self.jobs:
+            if job is not self.current:
+                job.remove()
+        self.jobs = [job for job in self.jobs if job is self.current]
+
+    def stop(self):
+        '''Stops the running job and holds the queue.'''
+        self.held = True
+        if self.modeobj is not None:
+            self.modeobj.setStop()
+
+    def start(self):
+        '''Starts the next waiting job, unless a job is running.'''
+        self.held = False
+        self._next()
+
+    def _next(self):
+        if self.held or self.isBusy():
+            return
+        for job in self.jobs:
+            if job.status == QUEUED:
+                break
+        else:
+            return
+        self.current = job
+        self.modeobj = Helpers.getScanmodeObject(job.mode)()
+        job.open()
+        job.status = RUNNING
+        self._report(job)
+        d = self.modeobj.whenFinished()
+        d.addCallbacks(self._finished, self._failed,
+                       callbackArgs = (job,), errbackArgs = (job,))
+        try:
+            self.modeobj.scan(copy.deepcopy(job.settings),
+                              lambda message, newline = True:
+                              self._write(job, message, newline))
+        except Exception as e:
+            self.modeobj.notifyFailed(e)
+
+    def _write(self, job, message, newline = True):
+        job.record(message, newline)
+        if self.writeResponse is not None:
+            self.writeResponse(message, newline)
+
+    def _finished(self, completed, job):
+        job.status = DONE if completed else STOPPED
+        self._done(job)
+
+    def _failed(self, error, job):
+        print "Job " + str(job.jobid) + " failed: " + str(error)
+        job.status = FAILED
+        self._done(job)
+
+    def _done(self, job):
+        job.close()
+        self.current = None
+        self.modeobj = None
+        self._report(job)
+        self._next()
+
+    def _report(self, job):
+        print "Job " + str(job.jobid) + " (" + job.mode + "): " + job.status
+        if self.writeResponse is not None:
+            self.writeResponse('JOB ' + json.dumps(job.info()))
+
+
+def getQueue():
+    '''Returns the job queue of the server, which is created at the first
+    call.'''
+    global QUEUE
+    if QUEUE is None:
+        QUEUE = JobQueue()
+    return QUEUE
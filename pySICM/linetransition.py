@@ -0,0 +1,139 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''pySICM.linetransition plans the moves of hopping scans between pixels
+which are not adjacent, e.g. the fly back to the start of the next line
+of a line by line scan.
+
+Instead of retracting above the highest point of the last line, the
+pipette follows the predicted surface. The profile of a line is
+predicted from
+
+  - the heights measured on the line itself,
+  - the previous lines: the neighbouring line, raised by its rise with
+    respect to the line before (at most by the margin), and
+  - the prescan, if there is one, interpolated to the scan resolution.
+
+The prediction is widened by one pixel to each side. The move is split
+into segments (the y-move at the old x-position, then the x-move along
+the new line in pieces of a few pixels); each is done at the highest
+predicted point of the segment plus a margin. As neighbouring segments
+share their border pixel, the pipette may change its height at the
+border.'''
+
+import numpy as np
+import pySICM.backsteps as Backsteps
+
+TOP = 1e5
+
+
+class LinePlanner(object):
+    '''Plans line transitions.
+
+    Params:
+    =======
+    xpx, ypx: Number of pixels of the scan
+    margin: Distance in nm kept above the predicted surface
+    prescan: Heights of a prescan in nm, indexed [x, y] (optional)
+    segment: Length of the segments of the x-move in pixels, defaults
+        to 1/16 of the line
+    '''
+
+    def __init__(self, xpx, ypx, margin, prescan = None, segment = None):
+        self.xpx = xpx
+        self.ypx = ypx
+        self.margin = margin
+        self.heights = np.empty((xpx, ypx))
+        self.heights.fill(np.nan)
+        self.prescan = None
+        if prescan is not None:
+            self.prescan = Backsteps.interpolate(prescan, xpx, ypx)
+        self.segment = segment or max(1, xpx // 16)
+
+    def record(self, pixel, height):
+        self.heights[pixel] = height
+
+    def top(self):
+        '''The highest point known, or None.'''
+        known = [h for h in (self.heights, self.prescan)
+                 if h is not None and not np.isnan(h).all()]
+        if not known:
+            return None
+        return max(np.nanmax(h) for h in known)
+
+    def safeTop(self):
+        '''Height above everything known.'''
+        return self._safe(self.top())
+
+    def _safe(self, h):
+        if h is None or np.isnan(h):
+            return TOP
+        return min(h + self.margin, TOP)
+
+    def _row(self, y):
+        if 0 <= y < self.ypx:
+            return self.heights[:, y]
+        return np.empty(self.xpx) * np.nan
+
+    def profile(self, y):
+        '''Predicted heights of line y (nan where nothing is known).'''
+        p = self.heights[:, y].copy()
+        for d in (-1, 1):
+            near, far = self._row(y + d), self._row(y + 2*d)
+            # Where the surface rises towards line y, it may continue to,
+            # by at most the margin, so that a single outlier does not
+            # grow from line to line
+            rise = np.where(np.isnan(far), 0,
+                            np.clip(near - far, 0, self.margin))
+            p = np.fmax(p, near + rise)
+        if self.prescan is not None:
+            p = np.fmax(p, self.prescan[:, y])
+        # Widened by one pixel
+        w = p.copy()
+        w[1:] = np.fmax(w[1:], p[:-1])
+        w[:-1] = np.fmax(w[:-1], p[1:])
+        return w
+
+    def _height(self, heights):
+        '''Safe height above heights; unknown heights are assumed to be
+        as high as the highest point known.'''
+        if np.isnan(heights).any():
+            return self.safeTop()
+        return self._safe(np.max(heights))
+
+    def path(self, previous, pixel):
+        '''Returns the path from previous to pixel as list of moves
+        (axis, position in pixels, height in nm): the pipette is brought
+        to the height, then moved along axis ('x' or 'y') to the
+        position.'''
+        x0, y0 = previous
+        x1, y1 = pixel
+        moves = []
+        if y1 != y0:
+            ys = range(min(y0, y1), max(y0, y1) + 1)
+            column = [self.profile(y)[x0] for y in ys]
+            moves.append(('y', y1, self._height(np.array(column))))
+        if x1 != x0:
+            p = self.profile(y1)
+            step = self.segment if x1 > x0 else -self.segment
+            x = x0
+            while x != x1:
+                end = x + step
+                if (step > 0 and end > x1) or (step < 0 and end < x1):
+                    end = x1
+                moves.append(('x', end,
+                              self._height(p[min(x, end):max(x, end) + 1])))
+                x = end
+        return moves
@@ -17,13 +17,17 @@
 "Simple classes for controling a single piezo"
 
 import numpy
-import pycomedi.channel as pyChan
-import pycomedi.constant as CONSTANTS
-import pycomedi.utility as Util
+from pySICM.comedi import channel as pyChan, constant as CONSTANTS, \
+    utility as Util
+import os
 import sys
+import threading
 import time
 from twisted.internet import defer, reactor
+from twisted.python.threadable import isInIOThread
 import pySICM.converter as Converter
+import pySICM.recorder as Recorder
+import pySICM.ramps as Ramps
 
 class PiezoConfig(object):
     '''Class for configuring a single piezo device.
@@ -193,7 +197,155 @@ class PiezoConfig(object):
     
     
 
+class RampFeeder(threading.Thread):
+    '''Writes the samples of a running timed AO command that did not fit
+    into the buffer of the board. Samples are written in chunks of a
+    quarter of the buffer whenever that much space is free, so that the
+    blocks written (and recorded) do not depend on timing.
+
+    Params:
+    =======
+    piezo: The PiezoControl whose command is fed
+    samples: The remaining samples (uint16)
+    '''
+
+    def __init__(self, piezo, samples):
+        super(RampFeeder, self).__init__(name = 'RampFeeder')
+        self.daemon = True
+        self.piezo = piezo
+        self.samples = samples
+        # Number of samples written
+        self.pos = 0
+        self._stop = threading.Event()
+
+    def run(self):
+        ao = self.piezo._ao
+        itemsize = numpy.dtype(numpy.uint16).itemsize
+        chunk = max(1, ao.get_buffer_size() // (4 * itemsize))
+        period = ao.cmd.scan_begin_arg * 1e-9
+        while self.pos < len(self.samples) and not self._stop.is_set():
+            n = min(chunk, len(self.samples) - self.pos)
+            free = (ao.get_buffer_size() - ao.get_buffer_contents()) // itemsize
+            if free < n:
+                # Wait until about half of the missing space is free
+                self._stop.wait(max((n - free) * period / 2, 1e-4))
+                continue
+            self.piezo.write_samples(self.samples[self.pos:self.pos + n])
+            self.pos += n
+
+    def stop(self):
+        self._stop.set()
+        if self.is_alive() and self is not threading.current_thread():
+            self.join()
+
+
+class SettleModel(object):
+    '''Step response of a piezo axis as seen by its position sensor. After
+    a dead time, the sensor follows a step like a first order lag; large
+    steps additionally take longer due to the limited slew rate of the
+    amplifier. The time needed to cover a fraction of a step is
+
+      delay + tau * ln(1 / (1 - fraction)) + step / rate
+
+    Params:
+    =======
+    delay: Dead time in seconds
+    tau: Time constant in seconds
+    rate: Slew rate in sensor bits per second (numpy.inf if not limiting)
+    noise: Standard deviation of a single sensor reading in bits
+    '''
+
+    # A step is never completed, its end drowns in the sensor noise
+    MAXFRACTION = 0.9999
+    # Shortest time constant which is fitted
+    MINTAU = 1e-5
+
+    def __init__(self, delay = 5e-4, tau = 1e-3, rate = numpy.inf,
+                 noise = 1.0):
+        self.delay = float(delay)
+        self.tau = float(tau)
+        self.rate = float(rate)
+        self.noise = float(noise)
+
+    def _lag(self, fraction):
+        fraction = min(abs(fraction), self.MAXFRACTION)
+        return numpy.log(1.0 / (1.0 - fraction))
+
+    def settle_time(self, step, fraction):
+        '''Predicted time (in seconds) until the sensor has covered the
+        given fraction of a step of step bits.'''
+        return (self.delay + self.tau * self._lag(fraction) +
+                abs(step) / self.rate)
+
+    def learn(self, step, fraction, observed):
+        '''Adapts the time constant to a settle time that exceeded the
+        prediction. Half of the missing time is added, so that single
+        outliers (e.g. a delayed thread) do not spoil the model.'''
+        missing = observed - self.settle_time(step, fraction)
+        if missing > 0:
+            self.tau += 0.5 * missing / self._lag(fraction)
+
+    def to_array(self):
+        return numpy.array([self.delay, self.tau, self.rate, self.noise])
+
+    @classmethod
+    def from_array(cls, a):
+        return cls(*a[:4])
+
+    @staticmethod
+    def crossing(t, response, level):
+        '''Time at which the normalised step response first reaches
+        level, or None.'''
+        idx = numpy.nonzero(response >= level)[0]
+        if len(idx) == 0:
+            return None
+        return t[idx[0]]
+
+    @classmethod
+    def fit(cls, small, large, noise):
+        '''Fits the model to two measured step responses. small and large
+        are tuples (step, t, response) of steps of different size, see
+        PiezoControl._step_response. The dead time and the time constant
+        are taken from the small step, the slew rate from the difference
+        of the 90% times of both steps.'''
+        step, t, response = small
+        delay = cls.crossing(t, response, 0.05)
+        t63 = cls.crossing(t, response, 1 - numpy.exp(-1))
+        if delay is None or t63 is None:
+            return cls(noise = noise)
+        model = cls(delay, max(t63 - delay, cls.MINTAU), numpy.inf, noise)
+        t90 = cls.crossing(t, response, 0.9)
+        step2, t2, response2 = large
+        t90_2 = cls.crossing(t2, response2, 0.9)
+        if t90 is not None and t90_2 is not None:
+            # Time differences below the sampling interval are not
+            # meaningful
+            dt = t90_2 - t90 - 2 * (t2[1] - t2[0])
+            if dt > 0:
+                model.rate = (abs(step2) - abs(step)) / dt
+        return model
+
+    def __str__(self):
+        return ("dead time " + str(self.delay) + " s, time constant " +
+                str(self.tau) + " s, slew rate " + str(self.rate) +
+                " bits/s, noise " + str(self.noise) + " bits")
+
+
 class PiezoControl(object):
+
+    CALIBRATIONDIR = '/var/pySICM/calibration/'
+    # Time (in seconds) allowed for a ramp or a wait for the sensor in
+    # addition to its expected duration
+    TIMEOUTMARGIN = 1.0
+    # Interval (in seconds) at which the sensor is read while waiting
+    WAITINTERVAL = 1e-3
+    # Number of sensor reads averaged when waiting for a position
+    FILTERREADS = 10
+    # Step response measurement: Samples per read, maximum number of
+    # reads after the step, and the steps as fractions of the range
+    STEPREADS = 1000
+    STEPBLOCKS = 50
+    STEPSIZES = (0.01, 0.25)
     
     def __init__(self, config, ao, ai, reactor):
         self._ao = ao
@@ -232,12 +384,16 @@ class PiezoControl(object):
                                             aref=CONSTANTS.AREF.ground,
                                             range=best_range)
         self._ai_range = best_range
+        self._ao_channel = Recorder.wrap(self._ao_channel)
+        self._ai_channel = Recorder.wrap(self._ai_channel)
         self._ao_converter = self._ao_channel.get_converter()
         self._ai_converter = self._ai_channel.get_converter()
         self._ao_ramp_cmd = None
         self._ao_ramp_data = None
+        self._feeder = None
         self.is_running = 0
         self.calibrate()
+        self.calibrate_settle()
         self.converter = Converter.NumberConverter(self._config._cvoltrange,
                                                    self._config._voltrange,
                                                    self._config._distance,
@@ -275,11 +431,15 @@ class PiezoControl(object):
             c = c + 1
         print "Done."
 
+    def _calibration_filename(self, extension):
+        return os.path.join(
+            self.CALIBRATIONDIR,
+            str(self._config._distance)+'-'+str(self._config._ai_channel)
+            +'-'+str(self._config._ao_channel)+extension)
+
     def calibrate(self):
         # Loads the calibration for the piezo, if available, otherwise calls _calibrate
-        config_filename = ('/var/pySICM/calibration/'
-                           +str(self._config._distance)+'-'+str(self._config._ai_channel)
-                           +'-'+str(self._config._ao_channel)+'.calib')
+        config_filename = self._calibration_filename('.calib')
         try:
             calib = numpy.fromfile(config_filename, dtype = numpy.uint16)
             self.calibration = calib.reshape(len(calib)/2,2)
@@ -292,10 +452,68 @@ class PiezoControl(object):
             except IOError:
                 sys.exit('Cannot save calibration file. '+
                          'Ensure that the directory '+
-                         '/var/pySICM/calibration/ '+
-                         'is writable.')
+                         self.CALIBRATIONDIR+
+                         ' is writable.')
         self.fit_calibration()
 
+    def _step_response(self, start, target):
+        '''Steps the output from start to target (bits) and reads the
+        sensor until it has settled. Returns the step in sensor bits,
+        the times of the samples (seconds after the step), the response
+        normalised to the step, and the noise of the settled sensor.'''
+        n = self.STEPREADS
+        self.set_bit(start)
+        time.sleep(.05)
+        before = numpy.mean(self._ai_channel.data_read_n(n))
+        t0 = Recorder.now()
+        self._ao_channel.data_write(target)
+        blocks = [self._ai_channel.data_read_n(n).astype(numpy.float64)]
+        for i in range(self.STEPBLOCKS):
+            blocks.append(
+                self._ai_channel.data_read_n(n).astype(numpy.float64))
+            # Settled if the mean does not change by more than its noise
+            if (abs(numpy.mean(blocks[-1]) - numpy.mean(blocks[-2])) <=
+                3 * numpy.std(blocks[-1]) / numpy.sqrt(n)):
+                break
+        t1 = Recorder.now()
+        data = numpy.concatenate(blocks)
+        step = numpy.mean(blocks[-1]) - before
+        if step == 0:
+            step = 1.0
+        t = numpy.linspace(0, t1 - t0, len(data))
+        return step, t, (data - before) / step, numpy.std(blocks[-1])
+
+    def _calibrate_settle(self):
+        # Measures the step response for a small and a large step around
+        # the centre of the range.
+        print ("Measuring step response of piezo on output channel "+
+               str(self._config._ao_channel)+".")
+        steps = []
+        noise = []
+        for size in self.STEPSIZES:
+            start = int(2**15 * (1 - size))
+            step, t, response, sigma = self._step_response(
+                start, start + int(2**16 * size))
+            steps.append((step, t, response))
+            noise.append(sigma)
+        self.set_bit(2**15)
+        self.settle = SettleModel.fit(steps[0], steps[1], max(noise))
+        print "Step response: " + str(self.settle)
+
+    def calibrate_settle(self):
+        # Loads the step response model, if available, otherwise measures
+        # it
+        filename = self._calibration_filename('.settle')
+        try:
+            self.settle = SettleModel.from_array(
+                numpy.fromfile(filename, dtype = numpy.float64))
+        except:
+            self._calibrate_settle()
+            try:
+                self.settle.to_array().tofile(filename)
+            except IOError:
+                print "Cannot save the step response to " + filename + "."
+
     def current_pos_quick(self):
         return self.converter.getConvertedNumber(
             self._ai_channel.data_read(),
@@ -364,9 +582,15 @@ class PiezoControl(object):
     def set_bit(self, bit, wait = 0):
         self._ao_channel.data_write(bit)
         if wait != 0:
+            timeout = time.time() + self.TIMEOUTMARGIN
             old = self.current_bit(laenge=100)
+            time.sleep(self.WAITINTERVAL)
             new = self.current_bit(laenge=100)
             while abs(old -new) > abs(wait):
+                if time.time() > timeout:
+                    print "Piezo did not settle at "+str(bit)+"."
+                    break
+                time.sleep(self.WAITINTERVAL)
                 old = new
                 new = self.current_bit(laenge=100)
     def set_volt(self, volt, wait = 0):
@@ -382,15 +606,48 @@ class PiezoControl(object):
     # ramps...
 
     def set_pos(self, pos, wait = 0, overshoot = 0):
-
+        '''Writes the position pos. If wait is not 0, returns when the
+        piezo has covered the fraction wait of the move (1: when it has
+        settled), see wait_for_settle.'''
+        if wait != 0:
+            start = numpy.mean(self._ai_channel.data_read_n(self.FILTERREADS))
         self._ao_channel.data_write(
             int(pos.get_oBits()))
         print "written position: " + str(int(pos.get_oBits()))
 #        foo = raw_input('Press Enter!\n')
         if wait != 0:
-            new = numpy.mean(self._ai_channel.data_read_n(10))
-            while wait*float(pos.get_iBits()) - new > 0:
-                new = numpy.mean(self._ai_channel.data_read_n(10))
+            self.wait_for_settle(start, float(pos.get_iBits()), wait)
+
+    def wait_for_settle(self, start, target, fraction):
+        '''Waits until the sensor has covered the given fraction of a move
+        from start to target (sensor bits). Sleeps for the time predicted
+        by the step response model, then confirms with averaged sensor
+        reads. The piezo also counts as settled if two consecutive reads
+        agree within their noise, e.g. if the calibration puts the target
+        slightly off. Gives up TIMEOUTMARGIN after the predicted time.
+        Returns False in that case.'''
+        step = target - start
+        tolerance = 3 * self.settle.noise / numpy.sqrt(self.FILTERREADS) + 1
+        if abs(step) <= tolerance:
+            return True
+        fraction = min(abs(fraction), 1 - tolerance / abs(step))
+        predicted = self.settle.settle_time(step, fraction)
+        t0 = time.time()
+        deadline = t0 + predicted + self.TIMEOUTMARGIN
+        time.sleep(predicted)
+        old = None
+        new = numpy.mean(self._ai_channel.data_read_n(self.FILTERREADS))
+        while ((new - start) / step < fraction and
+               (old is None or abs(new - old) > tolerance)):
+            if time.time() > deadline:
+                print "Piezo did not reach "+str(target)+"."
+                return False
+            time.sleep(self.WAITINTERVAL)
+            old = new
+            new = numpy.mean(self._ai_channel.data_read_n(self.FILTERREADS))
+        if old is not None:
+            self.settle.learn(step, fraction, time.time() - t0)
+        return True
 
     def ramp_to_nm_target(self, target, speed, callback = None, block = False):
         '''Outputs a ramp from the current position to the target position
@@ -432,17 +689,18 @@ class PiezoControl(object):
         t = float(numpy.abs(diff)) / (float(speed) * self._config.output_bits_per_volt())
         self.timed_volts_ramp(start, target, t, callback, block)
         
-    def timed_volts_ramp(self, start, target, tim_e, callback = None, block = False):
-        n = numpy.abs(target - start) + 1
-        if n > 2**15:
-            n = 2**15
-        samples = numpy.linspace(start, target, round(n))
+    def timed_volts_ramp(self, start, target, tim_e, callback = None,
+                         block = False, timeout = None):
+        if target == start:
+            # Nothing to ramp, a zero-length ramp would divide by zero
+            if callback is not None:
+                callback()
+            return
+        self._ramp_data = Ramps.ramp(start, target)
         tim_e = tim_e * 1e-3 # now in seconds
-        upd_freq = float(n) / tim_e
-        self._prepare_command(upd_freq, len(samples))
-        
-        self._ramp_data = numpy.array([int(round(q)) for q in samples], numpy.uint16)
-        self._run_ramp(callback, block)
+        upd_freq = float(len(self._ramp_data)) / tim_e
+        self._prepare_command(upd_freq, len(self._ramp_data))
+        self._run_ramp(callback, block, timeout)
 
     def _prepare_command(self, updfreq, n_samples):
         command = self._ao.get_cmd_generic_timed(1, 1e9/updfreq)
@@ -453,30 +711,98 @@ class PiezoControl(object):
         self._ao.cmd = command
         self._ao.command_test()
 
-    def _run_ramp(self, callback = None, block = False):
+    def write_samples(self, samples):
+        '''Writes samples (uint16) to the buffer of the command running on
+        the analog output subdevice.'''
+        self._ao.device.file.write(samples.tostring())
+        self._ao.device.file.flush()
+        Recorder.record(Recorder.AO_STREAM, self._ao.device,
+                        self._ao_channel.index, samples,
+                        self._ao.cmd.scan_begin_arg * 1e-9)
+
+    def load_ramp(self, samples):
+        '''Writes samples (uint16) for the prepared AO command. As many as
+        fit are written to the buffer of the board, the remaining ones
+        are written by a RampFeeder once the command has been started by
+        trigger_ramp.'''
+        self.stop_feeder()
+        n = self._ao.get_buffer_size() // numpy.dtype(numpy.uint16).itemsize
+        self.write_samples(samples[:n])
+        if len(samples) > n:
+            self._feeder = RampFeeder(self, samples[n:])
+
+    def trigger_ramp(self):
+        '''Starts the AO command loaded by load_ramp.'''
+        self._ao.device.do_insn(Util.inttrig_insn(self._ao))
+        if self._feeder is not None:
+            self._feeder.start()
+
+    def stop_feeder(self):
+        if self._feeder is not None:
+            self._feeder.stop()
+            self._feeder = None
+
+    def is_feeding(self):
+        return self._feeder is not None and self._feeder.is_alive()
+
+    def _run_ramp(self, callback = None, block = False, timeout = None):
+        '''Runs the loaded ramp. If block is True or a callback is given,
+        waits until the ramp has been output (see _wait_for_ramp) and
+        calls the callback. When called in the reactor thread with a
+        callback, the reactor is not blocked: the end of the ramp is
+        awaited by delayed calls and the callback is fired from the
+        reactor.'''
         if self._ao.get_flags().busy:
             print "Cannot run ramp, device is busy."
             self._ao.cancel()
             print "Canceled the command."
 
-        b_size = self._ao.get_buffer_size()
-
         self._ao.command()
-        self._ramp_data.tofile(self._ao.device.file)
-        self._ao.device.file.flush()
-        self._ao.device.do_insn(Util.inttrig_insn(self._ao))
-        if callback is not None or block is True:
-            c = 0
-            while self._ao.get_buffer_contents() > 0:
-#                c+=1
-                time.sleep(0)
-#                if (c > 10000):
-#                    print 
-#                    c = 0
-            self._ao.cancel()
-            if callback is not None:
-                print "Calling "+str(callback)+"."
-                callback()
+        self.load_ramp(self._ramp_data)
+        self.trigger_ramp()
+        if timeout is None:
+            timeout = (len(self._ramp_data) * self._ao.cmd.scan_begin_arg *
+                       1e-9 + self.TIMEOUTMARGIN)
+        deadline = time.time() + timeout
+        if callback is not None and not block and isInIOThread():
+            self.reactor.callLater(self._ramp_remaining(),
+                                   self._check_ramp, callback, deadline)
+        elif callback is not None or block is True:
+            while not self._ramp_done(deadline):
+                time.sleep(self._ramp_remaining())
+            self._finish_ramp(callback)
+
+    def _ramp_remaining(self):
+        '''Expected time (in seconds) until the ramp has been output. The
+        result is bounded, so that the ramp is checked at least every
+        50 ms; this also lets a replay, whose clock runs faster, go on
+        quickly.'''
+        n = self._ao.get_buffer_contents() // numpy.dtype(numpy.uint16).itemsize
+        if self.is_feeding():
+            n += len(self._feeder.samples) - self._feeder.pos
+        return min(max(n * self._ao.cmd.scan_begin_arg * 1e-9, 1e-4), 0.05)
+
+    def _ramp_done(self, deadline):
+        if not self.is_feeding() and self._ao.get_buffer_contents() <= 0:
+            return True
+        if time.time() > deadline:
+            print "Ramp did not finish in time, cancelling it."
+            return True
+        return False
+
+    def _check_ramp(self, callback, deadline):
+        if self._ramp_done(deadline):
+            self._finish_ramp(callback)
+        else:
+            self.reactor.callLater(self._ramp_remaining(),
+                                   self._check_ramp, callback, deadline)
+
+    def _finish_ramp(self, callback):
+        self.stop_feeder()
+        self._ao.cancel()
+        if callback is not None:
+            print "Calling "+str(callback)+"."
+            callback()
 
 
 
@@ -881,6 +1207,7 @@ class ZPiezoControl (PiezoControl):
 
     def stop(self):
         print "Cancelling"
+        self.stop_feeder()
         self._ao.cancel()
         self.isRunning=0
         n = self._ao.get_buffer_contents()
@@ -1,7 +1,6 @@
 import numpy
-import pycomedi.channel as pyChan
-import pycomedi.constant as CONSTANTS
-import pycomedi.utility as Util
+from pySICM.comedi import channel as pyChan, constant as CONSTANTS, \
+    utility as Util
 import sys
 import time
 from twisted.internet import defer, reactor
@@ -0,0 +1,175 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''pySICM.quadtree plans the pixels of adaptive resolution scans.
+
+The image of xpx times ypx pixels is first sampled on a coarse lattice,
+whose points are span pixels apart. Neighbouring lattice points are the
+corners of the cells of level 0. A cell is refined by measuring the
+midpoints of its edges and its centre, which splits it into four cells of
+the next level, until the cells are one pixel wide.
+
+Cells are refined by their roughness: a plane is fitted to the heights
+measured in the cell and its neighbourhood, and the largest residual
+within the cell is its roughness. Flat or tilted areas have no residuals
+and stay at coarse resolution. Rough and large cells are refined first,
+so that a scan which stops early (see pySICM.scanmodes.adaptiveResolution)
+has spent its pixels where they matter most.'''
+
+import heapq
+import numpy as np
+
+
+class Cell(object):
+    '''A rectangular cell whose corners (x0, y0) and (x1, y1) are pixels
+    of the image.'''
+
+    def __init__(self, x0, y0, x1, y1, level):
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
+        self.level = level
+
+    def width(self):
+        return self.x1 - self.x0
+
+    def height(self):
+        return self.y1 - self.y0
+
+    def divisible(self):
+        return self.width() > 1 or self.height() > 1
+
+    def split(self):
+        '''Returns the points which have to be measured to split the cell,
+        sorted by line, and the four (or two) cells of the next level.'''
+        xs = [self.x0, self.x1]
+        ys = [self.y0, self.y1]
+        if self.width() > 1:
+            xs.insert(1, (self.x0 + self.x1) // 2)
+        if self.height() > 1:
+            ys.insert(1, (self.y0 + self.y1) // 2)
+        points = [(x, y) for y in ys for x in xs
+                  if x not in (self.x0, self.x1) or y not in (self.y0, self.y1)]
+        children = [Cell(xs[i], ys[j], xs[i + 1], ys[j + 1], self.level + 1)
+                    for j in xrange(len(ys) - 1) for i in xrange(len(xs) - 1)]
+        return points, children
+
+
+def planeResiduals(x, y, z):
+    '''Fits the plane z = a*x + b*y + c to the points by least squares and
+    returns the residuals.'''
+    A = np.column_stack((x, y, np.ones(len(x))))
+    coeffs = np.linalg.lstsq(A, z, rcond = -1)[0]
+    return z - np.dot(A, coeffs)
+
+
+class Planner(object):
+    '''Plans an adaptive resolution scan.
+
+    Params:
+    =======
+    xpx: Number of pixels in x-direction of the final image
+    ypx: Number of pixels in y-direction of the final image
+    span: Distance in pixels of the points of the coarse lattice
+    '''
+
+    def __init__(self, xpx, ypx, span):
+        self.xpx = int(xpx)
+        self.ypx = int(ypx)
+        self.span = max(int(span), 1)
+        self.heights = np.empty((self.xpx, self.ypx))
+        self.heights.fill(np.nan)
+        self.levels = np.zeros((self.xpx, self.ypx), np.int32)
+        self._queue = []
+
+    def _lattice(self, n):
+        coords = range(0, n, self.span)
+        if coords[-1] != n - 1:
+            coords.append(n - 1)
+        return coords
+
+    def prescan(self):
+        '''Returns the points of the coarse lattice, in the order in which
+        they are scanned (serpentine), and queues the cells of level 0.
+        The cells are rated by roughness once the points are measured, see
+        rate().'''
+        xs = self._lattice(self.xpx)
+        ys = self._lattice(self.ypx)
+        points = []
+        for j, y in enumerate(ys):
+            line = [(x, y) for x in xs]
+            if j % 2:
+                line.reverse()
+            points.extend(line)
+        self._pending = [Cell(xs[i], ys[j], xs[i + 1], ys[j + 1], 0)
+                         for j in xrange(len(ys) - 1)
+                         for i in xrange(len(xs) - 1)]
+        return points
+
+    def plan(self, points, level):
+        '''Marks points as scheduled with level and returns the ones which
+        have not been measured yet.'''
+        new = []
+        for p in points:
+            if np.isnan(self.heights[p]) and p not in new:
+                self.levels[p] = level
+                new.append(p)
+        return new
+
+    def record(self, pixel, height):
+        self.heights[pixel] = height
+
+    def measured(self):
+        return int(np.count_nonzero(~np.isnan(self.heights)))
+
+    def roughness(self, cell):
+        '''Largest plane-fit residual of the heights within cell. The plane
+        is fitted to the heights within the cell enlarged by its size on
+        each side, so that edges between lattice points are noticed.'''
+        w = max(cell.width(), 1)
+        h = max(cell.height(), 1)
+        x0, x1 = max(cell.x0 - w, 0), min(cell.x1 + w, self.xpx - 1)
+        y0, y1 = max(cell.y0 - h, 0), min(cell.y1 + h, self.ypx - 1)
+        z = self.heights[x0:x1 + 1, y0:y1 + 1]
+        xi, yi = np.nonzero(~np.isnan(z))
+        if len(xi) < 4:
+            return 0.0
+        res = planeResiduals(xi + x0, yi + y0, z[xi, yi])
+        inside = ((xi + x0 >= cell.x0) & (xi + x0 <= cell.x1) &
+                  (yi + y0 >= cell.y0) & (yi + y0 <= cell.y1))
+        if not inside.any():
+            return 0.0
+        return float(np.max(np.abs(res[inside])))
+
+    def rate(self, cells = None):
+        '''Queues cells (by default the cells of level 0) by roughness.'''
+        if cells is None:
+            cells, self._pending = self._pending, []
+        for cell in cells:
+            if cell.divisible():
+                r = self.roughness(cell)
+                size = max(cell.width(), cell.height())
+                heapq.heappush(self._queue, (-r * size, -r, cell.level,
+                                             cell.x0, cell.y0, cell))
+
+    def next(self, threshold):
+        '''Removes the cell which is refined next from the queue and
+        returns it, or None if no cell is rougher than threshold.'''
+        while self._queue:
+            item = heapq.heappop(self._queue)
+            if -item[1] > threshold:
+                return item[-1]
+        return None
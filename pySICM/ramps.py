@@ -0,0 +1,68 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''pySICM.ramps provides the uint16 waveforms of AO ramps.
+
+Ramps that move by one bit per sample (all ramps of the piezos) are
+returned as views into two precomputed arrays with all 2**16 values in
+increasing and decreasing order, so getting such a ramp neither
+allocates nor loops. Ramps with other step sizes are computed by numpy
+and kept in a small LRU cache keyed by (start, end, step).
+
+The returned arrays are shared and therefore read-only.'''
+
+import collections, threading
+import numpy as np
+
+MAXCACHED = 32
+
+_UP = np.arange(2**16, dtype = np.uint16)
+_UP.flags.writeable = False
+_DOWN = _UP[::-1].copy()
+_DOWN.flags.writeable = False
+
+_cache = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def ramp(start, end, step = 1):
+    '''Returns the samples start, start +/- step, ... up to end. The sign
+    of step is taken from the direction of the ramp. end is always the
+    last sample, even if end - start is not a multiple of step. start
+    and end are clipped to the range of uint16.'''
+    start = min(max(int(start), 0), _UP.size - 1)
+    end = min(max(int(end), 0), _UP.size - 1)
+    step = abs(int(step))
+    if step == 1:
+        if end >= start:
+            return _UP[start:end + 1]
+        return _DOWN[_DOWN.size - 1 - start:_DOWN.size - end]
+    key = (start, end, step)
+    with _lock:
+        if key in _cache:
+            r = _cache.pop(key)
+            _cache[key] = r
+            return r
+    if end < start:
+        step = -step
+    r = np.arange(start, end, step, dtype = np.uint16)
+    if len(r) == 0 or r[-1] != end:
+        r = np.append(r, np.uint16(end))
+    r.flags.writeable = False
+    with _lock:
+        _cache[key] = r
+        while len(_cache) > MAXCACHED:
+            _cache.popitem(last = False)
+    return r
@@ -0,0 +1,258 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''pySICM.recorder records the raw data exchanged with the DAQ boards.
+
+Recording is enabled by the option recordfile in the [pySICM] section of
+setup.ini. The file name is passed through time.strftime, so that e.g.
+/var/pySICM/records/%Y%m%d-%H%M%S.rec creates a new log for each start of
+the server.
+
+The log is a binary file. It starts with a header (magic string, format
+version, wall clock time of the start of the recording), followed by
+records of the form
+
+  kind (uint8), device (uint8), channel (uint16), time (float64),
+  period (float64), n (uint32), n samples (uint16)
+
+time is given in seconds since the start of the recording and is taken
+after the data has been read or written. period is the sample period of
+timed (streamed) data and 0 otherwise. All numbers are little endian.
+
+To keep the overhead low for code that reads single samples in a loop,
+records are queued in memory and written by a background thread.
+Consecutive reads of the same channel (same kind, device and period) are
+merged into one record, whose time is the one of the last read. Writes
+to the analog outputs are never merged, a replay compares them block by
+block.
+
+Time measurements which influence the course of a scan (e.g. the read
+frequency of the ion current) have to use now() instead of time.time().
+The readings are recorded as CLOCK records (device 255, the float64
+reading stored in four samples) and returned again during a replay.
+
+A log can be replayed by a device of type replay, see pySICM.simulation.'''
+
+import atexit, collections, struct, threading, time
+import numpy as np
+
+MAGIC = 'PYSICMLG'
+VERSION = 1
+
+AI = 1
+AO = 2
+AI_STREAM = 3
+AO_STREAM = 4
+CLOCK = 5
+
+NODEVICE = 255
+
+# Kinds of records that are merged if they follow each other
+_MERGED = (AI, AI_STREAM)
+# Maximum number of samples in a merged record
+MAXMERGE = 2**16
+# Interval in seconds at which queued records are written
+FLUSHINTERVAL = 0.2
+
+_HEADER = struct.Struct('<8sBd')
+_RECORD = struct.Struct('<BBHddI')
+
+RECORDER = None
+# Callable returning recorded clock readings, set by a replay
+CLOCKSOURCE = None
+
+
+class Recorder(object):
+    '''Writes records to a log file. Thread safe: record() only appends
+    to a queue (deque.append is atomic), the records are merged and
+    written by a background thread.
+
+    Params:
+    =======
+    filename: Name of the log file
+    devices: List of the devices of the setup. The position of a device in
+        this list is used as device number in the log.
+    '''
+
+    def __init__(self, filename, devices):
+        self.filename = filename
+        self._devices = list(devices)
+        self._lock = threading.Lock()
+        self._queue = collections.deque()
+        self._file = open(filename, 'wb')
+        self._start = time.time()
+        self._file.write(_HEADER.pack(MAGIC, VERSION, self._start))
+        self._closing = threading.Event()
+        self._writer = threading.Thread(target = self._run)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def deviceNumber(self, device):
+        for i, dev in enumerate(self._devices):
+            if dev is device:
+                return i
+        return NODEVICE
+
+    def record(self, kind, device, channel, data, period = 0.0):
+        '''Queues a record. The data is converted when it is written.'''
+        self._queue.append((kind, device, channel, time.time() - self._start,
+                            period, data))
+
+    def _run(self):
+        while not self._closing.wait(FLUSHINTERVAL):
+            self.flush()
+
+    def flush(self):
+        '''Writes all queued records.'''
+        with self._lock:
+            if self._file is None:
+                return
+            pending = None
+            while self._queue:
+                kind, device, channel, t, period, data = (
+                    self._queue.popleft())
+                key = (kind, device, channel, period)
+                if (pending is not None and pending[0] == key and
+                    kind in _MERGED and pending[2] < MAXMERGE):
+                    pending[1] = t
+                    pending[2] += np.size(data)
+                    pending[3].append(data)
+                    continue
+                if pending is not None:
+                    self._write(*pending)
+                pending = [key, t, np.size(data), [data]]
+            if pending is not None:
+                self._write(*pending)
+            self._file.flush()
+
+    def _write(self, key, t, n, blocks):
+        kind, device, channel, period = key
+        if len(blocks) == 1:
+            data = np.atleast_1d(blocks[0])
+        elif all(np.ndim(b) == 0 for b in blocks):
+            data = np.array(blocks)
+        else:
+            data = np.concatenate([np.atleast_1d(b) for b in blocks])
+        data = np.ascontiguousarray(data, '<u2')
+        self._file.write(_RECORD.pack(
+            kind, self.deviceNumber(device), channel, t, period, len(data)))
+        self._file.write(data.tostring())
+
+    def close(self):
+        self._closing.set()
+        if self._writer.is_alive() and (
+            self._writer is not threading.current_thread()):
+            self._writer.join()
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class RecordingChannel(object):
+    '''Wraps an analog channel and records all data read from and written
+    to it. All other attributes are those of the wrapped channel.'''
+
+    def __init__(self, channel, recorder):
+        self.__dict__['_channel'] = channel
+        self.__dict__['_recorder'] = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._channel, name, value)
+
+    def _device(self):
+        return self._channel.subdevice.device
+
+    def data_read(self):
+        data = self._channel.data_read()
+        self._recorder.record(AI, self._device(), self._channel.index, data)
+        return data
+
+    def data_read_n(self, n):
+        data = self._channel.data_read_n(n)
+        self._recorder.record(AI, self._device(), self._channel.index, data)
+        return data
+
+    def data_write(self, data):
+        ret = self._channel.data_write(data)
+        self._recorder.record(AO, self._device(), self._channel.index, data)
+        return ret
+
+
+def start(filename, devices):
+    '''Starts recording to filename (passed through time.strftime).'''
+    global RECORDER
+    stop()
+    RECORDER = Recorder(time.strftime(filename), devices)
+    print "Recording DAQ data to " + RECORDER.filename
+    return RECORDER
+
+def stop():
+    global RECORDER
+    if RECORDER is not None:
+        RECORDER.close()
+        RECORDER = None
+
+atexit.register(stop)
+
+def wrap(channel):
+    '''Returns channel wrapped in a RecordingChannel if recording is
+    active, channel itself otherwise.'''
+    if RECORDER is None or channel is None:
+        return channel
+    return RecordingChannel(channel, RECORDER)
+
+def record(kind, device, channel, data, period = 0.0):
+    '''Records data if recording is active. Used for data which does not
+    pass a channel, i.e. data written to or read from the device file.'''
+    if RECORDER is not None:
+        RECORDER.record(kind, device, channel, data, period)
+
+def now():
+    '''Returns the wall clock time, which is recorded if recording is
+    active. During a replay, the recorded readings are returned.'''
+    if CLOCKSOURCE is not None:
+        return CLOCKSOURCE()
+    t = time.time()
+    record(CLOCK, None, 0, np.array([t], '<f8').view('<u2'))
+    return t
+
+def readLog(filename):
+    '''Generator yielding the records of a log as tuples
+    (kind, device, channel, time, period, data).'''
+    f = open(filename, 'rb')
+    try:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise IOError(filename + ' is not a pySICM log.')
+        magic, version, start = _HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise IOError(filename + ' is not a pySICM log of version ' +
+                          str(VERSION) + '.')
+        while True:
+            head = f.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                break
+            kind, device, channel, t, period, n = _RECORD.unpack(head)
+            data = np.frombuffer(f.read(2 * n), '<u2').astype(np.uint16)
+            if len(data) < n:
+                break
+            yield kind, device, channel, t, period, data
+    finally:
+        f.close()
@@ -0,0 +1,131 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''pySICM.scanengine drives hopping scans.
+
+A ScanEngine visits the pixels of a pixel order (see pySICM.scanorder)
+and leaves the hardware specific work to a strategy, usually the scan
+mode itself (see PixelStrategy). For each pixel, it
+
+  - moves to the pixel (strategy.moveToPixel),
+  - measures it (strategy.measurePixel),
+  - hands the encoded result to the reactor for transmission
+    (strategy.encodePixel, HardwareWorker.deliver) and
+  - leaves the pixel (strategy.leavePixel), e.g. by retracting.
+
+The engine runs in the hardware worker (pySICM.worker). Results are
+transmitted by the reactor thread while the worker already retracts and
+moves on to the next pixel, so the lateral move is pipelined with the
+transmission.'''
+
+import itertools
+from twisted.internet import defer
+import pySICM.worker as Worker
+
+
+class PixelStrategy(object):
+    '''Interface of the strategies used by ScanEngine. A pixel is a tuple
+    (x, y), see pySICM.scanorder. All methods are called in the worker
+    thread.'''
+
+    def stopRequested(self):
+        '''Returns True if the scan has to stop before the next pixel.'''
+        return getattr(self, 'stop', False)
+
+    def moveToPixel(self, pixel, previous):
+        '''Moves to pixel. previous is the pixel measured before, or None
+        for the first pixel of the scan.'''
+        raise NotImplementedError()
+
+    def measurePixel(self, pixel):
+        '''Measures pixel and returns the result.'''
+        raise NotImplementedError()
+
+    def encodePixel(self, pixel, result):
+        '''Returns the data transmitted to the client for the result of
+        pixel, or None if nothing is transmitted.'''
+        return None
+
+    def leavePixel(self, pixel, result, nextPixel):
+        '''Called after the result of pixel has been handed over for
+        transmission, before moving to nextPixel (None after the last
+        pixel). Knowing nextPixel, the strategy can adapt the retraction
+        to the direction of the following move.'''
+        pass
+
+
+class ScanEngine(object):
+    '''Scans the pixels of order with strategy.
+
+    Params:
+    =======
+    order: Iterable of pixels (x, y), see pySICM.scanorder
+    strategy: A PixelStrategy
+    writeResponse: Callable transmitting the encoded results. It is called
+        in the reactor thread.
+    worker: The HardwareWorker, defaults to pySICM.worker.getWorker()
+    skip: Number of pixels at the start of order which are skipped, e.g.
+        when a scan is resumed (see pySICM.checkpoint)
+    '''
+
+    def __init__(self, order, strategy, writeResponse, worker = None,
+                 skip = 0):
+        self.order = order
+        self.strategy = strategy
+        self.writeResponse = writeResponse
+        self.worker = worker or Worker.getWorker()
+        self.skip = skip
+        self.pixel = None
+        # Number of pixels of order whose results have been handed over,
+        # including the skipped ones
+        self.done = skip
+
+    def run(self):
+        '''Scans all pixels and blocks until done. Has to be called in the
+        worker thread. Returns False if the scan has been stopped, True
+        otherwise.'''
+        previous = None
+        pixels = itertools.islice(self.order, self.skip, None)
+        pixel = next(pixels, None)
+        while pixel is not None:
+            if self.strategy.stopRequested():
+                return False
+            self.pixel = pixel
+            nextPixel = next(pixels, None)
+            self.strategy.moveToPixel(pixel, previous)
+            result = self.strategy.measurePixel(pixel)
+            data = self.strategy.encodePixel(pixel, result)
+            if data is not None:
+                self.worker.deliver(self.writeResponse, data)
+            self.done += 1
+            self.strategy.leavePixel(pixel, result, nextPixel)
+            previous = pixel
+            pixel = nextPixel
+        return True
+
+    def start(self, before = None):
+        '''Submits the scan to the worker. before (optional) is called in
+        the worker thread before the first pixel. Returns a Deferred which
+        is fired with the result of run().'''
+        d = defer.Deferred()
+        if before is None:
+            self.worker.submit(d, self.run)
+        else:
+            self.worker.submit(d, self._runAfter, before)
+        return d
+
+    def _runAfter(self, before):
+        before()
+        return self.run()
@@ -0,0 +1,242 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''pySICM.scanorder provides the orders in which scans visit the pixels
+of an image.
+
+A pixel order is an iterable yielding the pixels (x, y) of an image with
+xpx times ypx pixels, each pixel exactly once. The scan engine
+(pySICM.scanengine) moves the pipette in this order, and clients use the
+same order to place the received values in the image, so server and
+client have to agree on the name of the order and the image size.
+
+New orders are added by subclassing PixelOrder and registering the class
+in ORDERS.'''
+
+import base64, zlib
+import numpy as np
+
+
+class PixelOrder(object):
+    '''Base class of the pixel orders.
+
+    Params:
+    =======
+    xpx: Number of pixels in x-direction
+    ypx: Number of pixels in y-direction
+    '''
+
+    def __init__(self, xpx, ypx):
+        self.xpx = int(xpx)
+        self.ypx = int(ypx)
+
+    def __iter__(self):
+        raise NotImplementedError()
+
+    def __len__(self):
+        return self.xpx * self.ypx
+
+    def pixels(self):
+        '''Returns the pixels as an array of shape (n, 2), column 0 holding
+        x, column 1 holding y.'''
+        return np.array(list(self), np.int32).reshape(len(self), 2)
+
+
+class Raster(PixelOrder):
+    '''Line by line, each line from left to right.'''
+
+    def __iter__(self):
+        for y in xrange(self.ypx):
+            for x in xrange(self.xpx):
+                yield x, y
+
+
+class Serpentine(PixelOrder):
+    '''Line by line, alternately from left to right and from right to
+    left, so that the first pixel of a line is next to the last pixel of
+    the previous line.'''
+
+    def __iter__(self):
+        for y in xrange(self.ypx):
+            if y % 2 == 0:
+                xs = xrange(self.xpx)
+            else:
+                xs = xrange(self.xpx - 1, -1, -1)
+            for x in xs:
+                yield x, y
+
+
+class Hilbert(PixelOrder):
+    '''Generalised Hilbert curve, which fills rectangles of any size.
+    Successive pixels are neighbours in x or y (for some odd sizes, one
+    step is diagonal), and pixels close on the curve are close in the
+    image, so that a scan rarely moves far from where it has been.'''
+
+    def __iter__(self):
+        pixels = []
+        if self.xpx >= self.ypx:
+            self._curve(pixels, 0, 0, self.xpx, 0, 0, self.ypx)
+        else:
+            self._curve(pixels, 0, 0, 0, self.ypx, self.xpx, 0)
+        return iter(pixels)
+
+    def _curve(self, pixels, x, y, ax, ay, bx, by):
+        # Fills the rectangle at (x, y) spanned by the major axis (ax, ay)
+        # and the minor axis (bx, by), by splitting it into two or three
+        # parts which are filled recursively.
+        w = abs(ax + ay)
+        h = abs(bx + by)
+        dax, day = cmp(ax, 0), cmp(ay, 0)
+        dbx, dby = cmp(bx, 0), cmp(by, 0)
+        if h == 1:
+            for i in xrange(w):
+                pixels.append((x + i * dax, y + i * day))
+            return
+        if w == 1:
+            for i in xrange(h):
+                pixels.append((x + i * dbx, y + i * dby))
+            return
+        ax2, ay2 = ax // 2, ay // 2
+        bx2, by2 = bx // 2, by // 2
+        w2 = abs(ax2 + ay2)
+        h2 = abs(bx2 + by2)
+        if 2 * w > 3 * h:
+            # Long rectangle: split along the major axis
+            if w2 % 2 and w > 2:
+                ax2, ay2 = ax2 + dax, ay2 + day
+            self._curve(pixels, x, y, ax2, ay2, bx, by)
+            self._curve(pixels, x + ax2, y + ay2, ax - ax2, ay - ay2, bx, by)
+        else:
+            if h2 % 2 and h > 2:
+                bx2, by2 = bx2 + dbx, by2 + dby
+            self._curve(pixels, x, y, bx2, by2, ax2, ay2)
+            self._curve(pixels, x + bx2, y + by2, ax, ay, bx - bx2, by - by2)
+            self._curve(pixels, x + (ax - dax) + (bx2 - dbx),
+                        y + (ay - day) + (by2 - dby),
+                        -bx2, -by2, -(ax - ax2), -(ay - ay2))
+
+
+class Progressive(PixelOrder):
+    '''Coarse to fine: first every step-th pixel of every step-th line,
+    then the pixels of the lattice of half the distance which have not
+    been visited yet, and so on down to every pixel. Each pass runs
+    serpentine over its lattice.
+
+    Params:
+    =======
+    xpx: Number of pixels in x-direction
+    ypx: Number of pixels in y-direction
+    step: Distance of the pixels of the first pass
+    '''
+
+    def __init__(self, xpx, ypx, step = 8):
+        super(Progressive, self).__init__(xpx, ypx)
+        self.step = max(int(step), 1)
+
+    def steps(self):
+        '''Returns the distances of the pixels of the passes.'''
+        steps = [self.step]
+        while steps[-1] > 1:
+            steps.append(steps[-1] // 2)
+        return steps
+
+    def stepOf(self, pixel):
+        '''Returns the distance of the pass in which pixel is visited.'''
+        for s in self.steps():
+            if pixel[0] % s == 0 and pixel[1] % s == 0:
+                return s
+
+    def __iter__(self):
+        for s in self.steps():
+            for j, y in enumerate(xrange(0, self.ypx, s)):
+                xs = range(0, self.xpx, s)
+                if j % 2:
+                    xs.reverse()
+                for x in xs:
+                    if self.stepOf((x, y)) == s:
+                        yield x, y
+
+
+class Masked(PixelOrder):
+    '''The pixels selected by a mask, along the Hilbert curve (see
+    Hilbert), so that the pixels of a region are visited one after the
+    other.
+
+    Params:
+    =======
+    xpx: Number of pixels in x-direction
+    ypx: Number of pixels in y-direction
+    mask: Boolean array of shape (ypx, xpx), or a string created by
+        encodeMask
+    '''
+
+    def __init__(self, xpx, ypx, mask):
+        super(Masked, self).__init__(xpx, ypx)
+        if isinstance(mask, basestring):
+            mask = decodeMask(mask, xpx, ypx)
+        self.mask = np.asarray(mask, bool).reshape(self.ypx, self.xpx)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.mask))
+
+    def __iter__(self):
+        for x, y in Hilbert(self.xpx, self.ypx):
+            if self.mask[y, x]:
+                yield x, y
+
+
+ORDERS = {'raster': Raster,
+          'serpentine': Serpentine,
+          'hilbert': Hilbert,
+          'progressive': Progressive,
+          'masked': Masked}
+
+# Orders selectable by the option ScanPath of the scan modes
+PATHS = ['raster', 'serpentine', 'hilbert']
+
+
+def getOrder(name, xpx, ypx, **kwargs):
+    '''Returns an instance of the pixel order registered as name.'''
+    if name not in ORDERS:
+        raise KeyError('Unknown pixel order ' + str(name) + '.')
+    return ORDERS[name](xpx, ypx, **kwargs)
+
+def getPath(number, xpx, ypx, **kwargs):
+    '''Returns the pixel order selected by the option ScanPath.'''
+    if number < 0 or number >= len(PATHS):
+        raise KeyError('Unknown scan path ' + str(number) + '.')
+    return getOrder(PATHS[int(number)], xpx, ypx, **kwargs)
+
+def adjacent(a, b):
+    '''Whether the pixels a and b are neighbours (including diagonal
+    ones).'''
+    return max(abs(a[0] - b[0]), abs(a[1] - b[1])) <= 1
+
+def encodeMask(mask):
+    '''Encodes a boolean mask of shape (ypx, xpx) as a string which can
+    be sent as value of an option (compressed bits in base64).'''
+    bits = np.packbits(np.asarray(mask, bool).ravel())
+    return base64.b64encode(zlib.compress(bits.tostring(), 9))
+
+def decodeMask(s, xpx, ypx):
+    '''Decodes a mask encoded by encodeMask into a boolean array of shape
+    (ypx, xpx).'''
+    bits = np.frombuffer(zlib.decompress(base64.b64decode(s)), np.uint8)
+    n = int(xpx) * int(ypx)
+    mask = np.unpackbits(bits)[:n]
+    if len(mask) < n:
+        raise ValueError('The mask does not cover ' + str(xpx) + 'x' +
+                         str(ypx) + ' pixels.')
+    return mask.astype(bool).reshape(int(ypx), int(xpx))
@@ -15,12 +15,17 @@
 # pySICM. If not, see <http://www.gnu.org/licenses/>.
 
 import ConfigParser, re, os
-import pycomedi.constant as CONSTANTS
 from twisted.internet import reactor
-from pycomedi.device import Device
-from pycomedi.subdevice import StreamingSubdevice
-from pycomedi.channel import AnalogChannel, DigitalChannel
-from pycomedi import PyComediError
+import pySICM.comedi as Comedi
+from pySICM.comedi import constant as CONSTANTS, PyComediError
+StreamingSubdevice = Comedi.subdevice.StreamingSubdevice
+AnalogChannel = Comedi.channel.AnalogChannel
+DigitalChannel = Comedi.channel.DigitalChannel
+import pySICM.simulation.device as SimDevice
+import pySICM.simulation.model as SimModel
+import pySICM.simulation.replay as SimReplay
+import pySICM.recorder as Recorder
+import pySICM.checkpoint as Checkpoint
 import pySICM.piezo as Piezo
 from pySICM.error import PySICMError
 import pySICM.controllable as Controllable
@@ -33,7 +38,7 @@ import pySICM.helpers as Helpers
 class Setup(object):
     '''Class for parsing a setup.ini file'''
 
-    DEFAULTINIFILE='/etc/pySICM/setup.ini'
+    DEFAULTINIFILE=os.environ.get('PYSICM_SETUP', '/etc/pySICM/setup.ini')
     instrument = {
         'main'           : {},
         'devices'        : {},
@@ -70,6 +75,15 @@ class Setup(object):
         files['inifiles'] = fname
         files['scanmodesdir'] = self.parser.get('pySICM','scanmodesdir')
         files['toolsdir'] = self.parser.get('pySICM','toolsdir')
+        if self.parser.has_option('pySICM', 'calibrationdir'):
+            Piezo.PiezoControl.CALIBRATIONDIR = self.parser.get(
+                'pySICM', 'calibrationdir')
+        if self.parser.has_option('pySICM', 'checkpointdir'):
+            Checkpoint.CHECKPOINTDIR = self.parser.get(
+                'pySICM', 'checkpointdir')
+        if self.parser.has_option('pySICM', 'checkpointinterval'):
+            Checkpoint.INTERVAL = self.parser.getfloat(
+                'pySICM', 'checkpointinterval')
 
         l = os.listdir(self.files['scanmodesdir'])
         for f in l:
@@ -99,6 +113,11 @@ class Setup(object):
 
     def _populateConfig(self):
         self.generateDevices()
+        if self.parser.has_option('pySICM', 'recordfile'):
+            Recorder.start(
+                self.parser.get('pySICM', 'recordfile'),
+                [self.instrument['devices'][i]['board'] for i in
+                 xrange(self.instrument['main']['devices'])])
         self.generateChannels('in')
         self.generateChannels('out')
         self.generateControllables()
@@ -116,15 +135,31 @@ class Setup(object):
                     'in': None,
                     'out': None,
                     'io': None},
-                'counter': None}
+                'counter': None,
+                'aistarttrigger': None}
 
-            device = Device(self.parser.get('Device'+str(i),'path'))
+            if self._deviceType(i) in ['simulated', 'replay']:
+                devconf['aistarttrigger'] = 0
+            devconf['aistarttrigger'] = self._getOption(
+                'Device'+str(i), 'aistarttrigger', devconf['aistarttrigger'],
+                int)
+            if self._deviceType(i) == 'simulated':
+                device = self._generateSimulatedDevice(i)
+            elif self._deviceType(i) == 'replay':
+                device = self._generateReplayDevice(i)
+            else:
+                if Comedi.SIMULATED:
+                    raise PySICMError(
+                        'pycomedi is not installed, only simulated devices '+
+                        'can be used.')
+                device = Comedi.device.Device(
+                    self.parser.get('Device'+str(i),'path'))
             device.open()
             devconf['board'] = device
             
             try:
                 devconf['analog']['in'] = device.find_subdevice_by_type(
-                    CONSTANTS.SUBDEVICE_TYPE.ai)
+                    CONSTANTS.SUBDEVICE_TYPE.ai, factory = StreamingSubdevice)
             except PyComediError:
                 pass
             try:
@@ -154,6 +189,65 @@ class Setup(object):
                 pass
             self.instrument['devices'][i] = devconf
 
+    def _deviceType(self, i):
+        return self._getOption('Device'+str(i), 'type', None)
+
+    def _getOption(self, sec, opt, default, conv = str):
+        if self.parser.has_option(sec, opt):
+            return conv(self.parser.get(sec, opt))
+        return default
+
+    def _parseMapping(self, s, keyconv = int):
+        mapping = {}
+        for item in s.split(','):
+            k, v = item.split(':', 1)
+            mapping[keyconv(k.strip())] = int(v)
+        return mapping
+
+    def _generateSimulatedDevice(self, i):
+        sec = 'Device'+str(i)
+        print "Device "+str(i)+" is simulated."
+        surface = SimModel.Surface(
+            self._getOption(sec, 'surface', 'cell'),
+            base = self._getOption(sec, 'surfacebase', 20000.0, float),
+            height = self._getOption(sec, 'surfaceheight', 3000.0, float),
+            size = self._getOption(sec, 'surfacesize', 15000.0, float))
+        instrument = SimModel.Instrument(
+            surface,
+            travel = self._getOption(sec, 'travel', 100000.0, float),
+            lag = 1e-3 * self._getOption(sec, 'piezolag', 0.5, float),
+            axes = self._parseMapping(
+                self._getOption(sec, 'axes', 'x:0,y:2,z:1'), str),
+            sensors = self._parseMapping(
+                self._getOption(sec, 'sensors', '0:0,5:2,2:1')),
+            signal = self._getOption(sec, 'signal', 3, int),
+            approachdir = self._getOption(sec, 'approachdir', 'decrease'),
+            noise = self._getOption(sec, 'noise', 1e-3, float),
+            sensornoise = self._getOption(sec, 'sensornoise', 1e-3, float))
+        return SimDevice.Device(
+            self._getOption(sec, 'path', 'simulated'),
+            samplerate = self._getOption(sec, 'samplerate', 1e5, float),
+            buffersize = self._getOption(sec, 'buffersize', 2**16, int),
+            instrument = instrument)
+
+    def _generateReplayDevice(self, i):
+        sec = 'Device'+str(i)
+        if not self.parser.has_option(sec, 'logfile'):
+            raise PySICMError('No logfile given for replay device '+str(i))
+        speed = self._getOption(sec, 'replayspeed', 'fast')
+        if speed not in ['fast', 'realtime']:
+            raise PySICMError('replayspeed of device '+str(i)+
+                              ' must be fast or realtime')
+        instrument = SimReplay.ReplayInstrument(
+            self.parser.get(sec, 'logfile'),
+            device = self._getOption(sec, 'recordeddevice', i, int),
+            realtime = speed == 'realtime')
+        return SimDevice.Device(
+            self._getOption(sec, 'path', 'replay'),
+            samplerate = self._getOption(sec, 'samplerate', 1e5, float),
+            buffersize = self._getOption(sec, 'buffersize', 2**16, int),
+            instrument = instrument)
+
     def generateChannels(self, inout):
         
         Inout = inout.capitalize()
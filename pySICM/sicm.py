@@ -19,6 +19,8 @@
 import sys
 import numpy
 import json
+import pySICM.worker as Worker
+from twisted.internet import defer
 
   
     
@@ -46,10 +48,35 @@ class _SICMMeasurement(object):
     _requirements = {}
     _reqoptions = {}
     _reactorCall = None
+    # Whether the mode reports the end of a scan (see whenFinished), which
+    # is required to run it from the job queue (see pySICM.jobqueue)
+    queueable = False
+    _finished = None
 
     def __init__(self):
         self.data = []
         self._reqoptions = {}
+
+    def whenFinished(self):
+        '''Returns a Deferred which is fired with True (scan completed) or
+        False (scan stopped) once the scan and the data sent by it are
+        finished, or errback'ed if the scan failed. Only modes with
+        queueable = True fire it.'''
+        if self._finished is None:
+            self._finished = defer.Deferred()
+        return self._finished
+
+    def notifyFinished(self, completed):
+        '''Fires the Deferred of whenFinished in the reactor thread, after
+        the responses delivered before.'''
+        d, self._finished = self._finished, None
+        if d is not None:
+            Worker.getWorker().deliver(d.callback, completed)
+
+    def notifyFailed(self, error):
+        d, self._finished = self._finished, None
+        if d is not None:
+            Worker.getWorker().deliver(d.errback, error)
         
     def _setRequired(self, key, number, typ):
         self._requirements['key'] = {
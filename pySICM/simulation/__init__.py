@@ -0,0 +1,76 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+
+'''Simulated DAQ backend for pySICM.
+
+The modules in this package mirror the layout of pycomedi (constant,
+device, subdevice, channel, utility) and provide a virtual board with the
+subdevice/channel/command surface used by pySICM. Piezos, the position
+sensors and the ion current are computed from a simple model of the
+instrument (see pySICM.simulation.model), so that all scan modes can be
+run and benchmarked without a DAQ card.
+
+A simulated device is selected in setup.ini:
+
+[Device0]
+type = simulated
+path = /dev/comedi0
+
+Optional parameters of the section:
+  samplerate:    AI sample rate in Hz (default 100000)
+  buffersize:    AO buffer size in bytes (default 65536)
+  piezolag:      Delay between AO output and piezo movement in ms
+                 (default 0.5)
+  surface:       Synthetic sample, one of flat, steps, grating, cell
+                 (default cell)
+  surfacebase:   Height of the substrate in nm (default 20000)
+  surfaceheight: Height of the sample features in nm (default 3000)
+  surfacesize:   Lateral feature size in nm (default 15000)
+  noise:         Relative noise of the ion current (default 0.001)
+  sensornoise:   Noise of the position sensors in V (default 0.001)
+  travel:        Travel range of the piezos in nm (default 100000)
+  axes:          AO channels of the x, y and z piezo (default x:0,y:2,z:1)
+  sensors:       AI channel to AO channel mapping of the position sensors
+                 (default 0:0,5:2,2:1)
+  signal:        AI channel of the ion current (default 3)
+  approachdir:   decrease or increase (default decrease)
+  aistarttrigger: start_arg of the external AI start trigger used by the
+                 streaming approach (default 0). On a simulated board, an
+                 external start trigger is raised by the start of any
+                 other command, i.e. the AI starts together with the AO.
+
+A log written by pySICM.recorder is replayed by a device of type replay
+(see pySICM.simulation.replay):
+
+[Device0]
+type = replay
+logfile = /var/pySICM/records/scan.rec
+
+Optional parameters of the section:
+  replayspeed:    fast or realtime (default fast)
+  recordeddevice: Number of the device in the log (default: the number of
+                  this device)
+  buffersize:     AO buffer size in bytes (default 65536)
+  samplerate:     Maximum AI sample rate of timed commands in Hz, should
+                  be the one of the recorded board (default 100000)
+  aistarttrigger: As for simulated devices (default 0)
+'''
+
+try:
+    from pycomedi import PyComediError
+except ImportError:
+    class PyComediError (Exception):
+        pass
@@ -0,0 +1,119 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+
+'''Channels of the simulated backend (mirrors pycomedi.channel).'''
+
+import numpy as np
+import pySICM.simulation.constant as _constant
+
+
+class Range(object):
+    '''An analog range of a channel.'''
+
+    def __init__(self, value, min, max, unit = None):
+        self.value = value
+        self.min = float(min)
+        self.max = float(max)
+        self.unit = unit
+
+    def __int__(self):
+        return self.value
+
+    def __cmp__(self, other):
+        return cmp(self.value, int(other))
+
+    def __str__(self):
+        return '[%g, %g]' % (self.min, self.max)
+
+
+class Converter(object):
+    '''Linear, uncalibrated conversion between bits and volts.'''
+
+    def __init__(self, rang, maxdata):
+        self.range = rang
+        self.maxdata = maxdata
+
+    def to_physical(self, data):
+        f = (self.range.max - self.range.min) / float(self.maxdata)
+        return self.range.min + np.asarray(data, np.float64) * f
+
+    def from_physical(self, data):
+        f = float(self.maxdata) / (self.range.max - self.range.min)
+        bits = np.clip(np.round((np.asarray(data, np.float64) -
+                                 self.range.min) * f), 0, self.maxdata)
+        if bits.ndim == 0:
+            return int(bits)
+        return bits.astype(np.uint16)
+
+
+class Channel(object):
+    def __init__(self, subdevice, index, aref = None, range = None):
+        self.subdevice = subdevice
+        self.index = index
+        self.aref = aref
+        if range is None:
+            range = 0
+        if not isinstance(range, Range):
+            range = subdevice.RANGES[int(range)]
+        self.range = range
+
+    def get_maxdata(self):
+        return self.subdevice.MAXDATA
+
+    def get_n_ranges(self):
+        return len(self.subdevice.RANGES)
+
+
+class AnalogChannel (Channel):
+
+    def find_range(self, unit = None, min = None, max = None):
+        '''Returns the smallest range containing [min, max], or -1.'''
+        best = -1
+        for r in self.subdevice.RANGES:
+            if r.min <= min and r.max >= max:
+                if best == -1 or r.max - r.min < best.max - best.min:
+                    best = r
+        return best
+
+    def get_converter(self):
+        return Converter(self.range, self.subdevice.MAXDATA)
+
+    def _to_bits(self, volts):
+        return self.get_converter().from_physical(volts)
+
+    def data_read(self):
+        return int(self.data_read_n(1)[0])
+
+    def data_read_n(self, n):
+        t = self.subdevice.acquire(int(n))
+        return np.atleast_1d(
+            self.subdevice.device.instrument.input_bits(self, t))
+
+    def data_write(self, data):
+        self.subdevice.device.instrument.write(
+            self.index, int(data), (self.range.min, self.range.max))
+
+
+class DigitalChannel (Channel):
+
+    def dio_config(self, direction):
+        self.direction = direction
+
+    def dio_write(self, value):
+        self.subdevice.dio_state[self.index] = int(value)
+
+    def dio_read(self):
+        return self.subdevice.dio_state.get(self.index, 0)
@@ -0,0 +1,81 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+
+'''Constants of the simulated backend.
+
+Only used if pycomedi is not installed. Names and values follow comedi.h.
+The simulated backend compares constants by name, hence the constants of
+pycomedi and the ones defined here can be used interchangeably.
+'''
+
+
+class _NamedInt (int):
+    def __new__(cls, name, value):
+        obj = super(_NamedInt, cls).__new__(cls, value)
+        obj.name = name
+        return obj
+
+    def __repr__(self):
+        return '<%s %d>' % (self.name, int(self))
+
+
+class _Enum (object):
+    def __init__(self, name, values):
+        self.name = name
+        self._values = []
+        for key, value in values:
+            v = _NamedInt(key, value)
+            setattr(self, key, v)
+            self._values.append(v)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def index_by_value(self, value):
+        for v in self._values:
+            if int(v) == int(value):
+                return v
+        raise ValueError(value)
+
+
+SUBDEVICE_TYPE = _Enum('subdevice_type', [
+    ('unused', 0), ('ai', 1), ('ao', 2), ('di', 3), ('do', 4), ('dio', 5),
+    ('counter', 6), ('timer', 7), ('memory', 8), ('calib', 9), ('proc', 10),
+    ('serial', 11), ('pwm', 12)])
+
+AREF = _Enum('analog_reference', [
+    ('ground', 0), ('common', 1), ('diff', 2), ('other', 3)])
+
+UNIT = _Enum('unit', [('volt', 0), ('mA', 1), ('none', 2)])
+
+TRIG_SRC = _Enum('trigger_source', [
+    ('none', 0), ('now', 1 << 1), ('follow', 1 << 2), ('time', 1 << 3),
+    ('timer', 1 << 4), ('count', 1 << 5), ('ext', 1 << 6), ('int', 1 << 7),
+    ('other', 1 << 30)])
+
+IO_DIRECTION = _Enum('io_direction', [('input', 0), ('output', 1)])
+
+INSN = _Enum('instruction', [
+    ('read', 0 | 0x4000000), ('write', 1 | 0x8000000),
+    ('bits', 2 | 0x4000000 | 0x8000000), ('config', 3 | 0x4000000 | 0x8000000),
+    ('gtod', 4 | 0x4000000 | 0x2000000), ('wait', 5 | 0x8000000 | 0x2000000),
+    ('inttrig', 6 | 0x8000000 | 0x2000000)])
+
+
+def name(constant):
+    '''Returns the name of a constant, regardless whether it has been
+    defined by pycomedi or by this module.'''
+    return getattr(constant, 'name', constant)
@@ -0,0 +1,97 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+
+'''The simulated board (mirrors pycomedi.device).'''
+
+import pySICM.simulation.constant as _constant
+from pySICM.simulation.subdevice import Subdevice, StreamingSubdevice
+from pySICM.simulation.model import Instrument, Surface
+from pySICM.simulation import PyComediError
+
+
+class DeviceFile(object):
+    '''Replaces the file of the comedi device. Data written is passed to
+    the AO command, reads return data of the AI command.'''
+
+    def __init__(self, device):
+        self.device = device
+
+    def write(self, data):
+        self.device.find_subdevice_by_type(
+            _constant.SUBDEVICE_TYPE.ao).write(data)
+
+    def read(self, size):
+        return self.device.find_subdevice_by_type(
+            _constant.SUBDEVICE_TYPE.ai).read(size)
+
+    def flush(self):
+        pass
+
+
+class Device(object):
+    '''A simulated DAQ board with an analog input, an analog output and a
+    digital io subdevice. See pySICM.simulation for the parameters.'''
+
+    def __init__(self, filename, samplerate = 1e5, buffersize = 2**16,
+                 instrument = None):
+        self.filename = filename
+        self.samplerate = float(samplerate)
+        self.buffersize = int(buffersize)
+        if instrument is None:
+            instrument = Instrument(Surface())
+        self.instrument = instrument
+        self.file = None
+        self._subdevices = [
+            StreamingSubdevice(self, 0, _constant.SUBDEVICE_TYPE.ai),
+            StreamingSubdevice(self, 1, _constant.SUBDEVICE_TYPE.ao),
+            Subdevice(self, 2, _constant.SUBDEVICE_TYPE.dio)]
+
+    def open(self):
+        self.file = DeviceFile(self)
+
+    def close(self):
+        for s in self._subdevices:
+            if isinstance(s, StreamingSubdevice):
+                s.cancel()
+        self.file = None
+
+    def get_n_subdevices(self):
+        return len(self._subdevices)
+
+    def subdevices(self, factory = None):
+        return iter(self._subdevices)
+
+    def find_subdevice_by_type(self, subdevice_type, factory = None):
+        for s in self._subdevices:
+            if _constant.name(s.subdevice_type) == _constant.name(
+                subdevice_type):
+                return s
+        raise PyComediError('No subdevice of type '+
+                            str(_constant.name(subdevice_type)))
+
+    def started(self, subdevice):
+        '''The start of a command raises the external start trigger of
+        the other commands (like an AO start signal routed to the AI
+        start trigger), which then share its start time.'''
+        for s in self._subdevices:
+            if (s is not subdevice and isinstance(s, StreamingSubdevice) and
+                s.waitsForStart()):
+                s.trigger(subdevice._t0)
+
+    def do_insn(self, insn):
+        if _constant.name(insn.insn) == 'inttrig':
+            insn.subdevice.trigger()
+        return 0
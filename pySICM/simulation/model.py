@@ -0,0 +1,235 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+
+'''Model of the instrument used by the simulated backend.
+
+The Instrument keeps the history of all values written to the analog
+outputs. Piezo positions, position sensor readings and the ion current are
+computed on demand for arbitrary points in time. Hence, no background
+thread is required and timed AO commands behave as on the real board.
+'''
+
+import threading
+import time
+import numpy as np
+
+
+class Surface(object):
+    '''Synthetic sample topography.
+
+    Params:
+    =======
+    kind: One of 'flat', 'steps', 'grating' or 'cell'
+    base: Height of the substrate in nm
+    height: Height of the features in nm
+    size: Lateral size of the features in nm
+    center: Center of the 'cell' in nm
+    '''
+    KINDS = ['flat', 'steps', 'grating', 'cell']
+
+    def __init__(self, kind = 'cell', base = 20000.0, height = 3000.0,
+                 size = 15000.0, center = (50000.0, 50000.0)):
+        if kind not in self.KINDS:
+            raise ValueError('Unknown surface '+str(kind))
+        self.kind = kind
+        self.base = float(base)
+        self.height = float(height)
+        self.size = float(size)
+        self.center = center
+
+    def __call__(self, x, y):
+        x = np.asarray(x, np.float64)
+        y = np.asarray(y, np.float64)
+        if self.kind == 'flat':
+            return self.base + 0 * x * y
+        if self.kind == 'steps':
+            return self.base + self.height * np.floor(
+                (x + y) / (2 * self.size))
+        if self.kind == 'grating':
+            return self.base + self.height * (
+                np.floor(x / (0.5 * self.size)) % 2) + 0 * y
+        r2 = (x - self.center[0])**2 + (y - self.center[1])**2
+        return self.base + self.height * np.exp(-r2 / (2 * self.size**2))
+
+
+class _Segment(object):
+    '''Part of the AO history: Either a constant value (samples of length
+    1, period None) or a timed output of samples.'''
+
+    def __init__(self, start, samples, period = None, range = (0.0, 10.0)):
+        self.start = start
+        self.samples = samples
+        self.period = period
+        self.range = range
+        self.stop = None
+
+    def values(self, t):
+        if self.period is None:
+            return np.repeat(self.samples[0], len(t))
+        if self.stop is not None:
+            t = np.minimum(t, self.stop)
+        idx = np.floor((t - self.start) / self.period).astype(np.int64)
+        return self.samples[np.clip(idx, 0, len(self.samples) - 1)]
+
+
+class Instrument(object):
+    '''Physical model of a SICM.
+
+    Params:
+    =======
+    surface: A Surface instance
+    travel: Travel range of all piezos in nm
+    vrange: Output voltage range corresponding to the travel range
+    lag: Delay between AO output and piezo movement in seconds
+    axes: Dictionary mapping 'x', 'y', 'z' to AO channel numbers
+    sensors: Dictionary mapping AI channel numbers to AO channel numbers
+    signal: AI channel carrying the ion current
+    approachdir: 'decrease' if the pipette approaches with decreasing
+        voltage, otherwise 'increase'
+    saturation: Ion current far away from the surface in volts
+    decay: Decay distance of the ion current in nm
+    noise: Relative noise of the ion current
+    sensornoise: Noise of the position sensors in volts
+    '''
+
+    def __init__(self, surface, travel = 100000.0, vrange = (0.0, 10.0),
+                 lag = 5e-4, axes = None, sensors = None, signal = 3,
+                 approachdir = 'decrease', saturation = 5.0, decay = 100.0,
+                 noise = 1e-3, sensornoise = 1e-3):
+        self.surface = surface
+        self.travel = float(travel)
+        self.vrange = (float(min(vrange)), float(max(vrange)))
+        self.lag = float(lag)
+        self.axes = axes or {'x': 0, 'y': 2, 'z': 1}
+        self.sensors = sensors or {0: 0, 5: 2, 2: 1}
+        self.signal = signal
+        self.approachdir = approachdir
+        self.saturation = float(saturation)
+        self.decay = float(decay)
+        self.noise = float(noise)
+        self.sensornoise = float(sensornoise)
+        self.lock = threading.Lock()
+        self._history = {}
+        self._random = np.random.RandomState(42)
+        home = {'decrease': 65535, 'increase': 0}[approachdir]
+        for ao in self.axes.itervalues():
+            self._history[ao] = [_Segment(0.0, np.array([0], np.uint16))]
+        self._history[self.axes['z']] = [
+            _Segment(0.0, np.array([home], np.uint16))]
+
+    # Reads of the simulated board are paced by the sample rate
+    paced = True
+
+    def clock(self):
+        '''Time base of the simulated board.'''
+        return time.time()
+
+    def _append(self, ao, segment):
+        with self.lock:
+            hist = self._history.setdefault(ao, [])
+            hist.append(segment)
+            # Segments which ended before the lag are no longer required
+            t = self.clock() - self.lag - 1.0
+            while len(hist) > 2 and hist[1].start < t:
+                hist.pop(0)
+
+    def write(self, ao, bits, range = (0.0, 10.0), t = None):
+        if t is None:
+            t = self.clock()
+        self._append(ao, _Segment(t, np.array([bits], np.uint16),
+                                  range = range))
+
+    def stream(self, ao, start, samples, period, range = (0.0, 10.0)):
+        '''Registers a timed output. Returns the segment, which can be
+        extended (segment.samples) or stopped (segment.stop).'''
+        seg = _Segment(start, samples, period, range)
+        self._append(ao, seg)
+        return seg
+
+    def stream_data(self, ao, samples):
+        '''Called with the samples written to the buffer of a timed
+        output. The samples are already part of the segment.'''
+        pass
+
+    def commanded(self, ao, t):
+        '''Returns the output bits of channel ao at times t (array).'''
+        t = np.atleast_1d(np.asarray(t, np.float64))
+        out = np.zeros(len(t), np.uint16)
+        rang = np.zeros((len(t), 2))
+        rang[:, 1] = 10.0
+        with self.lock:
+            for seg in self._history.get(ao, []):
+                mask = t >= seg.start
+                if mask.any():
+                    out[mask] = seg.values(t[mask])
+                    rang[mask] = seg.range
+        return out, rang
+
+    def volts(self, ao, t):
+        '''Output voltage of channel ao, as seen by the piezo (i.e.
+        including the lag).'''
+        bits, rang = self.commanded(ao, np.asarray(t) - self.lag)
+        return rang[:, 0] + bits / 65535.0 * (rang[:, 1] - rang[:, 0])
+
+    def position(self, axis, t):
+        '''Position of a piezo axis in nm.'''
+        v = self.volts(self.axes[axis], t)
+        return self.travel * (v - self.vrange[0]) / (
+            self.vrange[1] - self.vrange[0])
+
+    def gap(self, t):
+        '''Distance between pipette tip and sample in nm.'''
+        z = self.position('z', t)
+        if self.approachdir == 'increase':
+            z = self.travel - z
+        return z - self.surface(self.position('x', t),
+                                self.position('y', t))
+
+    def current(self, t):
+        '''Ion current (in volts) at times t.'''
+        g = np.maximum(self.gap(t), 0)
+        i = self.saturation * (1 - np.exp(-g / self.decay))
+        with self.lock:
+            noise = self._random.normal(0, self.noise * self.saturation,
+                                        len(i))
+        return i + noise
+
+    def analog_input(self, ai, t):
+        '''Voltage at the analog input ai at times t.'''
+        t = np.atleast_1d(np.asarray(t, np.float64))
+        if ai == self.signal:
+            return self.current(t)
+        if ai in self.sensors:
+            v = self.volts(self.sensors[ai], t)
+            with self.lock:
+                noise = self._random.normal(0, self.sensornoise, len(v))
+            return v + noise
+        return np.zeros(len(t))
+
+    def input_bits(self, channel, t):
+        '''Reading of the analog input channel at times t in bits.'''
+        return channel.get_converter().from_physical(
+            self.analog_input(channel.index, t))
+
+    def stream_bits(self, chanlist, idx, t):
+        '''Readings of a timed input of the channels in chanlist. idx are
+        the indices of the samples since the start of the command, t their
+        times (channels interleaved).'''
+        out = np.zeros(len(t), np.uint16)
+        for k, chan in enumerate(chanlist):
+            sel = idx % len(chanlist) == k
+            out[sel] = self.input_bits(chan, t[sel])
+        return out
@@ -0,0 +1,197 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+
+'''Replay of logs written by pySICM.recorder.
+
+A ReplayInstrument takes the place of the model of the simulated board:
+Analog inputs return the recorded samples of the channel in the order in
+which they were recorded, data written to the analog outputs is compared
+with the recorded data. A deviation means that the replayed code does not
+behave like the recorded one; it is counted in ReplayInstrument.divergences
+and reported once on stdout.
+
+Clock readings (pySICM.recorder.now) are replayed as well, so that time
+measurements which steer a scan give the recorded results.
+
+In realtime mode, reads are delayed until the time at which they have been
+recorded. Otherwise the replay runs as fast as possible: reads return
+immediately and the board's clock runs FASTFACTOR times faster than the
+wall clock between them, so that waiting for timed outputs (ramps) takes
+a fraction of the recorded time.
+'''
+
+import time, threading
+import numpy as np
+import pySICM.recorder as Recorder
+from pySICM.simulation.model import _Segment
+from pySICM.simulation import PyComediError
+
+
+class _Queue(object):
+    '''The recorded blocks of one channel. Blocks are consumed partially
+    if the replayed code reads in different block sizes.'''
+
+    def __init__(self):
+        self._times = []
+        self._blocks = []
+        self._pos = 0
+        self._offset = 0
+
+    def append(self, t, data):
+        self._times.append(t)
+        self._blocks.append(data)
+
+    def take(self, n, partial = False):
+        '''Returns the next n samples and the time of the block containing
+        the last of them. If the queue is exhausted, None is returned, or
+        the remaining (possibly no) samples if partial is True.'''
+
+        parts = []
+        t = None
+        while n > 0 and self._pos < len(self._blocks):
+            block = self._blocks[self._pos]
+            part = block[self._offset:self._offset + n]
+            parts.append(part)
+            n -= len(part)
+            t = self._times[self._pos]
+            self._offset += len(part)
+            if self._offset >= len(block):
+                self._pos += 1
+                self._offset = 0
+        if n > 0 and not partial:
+            return None, t
+        if not parts:
+            return np.zeros(0, np.uint16), t
+        return np.concatenate(parts), t
+
+    def takeBlock(self):
+        '''Returns the next (entire) block or None.'''
+        if self._pos >= len(self._blocks):
+            return None
+        block = self._blocks[self._pos][self._offset:]
+        self._pos += 1
+        self._offset = 0
+        return block
+
+
+class ReplayInstrument(object):
+    '''Replays the data of one device of a log.
+
+    Params:
+    =======
+    filename: Name of the log
+    device: Number of the recorded device (see pySICM.recorder)
+    realtime: Whether the replay runs in real time or as fast as possible
+    '''
+
+    FASTFACTOR = 1000.0
+    # Reads are paced by the recorded times, not by the sample rate
+    paced = False
+
+    def __init__(self, filename, device = 0, realtime = False):
+        self.filename = filename
+        self.realtime = realtime
+        self.divergences = 0
+        self.lock = threading.Lock()
+        self._inputs = {}
+        self._outputs = {}
+        self._clock = []
+        for kind, dev, chan, t, period, data in Recorder.readLog(filename):
+            if kind == Recorder.CLOCK:
+                self._clock.append(data.view('<f8')[0])
+                continue
+            if dev != device:
+                continue
+            if kind in (Recorder.AI, Recorder.AI_STREAM):
+                queues = self._inputs
+            else:
+                queues = self._outputs
+            queues.setdefault((kind, chan), _Queue()).append(t, data)
+        print ("Replaying " + filename + " (" + str(len(self._inputs)) +
+               " input channels, " + ("realtime" if realtime else "fast") +
+               ")")
+        self._factor = 1.0 if realtime else self.FASTFACTOR
+        self._t0 = time.time()
+        self._last = 0.0
+        self._lastReal = self._t0
+        self._clock.reverse()
+        if Recorder.CLOCKSOURCE is None:
+            Recorder.CLOCKSOURCE = self.recordedClock
+
+    def _now(self):
+        '''Time of the replay in seconds since the start of the log.'''
+        return self._last + (time.time() - self._lastReal) * self._factor
+
+    def clock(self):
+        with self.lock:
+            return self._t0 + self._now()
+
+    def recordedClock(self):
+        '''Returns the next recorded clock reading. If all readings have
+        been used, the time of the replay is returned.'''
+        with self.lock:
+            if self._clock:
+                return self._clock.pop()
+        return self.clock()
+
+    def _take(self, kind, channel, n, partial = False):
+        with self.lock:
+            q = self._inputs.get((kind, channel))
+            data, t = (None, None) if q is None else q.take(n, partial)
+            if data is None:
+                raise PyComediError(
+                    'Replay of ' + self.filename + ' is exhausted on ' +
+                    'analog input ' + str(channel) + '.')
+            now = self._now()
+        if t is None:
+            return data
+        if self.realtime and t > now:
+            time.sleep(t - now)
+        with self.lock:
+            self._last = max(self._now(), t)
+            self._lastReal = time.time()
+        return data
+
+    def _check(self, kind, channel, data):
+        with self.lock:
+            q = self._outputs.get((kind, channel))
+            expected = None if q is None else q.takeBlock()
+            if expected is not None and np.array_equal(
+                expected, np.atleast_1d(data)):
+                return
+            self.divergences += 1
+            if self.divergences == 1:
+                print ("Replay of " + self.filename + " diverged: " +
+                       "unexpected output on analog output " + str(channel))
+
+    def input_bits(self, channel, t):
+        return self._take(Recorder.AI, channel.index, len(t))
+
+    def stream_bits(self, chanlist, idx, t):
+        # How much is read from a stream depends on timing, so a replay
+        # may ask for more than was recorded. Like a read of the device
+        # file, the read then returns less, or nothing at the end.
+        return self._take(Recorder.AI_STREAM, chanlist[0].index, len(t),
+                          partial = True)
+
+    def write(self, ao, bits, range = (0.0, 10.0), t = None):
+        self._check(Recorder.AO, ao, bits)
+
+    def stream(self, ao, start, samples, period, range = (0.0, 10.0)):
+        return _Segment(start, samples, period, range)
+
+    def stream_data(self, ao, samples):
+        self._check(Recorder.AO_STREAM, ao, samples)
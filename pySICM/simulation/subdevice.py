@@ -0,0 +1,249 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+
+'''Subdevices of the simulated backend (mirrors pycomedi.subdevice).'''
+
+import time
+import numpy as np
+import pySICM.simulation.constant as _constant
+from pySICM.simulation.channel import Range, AnalogChannel, DigitalChannel
+from pySICM.simulation import PyComediError
+
+
+class _Flags(object):
+    def __init__(self, busy = False, running = False):
+        self.busy = busy
+        self.running = running
+
+
+class _Insn(object):
+    def __init__(self, subdevice):
+        self.subdevice = subdevice
+        self.insn = None
+        self.data = []
+
+
+class Command(object):
+    '''Minimal stand-in for a comedi command.'''
+
+    def __init__(self, chanlist_len = 1, scan_period_ns = 0):
+        self.start_src = _constant.TRIG_SRC.now
+        self.start_arg = 0
+        self.scan_begin_src = _constant.TRIG_SRC.timer
+        self.scan_begin_arg = int(round(scan_period_ns))
+        self.convert_src = _constant.TRIG_SRC.now
+        self.convert_arg = 0
+        self.scan_end_src = _constant.TRIG_SRC.count
+        self.scan_end_arg = chanlist_len
+        self.stop_src = _constant.TRIG_SRC.none
+        self.stop_arg = 0
+        self.chanlist = []
+
+
+class Subdevice(object):
+    RANGES = [Range(0, -10, 10), Range(1, -5, 5), Range(2, 0, 10),
+              Range(3, 0, 5)]
+    MAXDATA = 65535
+
+    def __init__(self, device, index, subdevice_type):
+        self.device = device
+        self.index = index
+        self.subdevice_type = subdevice_type
+        self.dio_state = {}
+        self._due = 0.0
+
+    def get_type(self):
+        return self.subdevice_type
+
+    def get_n_channels(self):
+        return 16
+
+    def channel(self, index, factory = None, **kwargs):
+        if _constant.name(self.subdevice_type) == 'dio':
+            return DigitalChannel(self, index, **kwargs)
+        return AnalogChannel(self, index, **kwargs)
+
+    def insn(self):
+        return _Insn(self)
+
+    def get_flags(self):
+        return _Flags()
+
+    def acquire(self, n):
+        '''Waits until n samples could have been converted by the ADC at
+        the configured sample rate. Returns the sample times.'''
+        rate = self.device.samplerate
+        now = self.device.instrument.clock()
+        start = max(self._due, now)
+        self._due = start + n / rate
+        # Sleeping is only done if the debt is noticeable, to keep the
+        # overhead of single reads low
+        if self.device.instrument.paced and self._due - now > 1e-3:
+            time.sleep(self._due - now)
+        return start + np.arange(n) / rate
+
+
+class StreamingSubdevice (Subdevice):
+
+    def __init__(self, device, index, subdevice_type):
+        super(StreamingSubdevice, self).__init__(device, index, subdevice_type)
+        self.cmd = None
+        self._reset()
+
+    def _reset(self):
+        self._armed = False
+        self._t0 = None
+        self._samples = np.zeros(0, np.uint16)
+        self._segment = None
+        self._delivered = 0
+        self._marked = 0
+        self._stopped = None
+
+    def get_cmd_generic_timed(self, chanlist_len, scan_period_ns = 0):
+        # Like comedi, the fastest possible rate is used if the requested
+        # one cannot be reached
+        return Command(chanlist_len, max(scan_period_ns,
+                                         1e9 / self.device.samplerate))
+
+    def command_test(self):
+        if self.cmd is None:
+            raise PyComediError('No command set.')
+        if len(self.cmd.chanlist) < 1:
+            raise PyComediError('Empty channel list.')
+
+    def command(self):
+        self.command_test()
+        self._reset()
+        self._armed = True
+        if _constant.name(self.cmd.start_src) == 'now':
+            self.trigger()
+
+    def cancel(self):
+        if self._segment is not None:
+            now = self.device.instrument.clock()
+            if self._segment.stop is None or self._segment.stop > now:
+                self._segment.stop = now
+        self._reset()
+
+    def waitsForStart(self):
+        '''Whether the command is armed and waits for an external start
+        trigger.'''
+        return (self._armed and self._t0 is None and
+                _constant.name(self.cmd.start_src) == 'ext')
+
+    def trigger(self, t0 = None):
+        if not self._armed or self._t0 is not None:
+            return
+        if t0 is None:
+            t0 = self.device.instrument.clock()
+        self._t0 = t0
+        if self._is_output():
+            chan = self.cmd.chanlist[0]
+            self._segment = self.device.instrument.stream(
+                chan.index, self._t0, self._samples, self._period(),
+                (chan.range.min, chan.range.max))
+            if self._count() is not None:
+                self._segment.stop = self._t0 + (
+                    self._count() - 1) * self._period()
+        self.device.started(self)
+
+    def _is_output(self):
+        return _constant.name(self.subdevice_type) == 'ao'
+
+    def _period(self):
+        return self.cmd.scan_begin_arg * 1e-9 / len(self.cmd.chanlist)
+
+    def _count(self):
+        if _constant.name(self.cmd.stop_src) == 'count':
+            return self.cmd.stop_arg * len(self.cmd.chanlist)
+        return None
+
+    def _converted(self, t = None):
+        '''Number of samples converted (or output) until t.'''
+        if self._t0 is None:
+            return 0
+        if t is None:
+            t = self.device.instrument.clock()
+        n = int((t - self._t0) / self._period()) + 1
+        if self._count() is not None:
+            n = min(n, self._count())
+        if self._is_output():
+            n = min(n, len(self._samples))
+        return max(n, 0)
+
+    def _finished(self):
+        if self._t0 is None:
+            return False
+        if self._is_output():
+            return self._converted() >= len(self._samples)
+        return (self._count() is not None and
+                self._converted() >= self._count())
+
+    def get_flags(self):
+        return _Flags(busy = self._armed,
+                      running = self._armed and not self._finished())
+
+    def get_buffer_size(self):
+        return self.device.buffersize
+
+    def get_buffer_contents(self):
+        if not self._armed:
+            return 0
+        if self._is_output():
+            n = len(self._samples) - self._converted() - self._marked
+        else:
+            n = self._converted() - self._delivered
+        return max(n, 0) * np.dtype(np.uint16).itemsize
+
+    def mark_buffer_written(self, nbytes):
+        self._marked += nbytes // np.dtype(np.uint16).itemsize
+
+    def mark_buffer_read(self, nbytes):
+        self._delivered += nbytes // np.dtype(np.uint16).itemsize
+
+    def write(self, data):
+        '''Appends samples to the buffer of an analog output command.'''
+        if not self._armed:
+            raise PyComediError('No command running on subdevice '+
+                                str(self.index))
+        samples = np.frombuffer(data, np.uint16)
+        self._samples = np.concatenate((self._samples, samples))
+        if self._segment is not None:
+            self._segment.samples = self._samples
+        self.device.instrument.stream_data(self.cmd.chanlist[0].index,
+                                           samples)
+
+    def read(self, nbytes):
+        '''Reads samples of an analog input command. Blocks until the
+        samples have been acquired or the command is finished.'''
+        if not self._armed:
+            return ''
+        n = nbytes // np.dtype(np.uint16).itemsize
+        if self._count() is not None:
+            n = min(n, self._count() - self._delivered)
+        while self._t0 is None:
+            time.sleep(1e-4)
+        while (self.device.instrument.paced and self._armed and
+               self._converted() < self._delivered + n):
+            missing = self._delivered + n - self._converted()
+            time.sleep(max(missing * self._period(), 1e-5))
+        if not self._armed:
+            return ''
+        idx = self._delivered + np.arange(n)
+        t = self._t0 + idx * self._period()
+        out = self.device.instrument.stream_bits(self.cmd.chanlist, idx, t)
+        self._delivered += len(out)
+        return out.tostring()
@@ -0,0 +1,54 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+
+'''Utilities of the simulated backend (mirrors pycomedi.utility).'''
+
+import threading, time
+import numpy as np
+import pySICM.simulation.constant as _constant
+
+
+def inttrig_insn(subdevice):
+    '''Returns an instruction that fires the internal trigger of the
+    subdevice.'''
+    insn = subdevice.insn()
+    insn.insn = _constant.INSN.inttrig
+    insn.data = [0]
+    return insn
+
+
+class Reader (threading.Thread):
+    '''Reads the data of a running AI command into buffer (a numpy
+    array), like pycomedi.utility.Reader.'''
+
+    def __init__(self, subdevice, buffer, name = None,
+                 block_while_running = False):
+        super(Reader, self).__init__(name = name)
+        self.subdevice = subdevice
+        self.buffer = buffer
+        self.block_while_running = block_while_running
+
+    def run(self):
+        raw = self.subdevice.read(self.buffer.nbytes)
+        data = np.frombuffer(raw, self.buffer.dtype)
+        self.buffer.flat[:len(data)] = data
+        if self.block_while_running:
+            self.block()
+
+    def block(self):
+        '''Waits until the command of the subdevice is finished.'''
+        while self.subdevice.get_flags().running:
+            time.sleep(1e-3)
@@ -0,0 +1,139 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''pySICM.stitching assembles the tiles of a tiled scan to one image.
+
+Neighbouring tiles overlap by a known number of pixels. Since the coarse
+stage is not as precise as the piezos, the true offset of a tile with
+respect to its neighbour deviates from the nominal one by a few pixels.
+It is found by the maximum of the normalized cross-correlation of the
+overlapping parts of both tiles, searched within a window around the
+nominal offset. The heights of the tiles are aligned by the median
+difference in the overlap, which removes drift between the tiles.
+
+Tiles are arrays indexed [y, x]; pixels which have not been measured are
+NaN.'''
+
+import numpy as np
+
+
+def _correlation(a, b):
+    '''Normalized cross-correlation of a and b (arrays of equal shape),
+    ignoring NaNs. Returns -inf if too few pixels are valid.'''
+    valid = ~(np.isnan(a) | np.isnan(b))
+    if np.count_nonzero(valid) < 4:
+        return -np.inf
+    a = a[valid] - np.mean(a[valid])
+    b = b[valid] - np.mean(b[valid])
+    norm = np.sqrt(np.sum(a*a) * np.sum(b*b))
+    if norm == 0:
+        return 0.0
+    return np.sum(a*b) / norm
+
+def _overlap(a, b, dx, dy):
+    '''Returns the parts of a and b which overlap if b is placed at
+    (dx, dy) relative to a.'''
+    ha, wa = a.shape
+    hb, wb = b.shape
+    x0, x1 = max(dx, 0), min(wa, dx + wb)
+    y0, y1 = max(dy, 0), min(ha, dy + hb)
+    if x1 <= x0 or y1 <= y0:
+        return None, None
+    return (a[y0:y1, x0:x1],
+            b[y0 - dy:y1 - dy, x0 - dx:x1 - dx])
+
+def offset(a, b, dx, dy, search = 4):
+    '''Returns the offset (dx, dy, dz) of tile b relative to tile a, found
+    within search pixels around the nominal offset (dx, dy). dz has to be
+    added to the heights of b to align them with a.
+
+    Params:
+    =======
+    a, b: The tiles
+    dx, dy: Nominal offset of b in pixels
+    search: Maximum deviation from the nominal offset in pixels
+    '''
+    best = (-np.inf, dx, dy)
+    for sy in xrange(dy - search, dy + search + 1):
+        for sx in xrange(dx - search, dx + search + 1):
+            pa, pb = _overlap(a, b, sx, sy)
+            if pa is None:
+                continue
+            c = _correlation(pa, pb)
+            if c > best[0]:
+                best = (c, sx, sy)
+    c, dx, dy = best
+    pa, pb = _overlap(a, b, dx, dy)
+    dz = 0.0
+    if pa is not None:
+        diff = pa - pb
+        if not np.isnan(diff).all():
+            dz = np.nanmedian(diff)
+    return dx, dy, dz
+
+def positions(tiles, stepx, stepy, search = 4):
+    '''Returns the positions (x, y, z) of the tiles in the stitched image.
+
+    Params:
+    =======
+    tiles: Dict mapping (column, row) of a tile to the tile. Missing tiles
+        are placed at their nominal position.
+    stepx, stepy: Nominal distance of the tiles in pixels
+    search: See offset
+
+    The first tile of each row is placed relative to the tile above it,
+    the other tiles relative to their left neighbour.
+    '''
+    pos = {}
+    for (i, j) in sorted(tiles, key = lambda t: (t[1], t[0])):
+        if (i - 1, j) in pos:
+            ref = (i - 1, j)
+            dx, dy = stepx, 0
+        elif (i, j - 1) in pos:
+            ref = (i, j - 1)
+            dx, dy = 0, stepy
+        else:
+            pos[(i, j)] = (i * stepx, j * stepy, 0.0)
+            continue
+        ox, oy, oz = offset(tiles[ref], tiles[(i, j)], dx, dy, search)
+        rx, ry, rz = pos[ref]
+        pos[(i, j)] = (rx + ox, ry + oy, rz + oz)
+    return pos
+
+def stitch(tiles, stepx, stepy, search = 4):
+    '''Stitches the tiles (see positions) and returns the image and the
+    positions. Overlapping pixels are averaged, pixels not covered by any
+    tile are NaN.'''
+    pos = positions(tiles, stepx, stepy, search)
+    if not pos:
+        return np.zeros((0, 0)), pos
+    x0 = min(p[0] for p in pos.itervalues())
+    y0 = min(p[1] for p in pos.itervalues())
+    x1 = max(p[0] + tiles[t].shape[1] for t, p in pos.iteritems())
+    y1 = max(p[1] + tiles[t].shape[0] for t, p in pos.iteritems())
+    total = np.zeros((y1 - y0, x1 - x0))
+    count = np.zeros((y1 - y0, x1 - x0))
+    for t, (x, y, z) in pos.iteritems():
+        tile = tiles[t]
+        valid = ~np.isnan(tile)
+        h, w = tile.shape
+        part = (slice(y - y0, y - y0 + h), slice(x - x0, x - x0 + w))
+        total[part][valid] += tile[valid] + z
+        count[part][valid] += 1
+    image = np.empty(total.shape)
+    image.fill(np.nan)
+    covered = count > 0
+    image[covered] = total[covered] / count[covered]
+    return image, pos
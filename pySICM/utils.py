@@ -13,4 +13,4 @@ def mkByte(self, number, r = 16):
             
     elif r == 24:
         a = int(number/(2**16))
-        return struct.pack('b',a) + mkByte(int(a%2^16), r=16)
+        return mkByte(self, int(number%(2**16)), r=16) + struct.pack('B',a)
@@ -0,0 +1,113 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''pySICM.worker runs the hardware access of the scan modes in one
+long-lived thread.
+
+Scans submit their work as a job together with a prepared Deferred,
+usually the entire scan run by a ScanEngine (see pySICM.scanengine). The
+worker runs the job and fires the Deferred in its own thread, so no
+thread pool handoff or reactor round trip is needed per pixel.
+
+Calls that must run in the reactor thread (e.g. writing responses to the
+client) are passed to deliver(). They are collected and handed to the
+reactor in batches: when the worker becomes idle, when MAXBATCH calls
+are pending, or after FLUSHINTERVAL seconds.'''
+
+import Queue, threading, time
+from twisted.internet import reactor
+from twisted.python import failure
+
+MAXBATCH = 256
+FLUSHINTERVAL = 0.1
+STOPTIMEOUT = 1.0
+
+WORKER = None
+
+
+class HardwareWorker(threading.Thread):
+    '''Thread that runs jobs in the order of submission.'''
+
+    def __init__(self):
+        super(HardwareWorker, self).__init__(name = 'HardwareWorker')
+        self.daemon = True
+        self._jobs = Queue.Queue()
+        self._pending = []
+        self._lastFlush = time.time()
+
+    def submit(self, d, func, *args, **kwargs):
+        '''Queues func(*args, **kwargs). d is fired with the result (or
+        errback'ed with the failure) in the worker thread. Returns d.'''
+        self._jobs.put((d, func, args, kwargs))
+        return d
+
+    def deliver(self, func, *args, **kwargs):
+        '''Calls func(*args, **kwargs) in the reactor thread. Calls made
+        from the worker thread are batched; the order is preserved.'''
+        if threading.current_thread() is not self:
+            reactor.callFromThread(func, *args, **kwargs)
+            return
+        self._pending.append((func, args, kwargs))
+        if (len(self._pending) >= MAXBATCH or
+            time.time() - self._lastFlush > FLUSHINTERVAL):
+            self.flush()
+
+    def flush(self):
+        '''Hands all pending deliveries to the reactor.'''
+        if self._pending:
+            reactor.callFromThread(_callAll, self._pending)
+            self._pending = []
+        self._lastFlush = time.time()
+
+    def isWorkerThread(self):
+        return threading.current_thread() is self
+
+    def run(self):
+        while True:
+            if self._pending and self._jobs.empty():
+                self.flush()
+            job = self._jobs.get()
+            if job is None:
+                self.flush()
+                return
+            d, func, args, kwargs = job
+            try:
+                result = func(*args, **kwargs)
+            except:
+                d.errback(failure.Failure())
+            else:
+                d.callback(result)
+
+    def stop(self):
+        '''Stops the worker after the queued jobs. Waits up to STOPTIMEOUT
+        seconds for it, so that it does not outlive the interpreter.'''
+        self._jobs.put(None)
+        if self.is_alive() and not self.isWorkerThread():
+            self.join(STOPTIMEOUT)
+
+
+def _callAll(calls):
+    for func, args, kwargs in calls:
+        func(*args, **kwargs)
+
+def getWorker():
+    '''Returns the worker of the server, which is started at the first
+    call and stopped when the reactor shuts down.'''
+    global WORKER
+    if WORKER is None:
+        WORKER = HardwareWorker()
+        WORKER.start()
+        reactor.addSystemEventTrigger('before', 'shutdown', WORKER.stop)
+    return WORKER
@@ -1,6 +1,7 @@
 from matplotlibwidget import MatplotlibWidget
-from matplotlib.widgets import RectangleSelector
-from matplotlib.patches import Rectangle
+from matplotlib.widgets import RectangleSelector, LassoSelector
+from matplotlib.patches import Rectangle, Polygon
+from matplotlib.path import Path
 import matplotlib.pyplot
 import matplotlib.colors
 from mpl_toolkits.mplot3d import Axes3D
@@ -22,6 +23,10 @@ class DataDisplayWidget(QtGui.QWidget):
         self.ipm = 'none'
         self.is3D = False
         self.asNewScanCallback = None
+        # Called with a boolean mask of the pixels to scan and the data
+        self.asMaskedScanCallback = None
+        self.drawRegion = False
+        self.region = None
         
         self.xlabel = 'x'
         self.ylabel = 'y'
@@ -126,6 +131,51 @@ class DataDisplayWidget(QtGui.QWidget):
             self.selection={'x':None,'y':None,'w':None,'h':None}
 
 
+    def onLasso(self, verts):
+        try:
+            self.regionPatch.remove()
+        except:
+            pass
+        if len(verts) < 3:
+            self.region = None
+            self.acAsMaskedScan.setEnabled(False)
+            return
+        self.region = Path(verts)
+        self.regionPatch = Polygon(verts, fill=False)
+        self.dataWidget.figure.axes[0].add_patch(self.regionPatch)
+        self.dataWidget.draw()
+        self.acAsMaskedScan.setEnabled(True)
+
+    def regionMask(self):
+        '''Returns the pixels within the drawn region as boolean array of
+        the shape of the data.'''
+        h, w = self.data.shape
+        y, x = numpy.mgrid[0:h, 0:w]
+        inside = self.region.contains_points(
+            numpy.column_stack((x.ravel(), y.ravel())))
+        return inside.reshape(h, w)
+
+    def rangeMask(self):
+        '''Returns the pixels whose values are within the limits of the
+        color scale as boolean array.'''
+        return (self.data >= self.minData) & (self.data <= self.maxData)
+
+    def setDrawRegion(self, chk):
+        self.drawRegion = chk
+        self._draw()
+
+    def onAsMaskedScan(self):
+        self._asMaskedScan(self.regionMask())
+
+    def onRangeAsMaskedScan(self):
+        self._asMaskedScan(self.rangeMask())
+
+    def _asMaskedScan(self, mask):
+        if self.asMaskedScanCallback is None:
+            print "No Callback set for opening a masked scan."
+            return
+        self.asMaskedScanCallback(mask, self.data)
+
     def _hasSelection(self, yn):
         self.hasSelection = yn
         self.acAsNewScan.setEnabled(yn)
@@ -165,9 +215,13 @@ class DataDisplayWidget(QtGui.QWidget):
             self.dataWidget.axes.imshow(self.data, cmap = self.cm,
                                         clim=(self.minData, self.maxData),
                                         interpolation = self.ipm)
-            self.selector = RectangleSelector(self.dataWidget.axes,
-                                              self.onSelect, button=1,
-                                              useblit = True)
+            if self.drawRegion:
+                self.selector = LassoSelector(self.dataWidget.axes,
+                                              self.onLasso, button=1)
+            else:
+                self.selector = RectangleSelector(self.dataWidget.axes,
+                                                  self.onSelect, button=1,
+                                                  useblit = True)
                 
             self.dataWidget.draw()
                 
@@ -236,6 +290,22 @@ class DataDisplayWidget(QtGui.QWidget):
         self.popMenu.addSeparator()
         self.popMenu.addAction(self.acAsNewScan)
 
+        self.acDrawRegion = QtGui.QAction("Draw region", self.popMenu)
+        self.acDrawRegion.setCheckable(True)
+        self.acDrawRegion.setChecked(False)
+        self.acDrawRegion.toggled.connect(self.setDrawRegion)
+        self.popMenu.addAction(self.acDrawRegion)
+
+        self.acAsMaskedScan = QtGui.QAction("Scan drawn region", self.popMenu)
+        self.acAsMaskedScan.triggered.connect(self.onAsMaskedScan)
+        self.acAsMaskedScan.setEnabled(False)
+        self.popMenu.addAction(self.acAsMaskedScan)
+
+        self.acRangeAsMaskedScan = QtGui.QAction(
+            "Scan pixels within color range", self.popMenu)
+        self.acRangeAsMaskedScan.triggered.connect(self.onRangeAsMaskedScan)
+        self.popMenu.addAction(self.acRangeAsMaskedScan)
+
 
     def setIP(self, ip):
         self.ipm = ip;
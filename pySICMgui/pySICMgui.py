@@ -225,7 +225,7 @@ class PySICMGuiMainWindow (QtGui.QMainWindow, Ui_PySICMGUIMainWindow,
         
     def depopulateScanmodes(self):
         self.menuScanmodes.clear()
-    def openScanModeWin(self, mode):
+    def openScanModeWin(self, mode, **kwargs):
         istool = False
         if mode.startswith('__tool__'):
             mode = "tool"+mode[8].capitalize()+mode[9:]
@@ -238,7 +238,7 @@ class PySICMGuiMainWindow (QtGui.QMainWindow, Ui_PySICMGUIMainWindow,
             if istool:
                 self._addWindow(instance(self), None, None)
             else:
-                self._addWindow(instance(self),800,600)
+                self._addWindow(instance(self, **kwargs),800,600)
         else:
             raise PySICMError('No widget found for scan mode %s' % mode)
         
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''This module implements the widget of the adaptive resolution scan
+(scanmodes/adaptiveResolution.py).
+
+The server sends the pixels as records (x, y, level, height). Until a
+pixel has been measured, it shows the nearest pixel measured on a coarser
+level of the quadtree (see pySICM.quadtree): each record is drawn as a
+block as large as the cells of its level, and finer levels draw over
+coarser ones.'''
+
+
+from PyQt4 import QtCore
+from pySICMgui.defaultScanwidget import DefaultScanWidget
+import time, datetime, numpy
+
+from pySICMgui.DataDisplayWidget import DataDisplayWidget
+try:
+    _fromUtf8 = QtCore.QString.fromUtf8
+except AttributeError:
+    def _fromUtf8(s):
+        return s
+
+
+class WidgetAdaptiveResolution(DefaultScanWidget):
+
+    # Value of the record marking the end of the scan
+    ENDRECORD = 2**16 - 1
+
+    def __init__ (self, mainwin, parent = None, **kwargs):
+        super(WidgetAdaptiveResolution, self).__init__(mainwin, parent, mode='adaptiveResolution', **kwargs)
+        self.setWindowTitle('Adaptive Resolution Scan')
+        self.populateForm()
+
+        self.addGraph('data',xlabel='x',ylabel='y')
+        self.addGraph('levels',xlabel='x',ylabel='y')
+        self.progressBar.setValue(0)
+        self.data = numpy.outer(
+            numpy.linspace(0,numpy.sqrt(256),128),
+            numpy.linspace(0,numpy.sqrt(256),128))
+        self.getGraph('data').update(self.data)
+        self.getGraph('levels').update(self.data)
+
+    def addGraph(self, name, **kwargs):
+        mpw = DataDisplayWidget()
+        self._graphs[name] = mpw
+        if name == 'levels':
+            self.dataLayout.addWidget(mpw,0,0)
+        else:
+            self.dataLayout.addWidget(mpw,0,1)
+
+    def sendSettings(self):
+        client = self.mainwin.client
+        client.sendLine('SET mode=adaptiveResolution')
+        for setting, field in self.settings.iteritems():
+            client.sendLine('SET adaptiveResolution.'+str(setting)+'='+str(field.text()))
+
+    def _prepare(self):
+        self.mainwin.serverLog=str(time.time())
+        self.sendSettings()
+        size = int(self.settings['FinalImageSize'].text())
+        self.span = int(self.settings['PrescanSpan'].text())
+        self.data = numpy.zeros((size, size), numpy.uint16)
+        # Level of the record drawn at each pixel, -1 where nothing has
+        # been drawn yet
+        self.levels = -numpy.ones((size, size), numpy.int32)
+        self.progressBar.setMaximum(size*size)
+        self.mainwin.stat.progressBar.setMaximum(size*size)
+        self.expectData(self.updateData, length = 4, form = 'int', rang=[0, 2**16])
+        self.n = 0
+        self.lastDraw = time.time()
+
+    def fake(self):
+        self._prepare()
+        self.receiveData('FAKE')
+
+    def updateData(self, data, *args):
+        x, y, level, height = [int(d) for d in data[:4]]
+        finished = x == self.ENDRECORD and y == self.ENDRECORD
+        if finished:
+            print "Scan finished, " + str(self.n) + " pixels measured"
+            self.info['client_scan_end_time'] = str(datetime.datetime.now())
+            self.unexpectData()
+        else:
+            self.n += 1
+            # Half the size of the cells of this level
+            h = self.span >> (level + 1)
+            ys = slice(max(y - h, 0), y + h + 1)
+            xs = slice(max(x - h, 0), x + h + 1)
+            block = self.levels[ys, xs] <= level
+            self.data[ys, xs][block] = height
+            self.levels[ys, xs][block] = level
+            self.data[y, x] = height
+            self.levels[y, x] = level
+
+        if time.time() - self.lastDraw > .2 or finished:
+            self.getGraph('data').update(self.data)
+            self.getGraph('levels').update(self.levels)
+            self.progressBar.setValue(self.n)
+            self.mainwin.stat.progressBar.setValue(self.n)
+            self.lastDraw = time.time()
+
+    def scan(self):
+        self._prepare()
+        self.receiveData('SCAN')
+        self.info['client_scan_start_time'] = str(datetime.datetime.now())
+
+    def stop(self):
+        self.mainwin.client.sendLine('STOP')
+        self.unexpectData()
@@ -25,6 +25,8 @@ import matplotlib.pyplot
 import matplotlib.colors
 import json, time, struct, numpy
 import pySICM.helpers as Helpers
+import pySICM.scanorder as ScanOrder
+import pySICM.detector as Detector
 try:
     _fromUtf8 = QtCore.QString.fromUtf8
 except AttributeError:
@@ -84,6 +86,8 @@ class WidgetBackstepScan(DefaultScanWidget):
         self.addLineEdit('Threshold', 'Stop threshold in percent (float)')
         self.addLineEdit('Sensitivity', 'Sensitivity in V/nA (float)')
         self.addLineEdit('Filter', 'Output filter in kHz (float)')
+        self.addLineEdit('ScanPath', 'Scan path [0: Line by line, 1: Serpentine, 2: Hilbert] (int)')
+        self.addLineEdit('Thresholds', 'Additional thresholds in percent, comma separated (0: none)')
 
     def getSetting(self, setting): 
         if setting in self.settingConvertFuncs:
@@ -99,9 +103,16 @@ class WidgetBackstepScan(DefaultScanWidget):
         self.sendSettings()
         xl = int(self.settings['x-px'].text())
         yl = int(self.settings['y-px'].text())
-        self.data = numpy.zeros((xl, yl), numpy.uint16)
+        self.data = numpy.zeros((yl, xl), numpy.uint16)
+        # Height maps at the additional thresholds
+        n = len(Detector.parseThresholds(self.settings['Thresholds'].text()))
+        self.maps = numpy.zeros((n, yl, xl), numpy.uint16)
         self.progressBar.setMaximum(xl*yl)
-        self.expectData(self.updateData, length = 1, form = 'int', rang=[0, 2**16])
+        self.expectData(self.updateData, length = 1 + n, form = 'int', rang=[0, 2**16])
+        # The pixels in the order in which the server scans them
+        self.pixels = ScanOrder.getPath(
+            int(self.settings['ScanPath'].text()), xl, yl).pixels()
+        self.n = 0
         self.x = -1
         self.y = 0
         self.min_data = None
@@ -122,20 +133,21 @@ class WidgetBackstepScan(DefaultScanWidget):
             self.min_data = data[0]
         if data[0] > self.max_data:
             self.max_data = data[0]
-        self.x+=1
-        if self.x >=  int(self.settings['x-px'].text()):
-            self.y += 1
-            self.x = 0
-        if self.y  < int(self.settings['y-px'].text()):
+        if self.n < len(self.pixels):
+            self.x, self.y = self.pixels[self.n]
             self.data[self.y, self.x] = data[0]
-        if self.x +1 == int(self.settings['x-px'].text()) and self.y +1 == int(self.settings['y-px'].text()):
+            self.maps[:, self.y, self.x] = data[1:1 + len(self.maps)]
+        self.n += 1
+        if self.n == len(self.pixels):
             print "Scan finished"
             self.unexpectData()
             fname = '/Daten/SICM/dev/testsic'+str(time.time())+'.dat'
             
             self.data.tofile(fname)
+            if len(self.maps):
+                self.maps.tofile(fname + '.thresholds')
         print "x: "+str(self.x)+" y: "+str(self.y)
-        if time.time() - self.lastDraw > .2 or self.y == int(self.settings['y-px'].text()):
+        if time.time() - self.lastDraw > .2 or self.n == len(self.pixels):
             mpw = self.getGraph('data')
             
             imgplotobj = mpw.axes.imshow(self.data, interpolation='none', cmap='hot')
@@ -146,7 +158,7 @@ class WidgetBackstepScan(DefaultScanWidget):
 #        mpw.axes.set_ylim((-5,5))
 
             mpw.draw()
-            self.progressBar.setValue(int(self.settings['x-px'].text())*self.y+self.x)
+            self.progressBar.setValue(self.n)
             self.lastDraw = time.time()
 
     def scan(self):
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''This module implements the widget of the constant height scan
+(scanmodes/constantHeight.py). The data is received line by line.'''
+
+
+from PyQt4 import QtCore
+from pySICMgui.defaultScanwidget import DefaultScanWidget
+import time, datetime, numpy
+
+from pySICMgui.DataDisplayWidget import DataDisplayWidget
+try:
+    _fromUtf8 = QtCore.QString.fromUtf8
+except AttributeError:
+    def _fromUtf8(s):
+        return s
+
+
+class WidgetConstantHeight(DefaultScanWidget):
+
+    def __init__ (self, mainwin, parent = None, **kwargs):
+        super(WidgetConstantHeight, self).__init__(mainwin, parent, mode='constantHeight', **kwargs)
+        self.setWindowTitle('Constant Height Scan')
+        self.populateForm()
+
+        self.addGraph('data',xlabel='x',ylabel='y')
+        self.progressBar.setValue(0)
+        self.data = numpy.outer(
+            numpy.linspace(0,numpy.sqrt(256),128),
+            numpy.linspace(0,numpy.sqrt(256),128))
+        self.getGraph('data').update(self.data)
+
+    def addGraph(self, name, **kwargs):
+        mpw = DataDisplayWidget()
+        self._graphs[name] = mpw
+        self.dataLayout.addWidget(mpw,0,0)
+
+    def sendSettings(self):
+        client = self.mainwin.client
+        client.sendLine('SET mode=constantHeight')
+        for setting, field in self.settings.iteritems():
+            client.sendLine('SET constantHeight.'+str(setting)+'='+str(field.text()))
+
+    def _prepare(self):
+        self.mainwin.serverLog=str(time.time())
+        self.sendSettings()
+        self.xl = int(self.settings['x-px'].text())
+        self.yl = int(self.settings['y-px'].text())
+        self.data = numpy.zeros((self.yl, self.xl), numpy.uint16)
+        self.progressBar.setMaximum(self.yl)
+        self.mainwin.stat.progressBar.setMaximum(self.yl)
+        self.expectData(self.updateData, length = self.xl + 1, form = 'int', rang=[0, 2**16])
+        self.n = 0
+
+    def fake(self):
+        self._prepare()
+        self.receiveData('FAKE')
+
+    def updateData(self, data, *args):
+        y = int(data[0])
+        self.data[y, :] = data[1:self.xl + 1]
+        self.n += 1
+        finished = self.n == self.yl
+        if finished:
+            print "Scan finished"
+            self.info['client_scan_end_time'] = str(datetime.datetime.now())
+            self.unexpectData()
+        # Lines arrive at a low rate, each one is drawn
+        self.getGraph('data').update(self.data)
+        self.progressBar.setValue(self.n)
+        self.mainwin.stat.progressBar.setValue(self.n)
+
+    def scan(self):
+        self._prepare()
+        self.receiveData('SCAN')
+        self.info['client_scan_start_time'] = str(datetime.datetime.now())
+
+    def stop(self):
+        self.mainwin.client.sendLine('STOP')
+        self.unexpectData()
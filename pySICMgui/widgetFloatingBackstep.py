@@ -25,6 +25,8 @@ import matplotlib.pyplot
 import matplotlib.colors
 import json, time, struct, numpy, datetime
 import pySICM.helpers as Helpers
+import pySICM.scanorder as ScanOrder
+import pySICM.detector as Detector
 
 from matplotlibwidget import MatplotlibWidget
 from pySICMgui.DataDisplayWidget import DataDisplayWidget
@@ -64,6 +66,7 @@ class WidgetFloatingBackstep(DefaultScanWidget):
             self.dataLayout.addWidget(mpw,0,0)
         else:
             mpw.asNewScanCallback = self.asNewScan
+            mpw.asMaskedScanCallback = self.asMaskedScan
             self.dataLayout.addWidget(mpw,0,1)
             
 
@@ -85,11 +88,19 @@ class WidgetFloatingBackstep(DefaultScanWidget):
         yl = int(self.settings['y-px'].text())
         xlp = int(self.settings['x-px-pre'].text())
         ylp = int(self.settings['y-px-pre'].text())
-        self.data = numpy.zeros((xl, yl), numpy.uint16)
-        self.prescan = numpy.zeros((xlp, ylp), numpy.uint16)
+        self.data = numpy.zeros((yl, xl), numpy.uint16)
+        self.prescan = numpy.zeros((ylp, xlp), numpy.uint16)
+        # Height maps of the main scan at the additional thresholds
+        n = len(Detector.parseThresholds(self.settings['Thresholds'].text()))
+        self.maps = numpy.zeros((n, yl, xl), numpy.uint16)
         self.progressBar.setMaximum(xlp*ylp)
         self.mainwin.stat.progressBar.setMaximum(xl*yl+xlp*ylp)
         self.expectData(self.updateData, length = 1, form = 'int', rang=[0, 2**16])
+        # The pixels in the order in which the server scans them
+        path = int(self.settings['ScanPath'].text())
+        self.prepixels = ScanOrder.getPath(path, xlp, ylp).pixels()
+        self.pixels = ScanOrder.getPath(path, xl, yl).pixels()
+        self.n = 0
         self.x = -1
         self.y = 0
         self.min_data = None
@@ -102,40 +113,37 @@ class WidgetFloatingBackstep(DefaultScanWidget):
 
     def updateData(self, data, *args):
         finished = False
-        self.x+=1
         if self.isPrescan:
-            if self.x >=  int(self.settings['x-px-pre'].text()):
-                self.y += 1
-                self.x = 0
-            if self.y  < int(self.settings['y-px-pre'].text()):
+            if self.n < len(self.prepixels):
+                self.x, self.y = self.prepixels[self.n]
                 self.prescan[self.y, self.x] = data[0]
+            self.n += 1
+            progress = self.n
+            total_progress = progress
+            mpw = self.getGraph('prescan')
+            d = self.prescan
                 
-            if self.x + 1 == int(self.settings['x-px-pre'].text()) and self.y +1 == int(self.settings['y-px-pre'].text()):
+            if self.n == len(self.prepixels):
                 print "Prescan finished"
                 self.info['client_prescan_end_timestamp'] = int( round( time.time() * 1e3 ) )
                 self.info['client_prescan_duration'] = self.info['client_prescan_end_timestamp'] - self.info['client_prescan_start_timestamp']
                 self.info['client_scan_start_timestamp'] = int( round( time.time() * 1e3 ) )
                 self.info['client_scan_start_time'] = str( datetime.datetime.now() )
-                self.x = -1
-                self.y = 0
+                self.n = 0
                 self.isPrescan = False
-                xl = int(self.settings['x-px'].text())
-                yl = int(self.settings['y-px'].text())
-                self.progressBar.setMaximum(xl*yl)
+                self.progressBar.setMaximum(len(self.pixels))
                 self.getGraph('prescan').update(self.prescan)
-
-            mpw = self.getGraph('prescan')
-            d = self.prescan
-            progress = int(self.settings['x-px-pre'].text())*self.y+self.x
-            total_progress = progress
+                # The main scan sends the heights at all thresholds
+                self.expectData(self.updateData, length = 1 + len(self.maps),
+                                form = 'int', rang=[0, 2**16])
         else:
-            if self.x >=  int(self.settings['x-px'].text()):
-                self.y += 1
-                self.x = 0
-            if self.y  < int(self.settings['y-px'].text()):
+            if self.n < len(self.pixels):
+                self.x, self.y = self.pixels[self.n]
                 self.data[self.y, self.x] = data[0]
+                self.maps[:, self.y, self.x] = data[1:1 + len(self.maps)]
+            self.n += 1
 
-            if self.x +1 == int(self.settings['x-px'].text()) and self.y +1 == int(self.settings['y-px'].text()):
+            if self.n == len(self.pixels):
                 print "Scan finished"
                 finished = True
                 self.info['client_scan_end_timestamp'] = int( round( time.time() * 1e3 ) )
@@ -145,12 +153,8 @@ class WidgetFloatingBackstep(DefaultScanWidget):
                 
             d = self.data
             mpw = self.getGraph('data')
-            total_progress = (int(self.settings['x-px-pre'].text())
-                              *int(self.settings['y-px-pre'].text())
-                              +int(self.settings['x-px'].text())
-                              *self.y+self.x)
-            
-            progress = int(self.settings['x-px'].text())*self.y+self.x 
+            total_progress = len(self.prepixels) + self.n
+            progress = self.n
 
         if time.time() - self.lastDraw > .2 or finished:
             mpw.update(d)
@@ -163,6 +167,16 @@ class WidgetFloatingBackstep(DefaultScanWidget):
 #            try:
                 
 
+    def _writeData(self):
+        ret = super(WidgetFloatingBackstep, self)._writeData()
+        if len(getattr(self, 'maps', [])):
+            fn = ret[0] + '.thresholds'
+            fo = open(fn, 'wb')
+            self.maps.tofile(fo)
+            fo.close()
+            ret.append(fn)
+        return ret
+
     def scan(self):
         self._prepare()
         self.isPrescan = True
@@ -189,3 +203,15 @@ class WidgetFloatingBackstep(DefaultScanWidget):
         settings['y-Size'] = str(round(selection['w']) * xpxsize)
         self.mainwin.openScanModeWin('floatingBackstep', data=data, settings=settings)
         print "As new scan..."
+
+    def asMaskedScan(self, mask, data):
+        settings = {}
+        for k in ['x-Size', 'y-Size', 'XOffset', 'YOffset', 'FallRate',
+                  'LateralSpeed', 'Threshold', 'Filter']:
+            settings[k] = self.settings[k].text()
+        settings['x-px'] = str(data.shape[1])
+        settings['y-px'] = str(data.shape[0])
+        settings['Backstep'] = self.settings['BackstepL'].text()
+        settings['Mask'] = ScanOrder.encodeMask(mask)
+        self.mainwin.openScanModeWin('maskedScan', data=data, settings=settings)
+        print "As masked scan..."
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''This module implements the widget of the IZ map (scanmodes/izMap.py).
+
+The records of the pixels are collected in a pySICM.izcurves.CurveMap,
+the end positions of the approaches are shown as height map. The
+recording stores the height map as the data and the curves in the file
+with the suffix .curves (see CurveMap.save and CurveMap.load).'''
+
+
+from PyQt4 import QtCore
+from pySICMgui.defaultScanwidget import DefaultScanWidget
+import time, datetime, numpy
+import pySICM.izcurves as IzCurves
+
+from pySICMgui.DataDisplayWidget import DataDisplayWidget
+try:
+    _fromUtf8 = QtCore.QString.fromUtf8
+except AttributeError:
+    def _fromUtf8(s):
+        return s
+
+
+class WidgetIzMap(DefaultScanWidget):
+
+    def __init__ (self, mainwin, parent = None, **kwargs):
+        super(WidgetIzMap, self).__init__(mainwin, parent, mode='izMap', **kwargs)
+        self.setWindowTitle('IZ Map')
+        self.populateForm()
+
+        self.addGraph('data',xlabel='x',ylabel='y')
+        self.progressBar.setValue(0)
+        self.data = numpy.outer(
+            numpy.linspace(0,numpy.sqrt(256),128),
+            numpy.linspace(0,numpy.sqrt(256),128))
+        self.getGraph('data').update(self.data)
+        self.curves = None
+
+    def addGraph(self, name, **kwargs):
+        mpw = DataDisplayWidget()
+        self._graphs[name] = mpw
+        self.dataLayout.addWidget(mpw,0,0)
+
+    def sendSettings(self):
+        client = self.mainwin.client
+        client.sendLine('SET mode=izMap')
+        for setting, field in self.settings.iteritems():
+            client.sendLine('SET izMap.'+str(setting)+'='+str(field.text()))
+
+    def _prepare(self):
+        self.mainwin.serverLog=str(time.time())
+        self.sendSettings()
+        self.xl = int(self.settings['x-px'].text())
+        self.yl = int(self.settings['y-px'].text())
+        self.data = numpy.zeros((self.yl, self.xl), numpy.uint16)
+        self.curves = IzCurves.CurveMap(int(self.settings['Decimation'].text()))
+        self.progressBar.setMaximum(self.xl * self.yl)
+        self.mainwin.stat.progressBar.setMaximum(self.xl * self.yl)
+        self.expectData(self.updateData, stop = IzCurves.STOP.astype('<u2').tostring(),
+                        form = 'byte')
+        self.lastDraw = time.time()
+
+    def fake(self):
+        self._prepare()
+        self.receiveData('FAKE')
+
+    def updateData(self, data, *args):
+        # The data of a record is preceded by the line break restored by
+        # DefaultScanWidget._dataReceivedCB
+        record = numpy.frombuffer(data[2:], '<u2')
+        self.curves.add(record)
+        (x, y, start, end, n, envelope, tail), size = IzCurves.decode(record)
+        self.data[y, x] = min(int(round(65535 * end / 1e5)), 65535)
+        finished = len(self.curves) == self.xl * self.yl
+        if finished:
+            print "Scan finished"
+            self.info['client_scan_end_time'] = str(datetime.datetime.now())
+            self.unexpectData()
+        if time.time() - self.lastDraw > .2 or finished:
+            self.getGraph('data').update(self.data)
+            self.progressBar.setValue(len(self.curves))
+            self.mainwin.stat.progressBar.setValue(len(self.curves))
+            self.lastDraw = time.time()
+
+    def _writeData(self):
+        ret = super(WidgetIzMap, self)._writeData()
+        if self.curves is not None:
+            fn = ret[0] + '.curves'
+            fo = open(fn, 'wb')
+            self.curves.save(fo)
+            fo.close()
+            ret.append(fn)
+        return ret
+
+    def scan(self):
+        self._prepare()
+        self.receiveData('SCAN')
+        self.info['client_scan_start_time'] = str(datetime.datetime.now())
+
+    def stop(self):
+        self.mainwin.client.sendLine('STOP')
+        self.unexpectData()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''This module implements the widget of the masked scan
+(scanmodes/maskedScan.py).
+
+The widget is usually opened from the image of a previous scan (see
+DataDisplayWidget), which passes the image as data and the mask in the
+settings. The pixels received as records (x, y, height) are put into the
+previous image.'''
+
+
+from PyQt4 import QtCore
+from pySICMgui.defaultScanwidget import DefaultScanWidget
+import time, datetime, numpy
+import pySICM.scanorder as ScanOrder
+
+from pySICMgui.DataDisplayWidget import DataDisplayWidget
+try:
+    _fromUtf8 = QtCore.QString.fromUtf8
+except AttributeError:
+    def _fromUtf8(s):
+        return s
+
+
+class WidgetMaskedScan(DefaultScanWidget):
+
+    def __init__ (self, mainwin, parent = None, **kwargs):
+        super(WidgetMaskedScan, self).__init__(mainwin, parent, mode='maskedScan', **kwargs)
+        self.setWindowTitle('Masked Scan')
+        self.populateForm()
+
+        self.addGraph('data',xlabel='x',ylabel='y')
+        self.progressBar.setValue(0)
+        self.prior = None
+        if kwargs and 'data' in kwargs:
+            self.prior = numpy.array(kwargs['data'], numpy.uint16)
+            self.data = self.prior
+        else:
+            self.data = numpy.outer(
+                numpy.linspace(0,numpy.sqrt(256),128),
+                numpy.linspace(0,numpy.sqrt(256),128))
+        self.getGraph('data').update(self.data)
+
+    def addGraph(self, name, **kwargs):
+        mpw = DataDisplayWidget()
+        self._graphs[name] = mpw
+        self.dataLayout.addWidget(mpw,0,0)
+
+    def sendSettings(self):
+        client = self.mainwin.client
+        client.sendLine('SET mode=maskedScan')
+        for setting, field in self.settings.iteritems():
+            client.sendLine('SET maskedScan.'+str(setting)+'='+str(field.text()))
+
+    def _prepare(self):
+        self.mainwin.serverLog=str(time.time())
+        self.sendSettings()
+        xl = int(self.settings['x-px'].text())
+        yl = int(self.settings['y-px'].text())
+        mask = ScanOrder.decodeMask(str(self.settings['Mask'].text()), xl, yl)
+        if self.prior is not None and self.prior.shape == (yl, xl):
+            self.data = self.prior.copy()
+        else:
+            self.data = numpy.zeros((yl, xl), numpy.uint16)
+        self.npixels = int(numpy.count_nonzero(mask))
+        self.progressBar.setMaximum(self.npixels)
+        self.mainwin.stat.progressBar.setMaximum(self.npixels)
+        self.expectData(self.updateData, length = 3, form = 'int', rang=[0, 2**16])
+        self.n = 0
+        self.lastDraw = time.time()
+
+    def fake(self):
+        self._prepare()
+        self.receiveData('FAKE')
+
+    def updateData(self, data, *args):
+        x, y, height = [int(d) for d in data[:3]]
+        self.data[y, x] = height
+        self.n += 1
+        finished = self.n == self.npixels
+        if finished:
+            print "Scan finished"
+            self.info['client_scan_end_time'] = str(datetime.datetime.now())
+            self.unexpectData()
+
+        if time.time() - self.lastDraw > .2 or finished:
+            self.getGraph('data').update(self.data)
+            self.progressBar.setValue(self.n)
+            self.mainwin.stat.progressBar.setValue(self.n)
+            self.lastDraw = time.time()
+
+    def scan(self):
+        self._prepare()
+        self.receiveData('SCAN')
+        self.info['client_scan_start_time'] = str(datetime.datetime.now())
+
+    def stop(self):
+        self.mainwin.client.sendLine('STOP')
+        self.unexpectData()
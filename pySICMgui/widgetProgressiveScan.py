@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''This module implements the widget of the progressive scan
+(scanmodes/progressiveScan.py).
+
+The heights arrive in the order of pySICM.scanorder.Progressive. During
+the first pass, each height is drawn as a block as large as the distance
+of the pixels. When a pass is complete, its lattice is interpolated
+bilinearly to the full image, and the pixels of the next pass are drawn
+into the interpolated image.'''
+
+
+from PyQt4 import QtCore
+from pySICMgui.defaultScanwidget import DefaultScanWidget
+import time, datetime, numpy
+import pySICM.scanorder as ScanOrder
+
+from pySICMgui.DataDisplayWidget import DataDisplayWidget
+try:
+    _fromUtf8 = QtCore.QString.fromUtf8
+except AttributeError:
+    def _fromUtf8(s):
+        return s
+
+
+class WidgetProgressiveScan(DefaultScanWidget):
+
+    def __init__ (self, mainwin, parent = None, **kwargs):
+        super(WidgetProgressiveScan, self).__init__(mainwin, parent, mode='progressiveScan', **kwargs)
+        self.setWindowTitle('Progressive Scan')
+        self.populateForm()
+
+        self.addGraph('data',xlabel='x',ylabel='y')
+        self.progressBar.setValue(0)
+        self.data = numpy.outer(
+            numpy.linspace(0,numpy.sqrt(256),128),
+            numpy.linspace(0,numpy.sqrt(256),128))
+        self.getGraph('data').update(self.data)
+
+    def addGraph(self, name, **kwargs):
+        mpw = DataDisplayWidget()
+        self._graphs[name] = mpw
+        self.dataLayout.addWidget(mpw,0,0)
+
+    def sendSettings(self):
+        client = self.mainwin.client
+        client.sendLine('SET mode=progressiveScan')
+        for setting, field in self.settings.iteritems():
+            client.sendLine('SET progressiveScan.'+str(setting)+'='+str(field.text()))
+
+    def _prepare(self):
+        self.mainwin.serverLog=str(time.time())
+        self.sendSettings()
+        xl = int(self.settings['x-px'].text())
+        yl = int(self.settings['y-px'].text())
+        order = ScanOrder.getOrder('progressive', xl, yl,
+                                   step = int(self.settings['CoarseStep'].text()))
+        # The pixels in the order in which the server scans them, and the
+        # pixel distance of their pass
+        self.pixels = order.pixels()
+        self.steps = [order.stepOf(p) for p in self.pixels]
+        # Measured heights, and the image shown
+        self.measured = numpy.zeros((yl, xl), numpy.uint16)
+        self.data = numpy.zeros((yl, xl), numpy.uint16)
+        self.interpolated = False
+        self.progressBar.setMaximum(len(self.pixels))
+        self.mainwin.stat.progressBar.setMaximum(len(self.pixels))
+        self.expectData(self.updateData, length = 1, form = 'int', rang=[0, 2**16])
+        self.n = 0
+        self.lastDraw = time.time()
+
+    def fake(self):
+        self._prepare()
+        self.receiveData('FAKE')
+
+    def interpolate(self, step):
+        '''Returns the image interpolated bilinearly from the pixels of the
+        lattice with distance step.'''
+        yl, xl = self.measured.shape
+        xs = numpy.arange(0, xl, step)
+        ys = numpy.arange(0, yl, step)
+        lattice = self.measured[::step, ::step].astype(numpy.float64)
+        rows = numpy.array([numpy.interp(numpy.arange(xl), xs, row)
+                            for row in lattice])
+        image = numpy.array([numpy.interp(numpy.arange(yl), ys, col)
+                             for col in rows.T]).T
+        return numpy.round(image).astype(numpy.uint16)
+
+    def updateData(self, data, *args):
+        if self.n >= len(self.pixels):
+            return
+        x, y = self.pixels[self.n]
+        step = self.steps[self.n]
+        self.measured[y, x] = data[0]
+        if self.interpolated:
+            self.data[y, x] = data[0]
+        else:
+            self.data[y:y+step, x:x+step] = data[0]
+        self.n += 1
+        finished = self.n >= len(self.pixels)
+        if finished or self.steps[self.n] != step:
+            # A pass is complete
+            print "Pass with pixel distance " + str(step) + " finished"
+            self.data = self.interpolate(step)
+            self.interpolated = True
+            self.lastDraw = 0
+        if finished:
+            print "Scan finished"
+            self.info['client_scan_end_time'] = str(datetime.datetime.now())
+            self.unexpectData()
+
+        if time.time() - self.lastDraw > .2 or finished:
+            self.getGraph('data').update(self.data)
+            self.progressBar.setValue(self.n)
+            self.mainwin.stat.progressBar.setValue(self.n)
+            self.lastDraw = time.time()
+
+    def scan(self):
+        self._prepare()
+        self.receiveData('SCAN')
+        self.info['client_scan_start_time'] = str(datetime.datetime.now())
+
+    def stop(self):
+        self.mainwin.client.sendLine('STOP')
+        self.unexpectData()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''This module implements the widget of the tiled scan
+(scanmodes/tiledScan.py).
+
+Each record names the tile of the pixel. Whenever a tile is complete,
+all complete tiles are stitched (pySICM.stitching) and shown; the pixels
+of the tile being scanned are drawn at the nominal position of the tile
+until then.'''
+
+
+from PyQt4 import QtCore
+from pySICMgui.defaultScanwidget import DefaultScanWidget
+import time, datetime, numpy
+import pySICM.stitching as Stitching
+
+from pySICMgui.DataDisplayWidget import DataDisplayWidget
+try:
+    _fromUtf8 = QtCore.QString.fromUtf8
+except AttributeError:
+    def _fromUtf8(s):
+        return s
+
+
+class WidgetTiledScan(DefaultScanWidget):
+
+    # Maximum deviation of the tile positions from the nominal ones, in
+    # pixels, searched when stitching
+    SEARCH = 8
+
+    def __init__ (self, mainwin, parent = None, **kwargs):
+        super(WidgetTiledScan, self).__init__(mainwin, parent, mode='tiledScan', **kwargs)
+        self.setWindowTitle('Tiled Scan')
+        self.populateForm()
+
+        self.addGraph('data',xlabel='x',ylabel='y')
+        self.progressBar.setValue(0)
+        self.data = numpy.outer(
+            numpy.linspace(0,numpy.sqrt(256),128),
+            numpy.linspace(0,numpy.sqrt(256),128))
+        self.getGraph('data').update(self.data)
+
+    def addGraph(self, name, **kwargs):
+        mpw = DataDisplayWidget()
+        self._graphs[name] = mpw
+        self.dataLayout.addWidget(mpw,0,0)
+
+    def sendSettings(self):
+        client = self.mainwin.client
+        client.sendLine('SET mode=tiledScan')
+        for setting, field in self.settings.iteritems():
+            client.sendLine('SET tiledScan.'+str(setting)+'='+str(field.text()))
+
+    def _prepare(self):
+        self.mainwin.serverLog=str(time.time())
+        self.sendSettings()
+        self.xl = int(self.settings['x-px'].text())
+        self.yl = int(self.settings['y-px'].text())
+        self.tilesx = int(self.settings['TilesX'].text())
+        self.tilesy = int(self.settings['TilesY'].text())
+        overlap = float(self.settings['Overlap'].text())/100
+        # Nominal distance of the tiles in pixels
+        self.stepx = int(round(self.xl * (1 - overlap)))
+        self.stepy = int(round(self.yl * (1 - overlap)))
+        self.tiles = {}
+        self.complete = {}
+        self.positions = {}
+        self.origin = (0, 0)
+        self.data = numpy.zeros(
+            (self.stepy * (self.tilesy - 1) + self.yl,
+             self.stepx * (self.tilesx - 1) + self.xl), numpy.uint16)
+        total = self.xl * self.yl * self.tilesx * self.tilesy
+        self.progressBar.setMaximum(total)
+        self.mainwin.stat.progressBar.setMaximum(total)
+        self.expectData(self.updateData, length = 4, form = 'int', rang=[0, 2**16])
+        self.n = 0
+        self.lastDraw = time.time()
+
+    def fake(self):
+        self._prepare()
+        self.receiveData('FAKE')
+
+    def stitch(self):
+        '''Stitches the complete tiles into self.data.'''
+        image, self.positions = Stitching.stitch(
+            self.complete, self.stepx, self.stepy, self.SEARCH)
+        valid = ~numpy.isnan(image)
+        if not valid.any():
+            return
+        # Position of the upper left corner of the image
+        self.origin = (min(p[0] for p in self.positions.itervalues()),
+                       min(p[1] for p in self.positions.itervalues()))
+        image[~valid] = numpy.min(image[valid])
+        self.data = numpy.clip(numpy.round(image), 0,
+                               2**16 - 1).astype(numpy.uint16)
+
+    def updateData(self, data, *args):
+        t, x, y, z = [int(d) for d in data[:4]]
+        tile = (t % self.tilesx, t // self.tilesx)
+        if tile not in self.tiles:
+            self.tiles[tile] = numpy.empty((self.yl, self.xl))
+            self.tiles[tile].fill(numpy.nan)
+        self.tiles[tile][y, x] = z
+        # Drawn at the position of the tile found by stitching, if known
+        px, py, pz = self.positions.get(
+            tile, (tile[0] * self.stepx, tile[1] * self.stepy, 0))
+        x0, y0 = self.origin
+        if (0 <= py - y0 + y < self.data.shape[0] and
+            0 <= px - x0 + x < self.data.shape[1]):
+            self.data[py - y0 + y, px - x0 + x] = z
+        self.n += 1
+        if not numpy.isnan(self.tiles[tile]).any():
+            print "Tile " + str(tile) + " finished"
+            self.complete[tile] = self.tiles[tile]
+            self.stitch()
+            self.lastDraw = 0
+        finished = len(self.complete) == self.tilesx * self.tilesy
+        if finished:
+            print "Scan finished"
+            self.info['client_scan_end_time'] = str(datetime.datetime.now())
+            self.unexpectData()
+
+        if time.time() - self.lastDraw > .2 or finished:
+            self.getGraph('data').update(self.data)
+            self.progressBar.setValue(self.n)
+            self.mainwin.stat.progressBar.setValue(self.n)
+            self.lastDraw = time.time()
+
+    def scan(self):
+        self._prepare()
+        self.receiveData('SCAN')
+        self.info['client_scan_start_time'] = str(datetime.datetime.now())
+
+    def stop(self):
+        self.mainwin.client.sendLine('STOP')
+        self.unexpectData()
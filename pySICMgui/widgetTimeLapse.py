@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''This module implements the widget of the time-lapse scan
+(scanmodes/timeLapse.py).
+
+The records of a frame update the image of the previous frame, which is
+shown when the frame is complete. All records are kept, so that the
+recording stores the sequence as deltas: the file of the data contains
+the last frame, the file with the suffix .deltas the records (frame, x,
+y, height) as uint16, from which every frame can be restored.'''
+
+
+from PyQt4 import QtCore
+from pySICMgui.defaultScanwidget import DefaultScanWidget
+import time, datetime, numpy
+
+from pySICMgui.DataDisplayWidget import DataDisplayWidget
+try:
+    _fromUtf8 = QtCore.QString.fromUtf8
+except AttributeError:
+    def _fromUtf8(s):
+        return s
+
+
+class WidgetTimeLapse(DefaultScanWidget):
+
+    ENDFRAME = 2**16 - 1
+
+    def __init__ (self, mainwin, parent = None, **kwargs):
+        super(WidgetTimeLapse, self).__init__(mainwin, parent, mode='timeLapse', **kwargs)
+        self.setWindowTitle('Time-Lapse Scan')
+        self.populateForm()
+
+        self.addGraph('data',xlabel='x',ylabel='y')
+        self.progressBar.setValue(0)
+        self.data = numpy.outer(
+            numpy.linspace(0,numpy.sqrt(256),128),
+            numpy.linspace(0,numpy.sqrt(256),128))
+        self.getGraph('data').update(self.data)
+
+    def addGraph(self, name, **kwargs):
+        mpw = DataDisplayWidget()
+        self._graphs[name] = mpw
+        self.dataLayout.addWidget(mpw,0,0)
+
+    def sendSettings(self):
+        client = self.mainwin.client
+        client.sendLine('SET mode=timeLapse')
+        for setting, field in self.settings.iteritems():
+            client.sendLine('SET timeLapse.'+str(setting)+'='+str(field.text()))
+
+    def _prepare(self):
+        self.mainwin.serverLog=str(time.time())
+        self.sendSettings()
+        xl = int(self.settings['x-px'].text())
+        yl = int(self.settings['y-px'].text())
+        self.frames = int(self.settings['Frames'].text())
+        self.data = numpy.zeros((yl, xl), numpy.uint16)
+        # The frame being received, and all records received
+        self.current = self.data.copy()
+        self.deltas = []
+        self.frame = 0
+        self.progressBar.setMaximum(self.frames)
+        self.mainwin.stat.progressBar.setMaximum(self.frames)
+        self.expectData(self.updateData, length = 4, form = 'int', rang=[0, 2**16])
+
+    def fake(self):
+        self._prepare()
+        self.receiveData('FAKE')
+
+    def updateData(self, data, *args):
+        frame, x, y, z = [int(d) for d in data[:4]]
+        self.deltas.append((frame, x, y, z))
+        if x != self.ENDFRAME:
+            self.current[y, x] = z
+            return
+        print "Frame " + str(frame) + " received"
+        self.data = self.current.copy()
+        self.frame = frame + 1
+        finished = self.frame >= self.frames
+        if finished:
+            print "Scan finished"
+            self.info['client_scan_end_time'] = str(datetime.datetime.now())
+            self.unexpectData()
+        self.getGraph('data').update(self.data)
+        self.progressBar.setValue(self.frame)
+        self.mainwin.stat.progressBar.setValue(self.frame)
+
+    def _writeData(self):
+        ret = super(WidgetTimeLapse, self)._writeData()
+        fn = ret[0] + '.deltas'
+        fo = open(fn, 'wb')
+        numpy.array(self.deltas, numpy.uint16).tofile(fo)
+        fo.close()
+        ret.append(fn)
+        return ret
+
+    def scan(self):
+        self._prepare()
+        self.receiveData('SCAN')
+        self.info['client_scan_start_time'] = str(datetime.datetime.now())
+
+    def stop(self):
+        self.mainwin.client.sendLine('STOP')
+        self.unexpectData()
@@ -13,138 +13,33 @@
 #
 # You should have received a copy of the GNU General Public License along with
 # pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''Adaptive resolution scan.
 
-from pySICM.setup import pysicmsetup as SETUP
-import pySICM.sicm
-import pySICM.piezo as Piezo
-import pySICM.error as PySICMError
-import pySICM.converter as Converter
-import pySICM.utils as Utils
-from scanmodes.approach import Approach
-from twisted.internet import defer, reactor, threads
-import struct
-import pycomedi.device as Device
-import pycomedi.subdevice as Subdevice
-import pycomedi.channel as Channel
-import pycomedi.constant as CONSTANTS
-import pycomedi.utility as Util
-import numpy as np
-import time
-
-class SinglePixelScan(Approach):
-    
-    def __init__(self):
-        super(SinglePixelScan, self).__init__()
-
-        self.xoffset = None
-        self.yoffset = None
-
-        self.xdimension = None
-        self.ydimension = None
-
-        self.backstep = None
-        
-        self.resolution = None
-        self.writeResponse = None
-
-        self.scan_ready_callback = None
-
-        self.skipFirst = False
-
-
-    def setResponseCallback(self, cb):
-        self.handleResponse = cb
-        
-    def setResolution(self, res):
-        self.resolution = res
-
-    def setBackstep(self, bs):
-        self.backstep = bs
-
-    def setXOffset(self, xo):
-        self.xoffset = xo
-
-    def setYOffset(self, yo):
-        self.yoffset = yo
+The scan samples the image on a coarse lattice first and then refines
+the rough areas, see pySICM.quadtree. Refinement stops when no cell is
+rougher than the option Roughness, or when the pixel or time budget is
+used up.
 
-    def setXDimension(self, xd):
-        self.xdimension = xd
+Each measured pixel is transmitted as four uint16: x, y, the level of
+the quadtree at which the pixel has been measured (0 for the lattice)
+and the height (65535 corresponding to 100 micm). As the number of
+pixels is not known in advance, the end of the scan is marked by a
+record of four times 65535.'''
 
-    def setYDimension(self, yd):
-        self.ydimension = yd
-        
-    def setWriteResponse(self, wr):
-        self.writeResponse = wr
-
-    def setSkipFirst(self, skip):
-        self.skipFirst = skip
-
-    def setWaitForLateralPos(self, wait):
-        self.wait_for_lateral_pos = wait
-
-    def setScanReadyCallback(self, cb):
-        self.scan_ready_callback = cb
-        
-    def do_scan(self):
-        self.x = -1
-        self.y = 0
-
-        if self.skipFirst:
-            self.x = 0
-
-        self.is_x_synced = False
-        self.is_y_synced = False
-        
-        self.nextDataPoint()
-
-    def increaseCounter(self):
-        self.x += 1
-        if self.x >= self.resolution:
-            self.x = 0
-            self.y += 1
-            self.y_is_synced = False
-
-        self.x_is_synced = False
-        return self.y < self.resolution
-
-    def getXPosInNM(self):
-        return self.xpiezo.converter.getConvertedNumber(
-            self.xoffset + self.x * self.xdimension / self.resolution,
-            Converter.UNIT.nm)
-
-    def getYPosInNM(self):
-        return self.ypiezo.converter.getConvertedNumber(
-            self.yoffset + self.y * self.ydimension / self.resolution,
-            Converter.UNIT.nm)
+import pySICM.sicm
+from pySICM.error import PySICMError
+import pySICM.recorder as Recorder
+import pySICM.scanengine as ScanEngine
+import pySICM.scanorder as ScanOrder
+import pySICM.quadtree as Quadtree
+import pySICM.worker as Worker
+from scanmodes.approach import PiezoScan
+from twisted.internet import defer
+import numpy as np
 
-    def nextDataPoint(self):
-        if self.increaseCounter():
-            self.setXYPos()
-            self.d = self.generateDeferred()
-            self.d.addCallback(self.handleResponse)
-            self.d.addCallback(self.nextDataPoint)
-            self._detectSurface()
-        else:
-            self.scan_ready_callback()
-        
-    def setXYPos(self):
-        if not self.is_x_synced:
-            self.xpiezo.set_pos(
-                self.getXPosInNM(),
-                wait = self.wait_for_lateral_pos
-                )
-            self.x_is_synced = True
-        if not self.is_y_synced:
-            self.ypiezo.set_pos(
-                self.getYPosInNM(),
-                wait = self.wait_for_lateral_pos
-                )
-            self.y_is_synced = True
-    
-    
-    
 
-class AdaptiveResolution (Approach):
+class AdaptiveResolution (PiezoScan, ScanEngine.PixelStrategy):
+    queueable = True
     _options = [['AdaptiveResolution.x-Size', 1, float, 
                  'Scan dimension in x-direction in micm (float)',
                  0, 0],
@@ -163,200 +58,158 @@ class AdaptiveResolution (Approach):
                 ['AdaptiveResolution.PrescanSpan', 1, int, 
                  'Prescan size in final image pixels (int)',
                  0, 5],
-                ['AdaptiveResolution.LowResolution', 1, int, 
-                 'Low resolution image size in pixels (int)',
+                ['AdaptiveResolution.Roughness', 1, float, 
+                 'Refine areas whose plane-fit residuals exceed, in nm (float)',
                  0, 6],
+                ['AdaptiveResolution.PixelBudget', 1, int, 
+                 'Maximum number of pixels, 0 for no limit (int)',
+                 0, 7],
+                ['AdaptiveResolution.TimeBudget', 1, float, 
+                 'Maximum duration in s, 0 for no limit (float)',
+                 0, 8],
                 ['AdaptiveResolution.Backstep', 1, float, 
-                 'Large backstep in micm (float)',
+                 'Backstep in micm (float)',
                  1, 0],
-                ['AdaptiveResolution.MinimumBackstep', 1, float, 
-                 'Minimum backstep in micm (float)',
+                ['AdaptiveResolution.LateralSpeed', 1, int, 
+                 'Lateral movement rate in nm/ms (int)',
                  1, 1],
-                ['AdaptiveResolution.startXMoveFraction', 1, float, 
-                 'Start moving in x-direction if this percentage of the backstep was retracted, in percent (float)',
+                ['AdaptiveResolution.Filter', 1, float, 
+                 'Output filter in kHz (float)',
                  1, 2],
-                ['AdaptiveResolution.startApproachFraction', 1, float, 
-                 'Start approaching if this percentage of the x-step was performed, in percent (float)',
-                 1, 3],
                 ['AdaptiveResolution.OffsetX', 1, float, 
                  'X-Offset in micm (float)',
                  1, 4],
                 ['AdaptiveResolution.OffsetY', 1, float, 
                  'Y-Offset in micm (float)',
                  1, 5],
-                ['AdaptiveResolution.RetractFirst', 1, bool, 
-                 'Retract Z-Piezo before starting scan (0:No, 1:Yes)',
+                ['AdaptiveResolution.RetractFirst', 1, int, 
+                 'Retract Z-Piezo before starting scan [0: No, 1: Yes] (int)',
                  1, 6]
                 ]
     mode = 'adaptiveResolution'
 
-    def __init__(self):
-        super(AdaptiveResolution, self).__init__()
-        self.threshold = None
-
-    def settingsPercent2Fraction(self, keys):
-        for k in keys:
-            self._config[k]/=100
-
-    def settingsMicm2Nm(self, keys):
-        for k in keys:
-            self._config[k]*=1e3
-
+    # Value of the record marking the end of the scan
+    ENDRECORD = 2**16 - 1
 
     def scan (self, settings, writeResponse):
+        self.writeResponse = writeResponse
+        self.initPiezos()
         if self.checkAndSetConfig(settings):
-            self.settingsPercent2Fraction([
-                'startXMoveFraction',
-                'Threshold', 'startApproachFraction'])
-            self.settingsMicm2Nm([
-                'XOffset','YOffset','Backstep',
-                'MinimumBackstep','x-Size','y-Size'])
-            self.writeResponse = writeResponse
-            self.setup()
-            self.do_scan()
+            self._config['Threshold']/=100
+            self.stop = False
+            self.retract = False
+            self.boost = False
+            size = self.getConfig('FinalImageSize')
+            self.deltax = 1e3*self.getConfig('x-Size')/float(size)
+            self.deltay = 1e3*self.getConfig('y-Size')/float(size)
+            self.xoffset = 1e3*self.getConfig('OffsetX')
+            self.yoffset = 1e3*self.getConfig('OffsetY')
+            self.planner = Quadtree.Planner(
+                size, size, self.getConfig('PrescanSpan'))
+            self.lastPixel = None
+            self.maxHeight = 0
+            self.worker = Worker.getWorker()
+            d = defer.Deferred()
+            d.addCallback(self.scanFinished)
+            d.addErrback(self.handleError)
+            self.worker.submit(d, self.do_scan)
         else:
             print "Configuration not correct"
+            self.notifyFailed(PySICMError('Configuration not correct'))
 
-    def setup(self):
-        self._init_internals()
-        
-        self.x = -1
-        self.y = 0
-
-        self.x_is_synced = False
-        self.y_is_synced = False
-
-        self.corner_counter = 0
-
-        fullRes = self.getConfig('FinalImageSize')
-        self.resolution = fullRes / self.getConfig('PrescanSpan')
-        
-        self.xoffset = self.getConfig('OffsetX')
-        self.yoffset = self.getConfig('OffsetY')
-
-        self.prescan_dim_x = self.getConfig('x-Size') / float(self.resolution)
-        self.prescan_dim_y = self.getConfig('y-Size') / float(self.resolution)
-        
-        self.highres = fullRes / self.resolution
-        self.lowres = self.getConfig('LowResolution') / self.resolution
-
-        self.data = numpy.zeros((fullRes, fullRes))
-        self.data[:] = numpy.nan
-
-        self.init_scanner()
-
-        
-
-    def init_scanner(self):
-        s = SinglePixelScan()
-        s.setXOffset(self.XOffset)
-        s.setYOffset(self.YOffset)
-        s.setXDimension(self.prescan_dim_x)
-        s.setYDimension(self.prescan_dim_y)
-        s.setWaitForLateralPos(self.getConfig('startApproachFraction'))
-        s.setResponseCallback(self.handleResponse)
-        self.scanner = s
-
-    def setXYPos(self):
-        if not self.x_is_synced:
-            self.xpiezo.set_pos(
-                self.xpiezo.getConvertedNumber(
-                    self.xoffset +
-                    (self.x + self.corner_counter % 2) * self.prescan_dim_x,
-                    Converter.UNIT.nm
-                ),
-                wait = self.getConfig('startApproachFraction'))
-            self.x_is_synced = True
-        if not self.y_is_synced:
-            self.ypiezo.set_pos(
-                self.ypiezo.getConvertedNumber(
-                    self.yoffset +
-                    (self.y + self.corner_counter // 2) * self.prescan_dim_y,
-                    Converter.UNIT.nm
-                ),
-                wait = self.getConfig('startApproachFraction'))
-            self.y_is_synced = True
-        
     def do_scan(self):
-        self.nextDataPoint()
-
-    def increaseCounter(self):
-        self.corner_counter += 1
-        self.corner_counter %= 4
-        if self.corner_counter == 0:
-            self.x += 1
-            if self.x >= self.resolution:
-                self.x = 0
-                self.y += 1
-        return self.corner_counter > 0
-
-    def finished(self):
-        return self.y >= self.resolution
-
-    def handleResponse(self, response):
-        px_x = self.x * self.getConfig('PrescanSpan')
-        px_y = self.y * self.getConfig('PrescanSpan')
-        pos = response['end_pos']
-        self.data[px_x, px_y] = pos
-        
-        s = Utils.mkByte(px_x) + Utils.mkByte(px_y) + Utils.mkByte(pos, r = 24)
-        
-        self.writeResponse(s)
-
-    def computePlaneCoeffsFromPoints(self, p1, p2, p3):
-        xv1 = p2[1] - p1[1]
-        yv1 = p2[2] - p1[2]
-        zv1 = p2[3] - p1[3]
-
-        xv2 = p3[1] - p1[1]
-        yv2 = p3[2] - p1[2]
-        zv2 = p3[3] - p1[3]
-
-        cross = numpy.cross([xv1, yv1, zv1], [xv2, yv2, zv2])
-
-        cross.append(-1*(cross[0] * p1[0] + cross[1]*p1[1] + cross[2]*p1[2]))
-        return cross
-    
-    def computeResolution(self):
-
-        shift = self.getConfig('PrescanSpan')
-
-        p = []
-
-        for x,y in [(self.x, self.y), (self.x + shift, self.y),
-                    (self.x, self.y + shift), (self.x + shift, self.y + shift)]:
-            p.append((x, y, data[x,y])
-
-        all_coeffs = [self.computePlaneCoeffsFromPoints(p[0], p[1], p[2]),
-                      self.computePlaneCoeffsFromPoints(p[0], p[1], p[3]),
-                      self.computePlaneCoeffsFromPoints(p[0], p[2], p[3]),
-                      self.computePlaneCoeffsFromPoints(p[1], p[2], p[3])]
-        points = [p3, p2, p1, p0]
-        diffs = []
-        for i in xrange(4):
-            a = all_coeffs[i][0]
-            b = all_coeffs[i][1]
-            c = all_coeffs[i][2]
-            d = all_coeffs[i][3]
-            z = (-d - c * points[i][0] - b * points[i][1]) / c
-            diffs.append(self.data[self.x + (i % 2) * shift, self.y + (i // 2) * shift] - z)
-        
-        
-    def nextDataPoint(self):
-        if self.increaseCounter():
-            self.setXYPos()
-            self.d = threads.deferToThread(
-                self._detectSurface, returnPos = True, returnData = False
-                )
-            self.d.addCallback(self.handleResponse)
-            self.d.addCallback(self.nextDataPoint)
-        else:
-            res = self.computeResolution()
-            self.scanner.setResolution(res)
-            self.scanner.setXOffset(self.xoffset + self.x * self.prescan_dim_x)
-            self.scanner.setYOffset(self.yoffset + self.y * self.prescan_dim_y)
-            self.scanner.setScanReadyCallback(self.nextDataPoint)
-            self.scanner.do_scan()
-            
-            
-        
+        '''Scans the lattice and refines it until no cell is rough enough
+        or the budget is used up. Blocks, has to be called in the worker
+        thread. Returns False if the scan has been stopped.'''
+        self.readFrequency = self.getReadFrequency()
+        self.startTime = Recorder.now()
+        if not self._scanPoints(self.planner.prescan(), 0):
+            return False
+        self.planner.rate()
+        while not self.budgetUsed():
+            cell = self.planner.next(self.getConfig('Roughness'))
+            if cell is None:
+                break
+            points, children = cell.split()
+            if not self._scanPoints(points, cell.level + 1):
+                return False
+            self.planner.rate(children)
+        return True
+
+    def _scanPoints(self, points, level):
+        points = self.planner.plan(points, level)
+        budget = self.getConfig('PixelBudget')
+        if budget > 0:
+            points = points[:max(budget - self.planner.measured(), 0)]
+        engine = ScanEngine.ScanEngine(points, self, self.writeResponse,
+                                       self.worker)
+        return engine.run()
+
+    def budgetUsed(self):
+        budget = self.getConfig('PixelBudget')
+        if budget > 0 and self.planner.measured() >= budget:
+            print "Pixel budget used up"
+            return True
+        duration = self.getConfig('TimeBudget')
+        if duration > 0 and Recorder.now() - self.startTime >= duration:
+            print "Time budget used up"
+            return True
+        return False
+
+    def moveToPixel(self, pixel, previous):
+        # Each refinement is scanned by its own engine, so previous is
+        # taken from the last pixel of the entire scan
+        previous = self.lastPixel
+        self.x, self.y = pixel
+        if previous is None:
+            if (self.getConfig('RetractFirst') == 1 and
+                self.zpiezo.current_nm() + 20 < 1e5):
+                self.zpiezo.ramp_to_nm_target(
+                    1e5, self.getConfig('LateralSpeed'), block = True)
+        elif not ScanOrder.adjacent(previous, pixel):
+            # Pixels far apart are connected above everything measured
+            # so far
+            self.zpiezo.ramp_to_nm_target(
+                min(self.maxHeight + self.getConfig('Backstep')*1e3, 1e5),
+                self.getConfig('LateralSpeed'), block = True)
+        if previous is None or previous[1] != self.y:
+            self.ypiezo.ramp_to_nm_target(
+                self.yoffset + self.y * self.deltay,
+                self.getConfig('LateralSpeed'), block = True)
+        if previous is None or previous[0] != self.x:
+            self.xpiezo.ramp_to_nm_target(
+                self.xoffset + self.x * self.deltax,
+                self.getConfig('LateralSpeed'), block = True)
+
+    def measurePixel(self, pixel):
+        r = self._detectSurface(returnPos = True, returnData = False,
+                                updateFrequency = False)
+        pos = r['end_pos']
+        print "Position: "+str(self.x) + " " + str(self.y) + " " +str(pos)
+        self.planner.record(pixel, pos)
+        if self.maxHeight < pos:
+            self.maxHeight = pos
+        return pos
+
+    def encodePixel(self, pixel, pos):
+        if pos > 100000:
+            pos = 100000
+        return (self.mkByte(pixel[0]) + self.mkByte(pixel[1]) +
+                self.mkByte(self.planner.levels[pixel]) +
+                self.mkByte(int(round(np.iinfo(np.uint16).max*pos/100000))))
+
+    def leavePixel(self, pixel, pos, nextPixel):
+        self.lastPixel = pixel
+        pos += self.getConfig('Backstep')*1e3
+        if pos > 1e5:
+            pos = 1e5
+        self.zpiezo.ramp_to_nm_target(pos,
+                                      self.getConfig('LateralSpeed'),
+                                      block = True)
+
+    def scanFinished(self, completed):
+        if completed:
+            print str(self.planner.measured()) + " pixels measured"
+        self.worker.deliver(self.writeResponse,
+                            self.mkByte(self.ENDRECORD) * 4)
+        super(AdaptiveResolution, self).scanFinished(completed)
@@ -19,10 +19,12 @@ from pySICM.setup import pysicmsetup as SETUP
 from pySICM.converter import UNIT, CHANNEL
 from twisted.internet import defer, reactor, threads
 from pySICM.error import PySICMError
+from pySICM.detector import ThresholdDetector, parseThresholds
+import pySICM.recorder as Recorder
+import pySICM.ramps as Ramps
 
 import struct
-import pycomedi.constant as CONSTANTS
-import pycomedi.utility as Util
+from pySICM.comedi import constant as CONSTANTS, utility as Util
 import numpy as np
 import time
 
@@ -46,12 +48,30 @@ class Approach (pySICM.sicm._SICMMeasurement):
                  0,4],
                 ['Approach.Boost',1, int,
                  'Use Booster to retract pipette? (0: No, 1: Yes)',
-                 0,5]
+                 0,5],
+                ['Approach.Streaming',1, int,
+                 'Read current by a timed command? (0: No, 1: Yes)',
+                 0,6],
+                ['Approach.StopCount',1, int,
+                 'Stop after this number of values below threshold (int)',
+                 0,7],
+                ['Approach.Hysteresis',1, float,
+                 'Hysteresis in percent of the threshold (float)',
+                 0,8]
         ]
 
     mode = 'approach'
 
-    
+    # Whether the current is acquired by a timed command, set by
+    # detectSurface from the option Streaming
+    streaming = False
+    # Parameters of the ThresholdDetector, set by detectSurface from the
+    # options StopCount and Hysteresis (fraction of the threshold)
+    stopCount = 3
+    hysteresis = 0.0
+    # Additional thresholds (fractions, like the option Threshold) whose
+    # crossings are returned by _detectSurface, see setThresholds
+    thresholds = []
 
     def __init__(self):
         super(Approach, self).__init__()
@@ -82,14 +102,10 @@ class Approach (pySICM.sicm._SICMMeasurement):
             self.signal = inp
 
     def getReadFrequency(self):
-        c = 0
-        start = time.time()
-        while c < 2**15:
-            n = self.signal.read()
-            c += 1
-        end = time.time()
-        print('frequency: ' + str(2**15/(end-start)))
-        return 2**15/(end-start)
+        '''Returns the estimated read frequency of the signal. It is
+        measured at the first call only, and refined by each polled
+        approach.'''
+        return self.signal.rate.frequency()
         
 
     def scan(self, settings, writeResponse):
@@ -109,7 +125,9 @@ class Approach (pySICM.sicm._SICMMeasurement):
         self.boost = self.getConfig('Boost') == 1
         if self.boost:
             self.booster.home()
-        self.readFrequency = self.getReadFrequency()
+        self.configureApproach()
+        if not self.streaming:
+            self.readFrequency = self.getReadFrequency()
         self.d = threads.deferToThread(
             self._detectSurface, returnPos = True)
         # print "I am back from '_detectSurface'"
@@ -118,12 +136,70 @@ class Approach (pySICM.sicm._SICMMeasurement):
 
     def handleError(self, error):
         print str(error)
+        self.notifyFailed(error)
         raise PySICMError('An error occured!')
 
-    def getThresholdInBits(self, i_zero):
-        
-        threshold_volts = self.signal.toPhysical(i_zero) * self.getConfig('Threshold')
+    def configureApproach(self):
+        '''Sets the instance attributes controlling the approach from the
+        options of the mode.'''
+        self.streaming = self.useStreaming()
+        self.stopCount = self.getConfig('StopCount')
+        self.hysteresis = self.getConfig('Hysteresis') / 100.0
+
+    def makeDetector(self, threshold, average, size):
+        '''Returns the ThresholdDetector of an approach.'''
+        return ThresholdDetector(threshold, count = self.stopCount,
+                                 hysteresis = threshold * self.hysteresis,
+                                 average = average, size = size)
+
+    def useStreaming(self):
+        '''Whether the current should be acquired by a timed command on
+        the analog input (see _streamApproach). This requires that the
+        option aistarttrigger is set for the device of the input signal,
+        otherwise the current is read in a loop.'''
+        if self.getConfig('Streaming') != 1:
+            return False
+        if self._aiStartTrigger() is None:
+            print ("No aistarttrigger configured for the device of the "+
+                   "input signal, reading the current in a loop.")
+            return False
+        return True
+
+    def _aiStartTrigger(self):
+        device = self.signal.channel.subdevice.device
+        for dev in SETUP.instrument['devices'].itervalues():
+            if dev['board'] is device:
+                return dev['aistarttrigger']
+        return None
+
+    def getThresholdInBits(self, i_zero, fraction = None):
+        if fraction is None:
+            fraction = self.getConfig('Threshold')
+        threshold_volts = self.signal.toPhysical(i_zero) * fraction
         return self.signal.toBits(threshold_volts)
+
+    def setThresholds(self, text):
+        '''Sets the additional thresholds from text, comma separated
+        percentages (see pySICM.detector.parseThresholds).'''
+        self.thresholds = parseThresholds(text)
+
+    def crossingPositions(self, data, thresholds, start, end):
+        '''Returns the positions (in nm) at which the thresholds (in
+        bits) are first crossed by the averages data of an approach from
+        start to end, using the same rule as the stop of the approach.
+        The averages are taken at equidistant positions. The position is
+        None for thresholds that have not been crossed. A threshold which
+        is already crossed at the start (the backstep of a hopping scan
+        is too small for it) is found at the start of the approach.'''
+        positions = []
+        for threshold in thresholds:
+            detector = self.makeDetector(threshold, 1, 0)
+            if detector.feed(data):
+                positions.append(start + (end - start) * detector.n /
+                                 float(len(data)))
+            else:
+                positions.append(None)
+        return positions
     
     def _detectSurface(self, returnPos = False, returnData = True, 
                        updateFrequency = True, currPos = None,
@@ -143,6 +219,16 @@ class Approach (pySICM.sicm._SICMMeasurement):
           target (int16, defaults None): The target position of the
             approach curve. If none, it is determined as the maximum
             deflection of the piezo.
+          threshold (defaults None): The stop threshold in bits. If none,
+            it is computed from the current before the approach and the
+            option Threshold.
+
+          If additional thresholds are set (see setThresholds), the
+          approach goes on until the lowest of all thresholds is
+          crossed, and if returnPos is True, appData['crossings'] holds
+          the positions (in nm) at which the threshold and the
+          additional thresholds have been crossed first (see
+          crossingPositions).
 
           If returnPos and returnData both are set to True, the first
           four bytes of the data will indicate the start position of the
@@ -151,11 +237,8 @@ class Approach (pySICM.sicm._SICMMeasurement):
         '''
         
         # Update the read frequency, if requested
-        if updateFrequency:
+        if updateFrequency and not self.streaming:
             self.readFrequency = self.getReadFrequency()
-        npoints = np.floor(self.readFrequency / (1e3*self.getConfig('Filter')))
-        if npoints < 1:
-            npoints = 1
         # If currPos is not provided, read it
         if currPos is None:
             currPos = self.piezo.current_pos()
@@ -174,40 +257,20 @@ class Approach (pySICM.sicm._SICMMeasurement):
         per_nm = float(e.get_oBits() - s.get_oBits())/10000.0
         speed_in_bits_per_s = float(per_nm) * self.getConfig('FallRate') * 1e3
 
-        # Now a problem occurs. We might have to write more bits than fit in the buffer,
-        # but we need to read the input channel as fast as possible. Reading the input
-        # channel in a while loop to seems to block other threads, hence writing the
-        # data to the buffer in a second thread does not help. We omit every second value
-        # if the apporach data is too large.
-
-        # Buffer size in uint16
-
-        b_size = self.piezo._ao.get_buffer_size() / np.dtype(np.uint16).itemsize
-
-
-        # Check whether the data range is too large:
-
-        if abs(dist) > b_size:
-            f = np.sign(dist) * 2
-        else:
-            f = np.sign(dist)
-
-
-        speed_in_bits_per_s/= np.abs(f)
+        # Ramps longer than the buffer of the board are fed while the
+        # command is running (see PiezoControl.load_ramp), so the ramp
+        # always moves by one bit per step.
+        f = np.sign(dist)
 
         # Compute the ramp data
-        start = int(currPos.get_oBits()) + int(np.sign(f))
+        start = int(currPos.get_oBits()) + int(f)
         ende = int(target.get_oBits())
         print "Ramp info:"
         print "====================="
         print "From "+str(start)+" (in bits: "+str(currPos.get_oBits())+")"
         print "To "+str(target)+" (in bits: "+str(target.get_oBits())+")"
         print "====================="
-        ramp_data = np.array(
-            xrange(start, ende, 
-                   int(f)), np.uint16)
-        if ramp_data[-1] != int(target.get_oBits()) and len(ramp_data) < b_size:
-            np.append(ramp_data, int(target.get_oBits()))
+        ramp_data = Ramps.ramp(start, ende)
         
         print str(ramp_data)
 
@@ -216,54 +279,28 @@ class Approach (pySICM.sicm._SICMMeasurement):
         self._prepareApproachCommand(len(ramp_data), speed_in_bits_per_s)
 
         # Compute the threshold
-        if threshold is None:
+        if threshold is None or self.thresholds:
             i_zero = self.signal.read_n(10)
             
             signal =int(np.mean(i_zero))
+        if threshold is None:
             threshold = self.getThresholdInBits(signal)
         print ('Threshold is ' + str(threshold));
-        # Compute maximum number of points to be read
-        max_points = int(2*round(abs(dist)  * float(self.readFrequency) /
-                               float(speed_in_bits_per_s))/npoints)
-        data = np.zeros(max_points,np.uint16)
-
-        # Issue the command
-
-        self.piezo._ao.command()
+        thresholds = [threshold] + [self.getThresholdInBits(signal, f)
+                                    for f in self.thresholds]
+        # The approach stops at the lowest threshold
+        stop_threshold = min(thresholds)
 
-        # Write data to the buffer:
-
-        ramp_data.tofile(self.piezo._ao.device.file)
-        self.piezo._ao.device.file.flush()
-
-        c = 0
-
-        # Run the loop
-
-        # Booster down
-        if self.boost and c < max_points:
-            self.booster.home()
-        time.sleep(0.001)
-        n = 0
-        q = 0
         start = time.time()
-        while c < max_points:
-            if c < 1:
-                self.piezo._ao.device.do_insn(Util.inttrig_insn(self.piezo._ao))
-            signal = np.mean(self.signal.read_n(npoints))
-            data[c] = np.floor(signal)
-            c += 1
-            
-            if signal <= threshold:
-                n = n + 1
-                q = q + 1;
-            else:
-                n = 0
-            if n > 2:
-               break
+        if self.streaming:
+            c, max_points, data, stop_z = self._streamApproach(
+                ramp_data, stop_threshold)
+        else:
+            c, max_points, data = self._pollApproach(
+                ramp_data, stop_threshold, abs(dist) / speed_in_bits_per_s)
+            stop_z = None
 
         # Boost up
-        print ('q is '+str(q))
         if self.boost and c < max_points:
             self.booster.up()
           
@@ -272,9 +309,14 @@ class Approach (pySICM.sicm._SICMMeasurement):
         self.piezo.stop()
 
 
-        # Read position
+        # Read position. When streaming, the position commanded at the
+        # detection is known exactly.
         if returnPos:
-            pos = self.piezo.current_pos()
+            if stop_z is not None:
+                pos = self.piezo.converter.getConvertedNumber(
+                    stop_z, UNIT.bits, CHANNEL.outp)
+            else:
+                pos = self.piezo.current_pos()
 
         
         if c == max_points:
@@ -302,12 +344,157 @@ class Approach (pySICM.sicm._SICMMeasurement):
             st = None
             en = None
 
+        crossings = None
+        if returnPos and self.thresholds:
+            crossings = self.crossingPositions(data[:c], thresholds, st, en)
+
         appData = {
             'data' : ret,
             'threshold_detected' : c < max_points,
             'start_pos' : st,
-            'end_pos' : en}
+            'end_pos' : en,
+            'stop_z' : stop_z,
+            'crossings' : crossings}
         return appData
+
+    def _pollApproach(self, ramp_data, threshold, duration):
+        '''Starts the ramp and reads the current in a loop, averaging
+        over the number of reads that fits in one filter period (as
+        estimated by getReadFrequency). The timing of the reads updates
+        the estimate.
+
+        Returns the number of averaged values read, the maximum number
+        of values and the values.'''
+
+        npoints = int(self.readFrequency / (1e3*self.getConfig('Filter')))
+        if npoints < 1:
+            npoints = 1
+        # Compute maximum number of points to be read. Reading should not
+        # get faster than the upper estimate of the rate.
+        rate = max(self.signal.rate.upper(), self.readFrequency)
+        max_points = int(np.ceil(1.25 * duration * rate / npoints))
+        detector = self.makeDetector(threshold, npoints, max_points)
+
+        # Issue the command
+
+        self.piezo._ao.command()
+
+        # Write data to the buffer:
+
+        self.piezo.load_ramp(ramp_data)
+
+        # Booster down
+        if self.boost:
+            self.booster.home()
+        time.sleep(0.001)
+        self.piezo.trigger_ramp()
+
+        # Run the loop
+        start = Recorder.now()
+        while detector.n < max_points:
+            if detector.feed(self.signal.read_n(npoints)):
+                break
+        self.signal.rate.update(detector.n * npoints, Recorder.now() - start)
+        return detector.n, max_points, detector.data()
+
+    def _streamApproach(self, ramp_data, threshold):
+        '''Starts the ramp together with a timed command on the analog
+        input. The AI command is started by the start of the AO command
+        (external trigger aistarttrigger), so that both share the same
+        start time. The AI is clocked at an integer multiple of the AO rate
+        (as fast as the board allows), so that each sample belongs to a
+        known z position. The samples are averaged over one filter period.
+        At least one filter period is read from the buffer of the board at
+        a time, or all complete periods that are available.
+
+        Returns the number of blocks read, the maximum number of blocks,
+        the block averages and the AO value (in bits) commanded at the
+        end of the block at which the threshold was detected (None if it
+        was not detected).'''
+
+        ao = self.piezo._ao
+        ai = self.signal.channel.subdevice
+        ao_period = float(ao.cmd.scan_begin_arg)
+        m, ai_period = self._prepareStreamCommand(ao_period, len(ramp_data))
+
+        block = int(round(1e6 / (self.getConfig('Filter') * ai_period)))
+        if block < 1:
+            block = 1
+        total = len(ramp_data) * m
+        max_points = int(np.ceil(total / float(block)))
+        detector = self.makeDetector(threshold, block, max_points)
+        itemsize = np.dtype(np.uint16).itemsize
+        print ("Streaming approach: " + str(1e9 / ai_period) + " Hz, " +
+               str(m) + " samples per step, " + str(block) +
+               " samples per block")
+
+        ai.command()
+        ao.command()
+        self.piezo.load_ramp(ramp_data)
+
+        # Booster down
+        if self.boost:
+            self.booster.home()
+        time.sleep(0.001)
+        self.piezo.trigger_ramp()
+
+        read = 0
+        stop_z = None
+        while read < total:
+            available = ai.get_buffer_contents() // itemsize
+            n = min(max(1, available // block) * block, total - read)
+            samples = self._readStream(n, ai_period)
+            if len(samples) == 0:
+                break
+            read += len(samples)
+            if detector.feed(samples):
+                step = int((detector.samples() - 1) * ai_period / ao_period)
+                stop_z = int(ramp_data[min(step, len(ramp_data) - 1)])
+                break
+        ai.cancel()
+        return detector.n, max_points, detector.data(), stop_z
+
+    def _prepareStreamCommand(self, ao_period, steps):
+        '''Prepares a timed command on the analog input of the signal
+        which is started by the start of the AO command (external trigger
+        aistarttrigger) and reads the signal during steps samples of the
+        AO command, whose period is ao_period (in ns). The AI is clocked
+        at an integer multiple of the AO rate, as fast as the board
+        allows, so that each sample belongs to a known AO sample.
+
+        Returns the number of AI samples per AO sample and the period of
+        the AI command in ns (the board may have adjusted it).'''
+        ai = self.signal.channel.subdevice
+        fastest = ai.get_cmd_generic_timed(1, 0).scan_begin_arg
+        m = max(1, int(ao_period // fastest))
+        cmd = ai.get_cmd_generic_timed(1, int(ao_period // m))
+        cmd.chanlist = [self.signal.channel]
+        cmd.start_src = CONSTANTS.TRIG_SRC.ext
+        cmd.start_arg = self._aiStartTrigger()
+        cmd.stop_src = CONSTANTS.TRIG_SRC.count
+        cmd.stop_arg = steps * m
+        ai.cmd = cmd
+        ai.command_test()
+        return m, float(ai.cmd.scan_begin_arg)
+
+    def _readStream(self, n, ai_period):
+        '''Reads n samples of the running AI command prepared by
+        _prepareStreamCommand from the device file, blocking until they
+        are available. Fewer samples are returned if the command ended.'''
+        device = self.signal.channel.subdevice.device
+        itemsize = np.dtype(np.uint16).itemsize
+        raw = ''
+        while len(raw) < n * itemsize:
+            chunk = device.file.read(n * itemsize - len(raw))
+            if not chunk:
+                break
+            raw += chunk
+        samples = np.frombuffer(raw, np.uint16)
+        if len(samples):
+            Recorder.record(Recorder.AI_STREAM, device,
+                            self.signal.channel.index, samples,
+                            ai_period * 1e-9)
+        return samples
         
 
 
@@ -365,3 +552,41 @@ class Approach (pySICM.sicm._SICMMeasurement):
         self.piezo._ao.cmd = cmd
         self.piezo._ao.command_test()
         
+
+
+class PiezoScan (Approach):
+    '''Base of the scan modes that move the pipette over the sample. It
+    looks up the piezos and the input signal and returns the piezos home
+    when the scan ends; errors are reported by Approach.handleError.
+    Subclasses implement the scan itself and call initPiezos before
+    moving anything.'''
+
+    def __init__(self):
+        super(PiezoScan, self).__init__()
+        self.stop = False
+
+    def initPiezos(self):
+        for con in SETUP.instrument['controllables'].itervalues():
+            if con.z():
+                self.zpiezo = con.z()
+            if con.x():
+                self.xpiezo = con.x()
+            if con.y():
+                self.ypiezo = con.y()
+        for inp in SETUP.instrument['inputsignals'].itervalues():
+            self.signal = inp
+        # Approach._detectSurface expects the z-piezo in self.piezo
+        self.piezo = self.zpiezo
+
+    def homePiezos(self):
+        self.zpiezo.home()
+        self.xpiezo.set_nm(0)
+        self.ypiezo.set_nm(0)
+
+    def scanFinished(self, completed):
+        if completed:
+            print "Scan finished"
+        else:
+            print "Stop"
+        self.homePiezos()
+        self.notifyFinished(completed)
@@ -1,16 +1,14 @@
 import pySICM.piezo as Piezo
 from twisted.internet import defer, reactor, threads
 import struct
-import pycomedi.device as Device
-import pycomedi.subdevice as Subdevice
-import pycomedi.channel as Channel
-import pycomedi.constant as CONSTANTS
-import pycomedi.utility as Util
+from pySICM.comedi import device as Device, subdevice as Subdevice, \
+    channel as Channel, constant as CONSTANTS, utility as Util
 import numpy as np
 import time
 import re
 import pyAPT.pt1
 from pySICM.setup import pysicmsetup as SETUP
+import pySICM.recorder as Recorder
 from scanmodes.approach import Approach
 
 class AutomaticApproach (Approach):
@@ -53,20 +51,9 @@ class AutomaticApproach (Approach):
 #            self.makeContact()
 
     def calibrate(self):
-        f = []
-        for i in range(0,4):
-            j = 0
-            s = time.time()
-            while j < 2**15:
-                self.signal.read()
-                j += 1
-            e = time.time()
-            f.append(float(2**15/(e-s)))
-
-        m_freq = np.mean(f)
-        s_freq = np.std(f)
-
-        freq = m_freq + 5*s_freq
+        rate = self.signal.rate
+        rate.frequency()
+        freq = rate.mean() + 5*rate.jitter()
         
         if freq < 10000:
             print "Reading data with less than 10kHz."
@@ -98,7 +85,9 @@ class AutomaticApproach (Approach):
         self.generateDeferred()
         self.retract = True
         self.boost = True
-        self.readFrequency = self.getReadFrequency()
+        self.configureApproach()
+        if not self.streaming:
+            self.readFrequency = self.getReadFrequency()
         self.d = threads.deferToThread(self._detectSurface)
         self.d.addCallback(self.writeData)
         self.d.addErrback(self.handleError)
@@ -113,10 +102,10 @@ class AutomaticApproach (Approach):
             print str(app_data)
             if app_data['threshold_detected'] is False:
                 touched = 0
-                if time.time()-lastApp < 2:
+                if Recorder.now()-lastApp < 2:
                     print "Waiting"
                     time.sleep(2)
-                lastApp = time.time()
+                lastApp = Recorder.now()
                 self.coarseStage.down(distance)
             else:
                 if touched == 0:
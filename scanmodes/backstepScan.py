@@ -15,377 +15,184 @@
 # pySICM. If not, see <http://www.gnu.org/licenses/>.
 
 import pySICM.sicm 
-import pySICM.piezo as Piezo
-from twisted.internet import defer, reactor, threads
+from pySICM.error import PySICMError
+import pySICM.scanengine as ScanEngine
+import pySICM.scanorder as ScanOrder
+import pySICM.linetransition as LineTransition
+from scanmodes.approach import Approach, PiezoScan
 import struct
-import pycomedi.device as Device
-import pycomedi.subdevice as Subdevice
-import pycomedi.channel as Channel
-import pycomedi.constant as CONSTANTS
-import pycomedi.utility as Util
 import numpy as np
 import time
 
-class BackstepScan (Approach):
+class BackstepScan (PiezoScan, ScanEngine.PixelStrategy):
+
+    queueable = True
+
+    _options = [['BackstepScan.x-Size', 1, float, 
+                 'Scan dimension in x-direction in micm (float)',
+                 0, 0],
+                ['BackstepScan.y-Size', 1, float, 
+                 'Scan dimension in y-direction in micm (float)',
+                 0, 1],
+                ['BackstepScan.x-px', 1, int, 
+                 'number of pixels in x-direction (int)',
+                 0, 2],
+                ['BackstepScan.y-px', 1, int, 
+                 'number of pixels in y-direction (int)',
+                 0, 3],
+                ['BackstepScan.Backstep', 1, int, 
+                 'Vertical retraction distance in micm (int)',
+                 1, 0],
+                ['BackstepScan.FallRate', 1, int, 
+                 'Fall rate in nm/ms (int)',
+                 1, 1],
+                ['BackstepScan.LateralSpeed', 1, int, 
+                 'Lateral movement rate in nm/ms (int)',
+                 1, 2],
+                ['BackstepScan.Threshold', 1, float, 
+                 'Stop threshold in percent (float)',
+                 1, 3],
+                ['BackstepScan.Sensitivity', 1, float, 
+                 'Sensitivity in V/nA (float)',
+                 1, 4],
+                ['BackstepScan.Filter', 1, float, 
+                 'Output filter in kHz (float)',
+                 1, 5],
+                ['BackstepScan.ScanPath', 1, int, 
+                 'Scan path [0: Line by line, 1: Serpentine, 2: Hilbert] (int)',
+                 1, 6],
+                ['BackstepScan.Thresholds', 1, str, 
+                 'Additional thresholds in percent, comma separated (0: none)',
+                 1, 7]
+        ]
     
-    mode = 'backstep'
+    mode = 'backstepScan'
 
 
     def __init__(self):
         super(BackstepScan, self).__init__()
-        self.setOptions()
         self.initInternals()
 
-    def setOptions(self):
-        for o in self._options:
-            self._setRequiredOptions(o[0], o[1], o[2], o[3], col = o[4], pos = o[5])
-
-        
     def initInternals(self):
         self.stop = False
-        self.device = None
-        self.ai = None
-        self.channel = None
         self.runs=0
-        self.reader=None
-
-    def checkAndSetConfig(self, settings):
-        if 'mode' not in settings:
-            return False
-        if settings['mode'] != 'backstepScan':
-            return False
-        if 'backstepScan' not in settings:
-            return False
-        rsettings = settings['backstepScan']
-        if 'Threshold' not in rsettings:
-            return False
-        self.setConfig('Threshold', float(rsettings['Threshold'])/100.0)
-        if 'FallRate' not in rsettings:
-            return False
-        self.setConfig('FallRate', int(rsettings['FallRate']))
-        if 'LateralSpeed' not in rsettings:
-            return False
-        self.setConfig('LateralSpeed', int(rsettings['LateralSpeed']))
-
-        if 'Sensitivity' not in rsettings:
-            return False
-        self.setConfig('Sensitivity', float(rsettings['Sensitivity']))
-        if 'Filter' not in rsettings:
-            return False
-        self.setConfig('Filter', float(rsettings['Filter']))
-
-        if 'x-px' not in rsettings:
-            return False
-        self.setConfig('x-px', int(rsettings['x-px']))
-        if 'y-px' not in rsettings:
-            return False
-        self.setConfig('y-px', int(rsettings['y-px']))
-        if 'x-Size' not in rsettings:
-            return False
-        self.setConfig('x-Size', float(rsettings['x-Size']))
-        if 'y-Size' not in rsettings:
-            return False
-        self.setConfig('y-Size', float(rsettings['y-Size']))
-        if 'Backstep' not in rsettings:
-            return False
-        self.setConfig('Backstep', int(rsettings['Backstep']))
-        return True
-
-    def initPiezos(self):
-        self.ao = self.device.find_subdevice_by_type(
-            CONSTANTS.SUBDEVICE_TYPE.ao,
-            factory = Subdevice.StreamingSubdevice)
-        aochannel = self.ao.channel(
-            1,
-            factory = Channel.AnalogChannel,
-            aref = CONSTANTS.AREF.ground)
-
-        best_range_ao = aochannel.find_range(
-            unit=CONSTANTS.UNIT.volt, 
-            min = 0,
-            max = 10)
-        z_out = self.ao.channel(
-            1,
-            factory = Channel.AnalogChannel,
-            aref = CONSTANTS.AREF.ground,
-            range = best_range_ao)
-
-        x_out = self.ao.channel(
-            0,
-            factory = Channel.AnalogChannel,
-            aref = CONSTANTS.AREF.ground,
-            range = best_range_ao)
-
-        y_out = self.ao.channel(
-            2,
-            factory = Channel.AnalogChannel,
-            aref = CONSTANTS.AREF.ground,
-            range = best_range_ao)
-        
-        z_in = self.ai.channel(
-            2,
-            factory = Channel.AnalogChannel,
-            aref = CONSTANTS.AREF.ground,
-            range = best_range_ao)
-
-        x_in = self.ai.channel(
-            0,
-            factory = Channel.AnalogChannel,
-            aref = CONSTANTS.AREF.ground,
-            range = best_range_ao)
-        y_in = self.ai.channel(
-            5,
-            factory = Channel.AnalogChannel,
-            aref = CONSTANTS.AREF.ground,
-            range = best_range_ao)
-
-        piezoCfg_z = Piezo.PiezoConfig(z_out, 
-                                     direction = Piezo.PiezoConfig.DIRECTION_Z, 
-                                     amplification = 1,
-                                     voltrange = [0,10],
-                                     distance = 100*1e3,
-                                     ai_channel = z_in)
-        piezoCfg_x = Piezo.PiezoConfig(x_out, 
-                                     amplification = 1,
-                                     voltrange = [0,10],
-                                     distance = 100*1e3,
-                                     ai_channel = x_in)
-        piezoCfg_y = Piezo.PiezoConfig(y_out, 
-                                     amplification = 1,
-                                     voltrange = [0,10],
-                                     distance = 100*1e3,
-                                     ai_channel = y_in)
-        global reactor
-        self.zpiezo = Piezo.ZPiezoControl(piezoCfg_z, 
-                                         self.ao, 
-                                         self.ai, 
-                                         reactor, 
-                                         Piezo.ZPiezoControl.DECREASE)
-        self.xpiezo = Piezo.PiezoControl(piezoCfg_x, 
-                                         self.ao, 
-                                         self.ai, 
-                                         reactor)
-
-        self.ypiezo = Piezo.PiezoControl(piezoCfg_y, 
-                                         self.ao, 
-                                         self.ai, 
-                                         reactor)
-
-        
 
     def scan(self, settings, writeResponse):
         self.writeResponse = writeResponse
-        self.device = Device.Device('/dev/comedi0')
-        self.device.open()
-        
-        self.ai = self.device.find_subdevice_by_type(
-            CONSTANTS.SUBDEVICE_TYPE.ai,
-            factory = Subdevice.StreamingSubdevice)
-        channel = self.ai.channel(
-            3,
-            factory = Channel.AnalogChannel, 
-            aref = CONSTANTS.AREF.ground)
-        best_range = channel.find_range(
-            unit=CONSTANTS.UNIT.volt, 
-            min = 0,
-            max = 10)
-        self.signalchannel = self.ai.channel(
-            3, 
-            factory = Channel.AnalogChannel, 
-            aref = CONSTANTS.AREF.ground,
-            range = best_range)
         self.initPiezos()
         if self.checkAndSetConfig(settings):
+            self._config['Threshold']/=100
+            self.setThresholds(self.getConfig('Thresholds'))
+            self.crossings = None
+            self.retract = False
+            self.boost = False
             self.x = None
             self.deltax = 1000*self.getConfig('x-Size')/float(self.getConfig('x-px'))
             self.y = None
             self.deltay = 1000*self.getConfig('y-Size')/float(self.getConfig('y-px'))
 
-            self.y_is_sync = False
-            self.x_is_sync = False
-            self.maxLine = 0
-        self.nextDataPoint(100000)
-        
-    def _callNextDataPoint(self):
-        print "In callback from setting to StartPos"
-        self.nextDataPoint('')
-
-    def nextDataPoint(self, args):
-        print str(args)
-#        if args != '':
-        pos = args
-        pos += self.getConfig('Backstep')*1e3
-        print "Position: "+str(pos)
-        if pos > 1e5:
-            pos = 1e5
-        self.zpiezo.ramp_to_nm_target(pos,
-                                      self.getConfig('LateralSpeed'),
-                                      self._proceed)
-#        else:
-#            self.zpiezo.ramp_to_nm_target(0,
-#                                          self.getConfig('LateralSpeed'),
-#                                          self._proceed)
-    def _proceed(self):
-        if self.y is None:
-            self.y = 0
-            self.y_is_sync = False
-        if self.x is None:
-            self.x = 0
-            self.x_is_sync = False
-        else:
-            self.x += 1
-            self.x_is_sync = False
-        if self.x+1 > self.getConfig('x-px'):
-            self.x = 0
-            self.y+=1
-            self.x_is_sync = False
-            self.y_is_sync = False
-        if self.y  < self.getConfig('y-px'):
-            self.d=None;
-            self.generateDeferred()
-            self.setXYposAndDetectSurface()
-
-    def setXYposAndDetectSurface(self):
-        if self.y_is_sync == False:
-            print self.maxLine
-            print str(self.getConfig('Backstep'))
-            if self.x == 0 and self.y == 0:
-                if self.zpiezo.current_nm() + 20 < 1e5: 
-                    self.zpiezo.ramp_to_nm_target(1e5, self.getConfig('LateralSpeed'), self._setYPos)
-            else:
-                self.zpiezo.ramp_to_nm_target(self.maxLine + self.getConfig('Backstep')*1e3, self.getConfig('LateralSpeed'), self._setYPos)
-                
+            self.lines = LineTransition.LinePlanner(
+                self.getConfig('x-px'), self.getConfig('y-px'),
+                self.getConfig('Backstep')*1e3)
+            self.engine = ScanEngine.ScanEngine(
+                ScanOrder.getPath(self.getConfig('ScanPath'),
+                                  self.getConfig('x-px'),
+                                  self.getConfig('y-px')),
+                self, self.writeResponse)
+            d = self.engine.start(self._startScan)
+            d.addCallback(self.scanFinished)
+            d.addErrback(self.handleError)
         else:
-            self._setXYpos()
-
-    def _setYPos(self):
-        print "Ramping to y-pos"
-        self.y_is_sync = True
-        self.maxLine = 0
-        self.ypiezo.ramp_to_nm_target(self.y * self.deltay, self.getConfig('LateralSpeed'), self._setXYpos)
-
-    def _setXYpos(self):
-        # wait for piezo to move to y pos:
-        time.sleep(.01)
-        if self.x_is_sync == False:
+            print "Config was not correct"
+            self.notifyFailed(PySICMError('Configuration not correct'))
+        
+    def _startScan(self):
+        self.readFrequency = self.getReadFrequency()
+
+    def moveToPixel(self, pixel, previous):
+        self.x, self.y = pixel
+        if previous is None:
+            if self.zpiezo.current_nm() + 20 < 1e5: 
+                self.zpiezo.ramp_to_nm_target(
+                    1e5, self.getConfig('LateralSpeed'), block = True)
+        elif not ScanOrder.adjacent(previous, pixel):
+            # Flying back over the line, the backstep of the last pixel
+            # does not suffice. The pipette follows the predicted surface.
+            for axis, target, z in self.lines.path(previous, pixel):
+                self.zpiezo.ramp_to_nm_target(
+                    z, self.getConfig('LateralSpeed'), block = True)
+                if axis == 'y':
+                    self.ypiezo.ramp_to_nm_target(
+                        target * self.deltay, self.getConfig('LateralSpeed'),
+                        block = True)
+                else:
+                    self.xpiezo.ramp_to_nm_target(
+                        target * self.deltax, self.getConfig('LateralSpeed'),
+                        block = True)
+            previous = pixel
+        if previous is None or previous[1] != self.y:
+            print "Ramping to y-pos"
+            self.ypiezo.ramp_to_nm_target(
+                self.y * self.deltay, self.getConfig('LateralSpeed'),
+                block = True)
+            # wait for piezo to move to y pos:
+            time.sleep(.01)
+        if previous is None or previous[0] != self.x:
             print "Ramping to x-pos"
-            self.x_is_sync = True
-            self.xpiezo.ramp_to_nm_target(self.x * self.deltax, self.getConfig('LateralSpeed'), self.detectSurface)
-        else:
-            self.detectSurface()
-    def detectSurface(self):
+            self.xpiezo.ramp_to_nm_target(
+                self.x * self.deltax, self.getConfig('LateralSpeed'),
+                block = True)
         # wait for piezo to move to x pos:
         time.sleep(.007)
-        self.generateDeferred()
-        self.d = threads.deferToThread(self._detectSurface)
-        self.d.addCallback(self._writeResponse)
-        self.d.addCallback(self.nextDataPoint)
 
+    def measurePixel(self, pixel):
+        return self._detectSurface()
 
     def _detectSurface(self):
-        
-        safety_dist = self.zpiezo.getSignForRetract() * 1000
-        i_zero = np.average(self.signalchannel.data_read_n(1000))
         start = time.time()
-
-        self.zpiezo.approach_noThread(self.getConfig('FallRate'))
-        signal = np.average(self.signalchannel.data_read_n(10))
-        tmp = 0
-
-        # debug
-#        print "Measurement: " + str(signal/i_zero)
-#        print "Card running?: " + str(self.ao.get_flags().running)
-        while signal/i_zero > self.getConfig('Threshold') and self.ao.get_flags().running:
-            signal = np.average(self.signalchannel.data_read_n(10))
-            # debug
-#            print signal/i_zero
-#            if tmp == 0:
-#                print "In while"
-#                tmp = 1000
-#            tmp -= 1
-        self.ao.cancel()
-        pos = self.zpiezo.current_nm()
+        r = super(BackstepScan, self)._detectSurface(
+            returnPos = True, returnData = False, updateFrequency = False)
+        pos = r['end_pos']
+        self.crossings = r['crossings']
         end = time.time()
-        self.zpiezo.set_nm(pos+safety_dist)
         print "Position: "+str(self.x) + " " + str(self.y) + " " +str(pos)
         print "Time required: "+str(end-start)
-        if self.maxLine < pos:
-            self.maxLine = pos
+        self.lines.record((self.x, self.y), pos)
         return pos
 
-    def _writeResponse(self, pos):
-        self.writeResponse(
-            self.mkByte(int(round(np.iinfo(np.uint16).max*pos/100000))))
-        return pos
-        
-    def updateXY(self):
-        self.x+=1
-        if self.x +1 > self.getConfig('x-px'):
-            self.x = 0
-            self.y+=1
-        self.writeResponse(self.mkByte(int(round(1e-3*self.pos/100.0))))
-        global reactor
-        reactor.callLater(0.001, self.nextDataPoint,'')
-        
-        
-
-    def dataMeasured(self, data):
-#        print "Runs is: %i"% self.runs
-#        print "Data Received: %i"%time.time()
-        
-        print s#self.writeResponse(s)
-#        if self.reader.isAlive():
-#            self.reader.join()
+    def encodePixel(self, pixel, pos):
+        # With additional thresholds, the heights at all thresholds are
+        # sent, starting with the one at Threshold. A threshold that has
+        # not been crossed gets the height at which the approach stopped.
+        heights = [pos]
+        if self.thresholds:
+            heights = [pos if h is None else h for h in self.crossings]
+        s = ''
+        for h in heights:
+            h = min(h, 100000)
+            s += self.mkByte(int(round(np.iinfo(np.uint16).max*h/100000)))
+        return s
 
-#        self.nextDataPoint()
+    def leavePixel(self, pixel, pos, nextPixel):
+        pos += self.getConfig('Backstep')*1e3
+        print "Position: "+str(pos)
+        if pos > 1e5:
+            pos = 1e5
+        self.zpiezo.ramp_to_nm_target(pos,
+                                      self.getConfig('LateralSpeed'),
+                                      block = True)
 
-    def _scan(self):
-        buf = np.zeros(self.getConfig('Samples'),np.uint16);
-        reader = Util.Reader(self.ai, buf);
-        reader.start()
-        reader.join()
-        print "Length after reader joined: %i" % len(reader.buffer)
-        s = ''
-        for i in reader.buffer:
-            s = s + self.mkByte(i)
-        self.d.callback(s)
+    def scanFinished(self, completed):
+        self.zpiezo.home()
+        if completed:
+            print "Scan finished"
+        else:
+            print "Stop"
+        self.notifyFinished(completed)
         
     def destroy(self):
         self.runs=0
         super(Approach, self).destroy()
-        self.device.close()
-
-    def fake(self, settings, writeResponse):
-        self.writeResponse = writeResponse
-        self.stop = False
-        self.stoppos = 20.0;
-        self.C = 0.105;
-        self.pos = 100.0
-        if self.checkAndSetConfig(settings):
-            self.nextFakeDataPoint('')
-        else:
-            self.writeResponse("NACK\r\n")
-
-    def generateDeferred(self):
-        self.d = defer.Deferred()
-        self.d.addCallback(self.writeResponse)
-        self.d.addCallback(self.nextDataPoint)
-    def generateFakeDeferred(self):
-        self.d = defer.Deferred()
-        self.d.addCallback(self.writeResponse)
-        self.d.addCallback(self.nextFakeDataPoint)
-
-    def nextFakeDataPoint(self, args):
-        self.data = []
-        global reactor
-        self.d = None
-        self.generateFakeDeferred()
-        if self.stop is False:
-           self.call = reactor.callLater(0,self._fake)
-
-    def _fake(self):
-        self.d.callback(data)
-
 
     def mkByte(self, number):
         # little endian
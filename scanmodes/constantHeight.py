@@ -0,0 +1,240 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''Constant height scan: continuous line scans of flat samples.
+
+Instead of approaching at each pixel, the pipette is kept at a constant
+height Distance (in nm) above the surface, and each line is scanned by a
+single timed AO command of the x-piezo (see PiezoControl._prepare_command)
+moving at LineSpeed. The ion current is acquired during the line by a
+timed AI command started together with the AO command (see
+Approach._prepareStreamCommand), so that each sample belongs to a known x
+position. This requires the option aistarttrigger of the device of the
+input signal, and the x-piezo has to be driven by the same board.
+
+The current is converted to the distance between pipette and sample by
+the approach curve recorded by a single approach at the first pixel: the
+current averaged over a pixel is looked up in the curve (made monotonic),
+which gives the distance at which the approach measured it. Currents
+above the part of the curve that depends on the distance (the bulk
+current) are mapped to the largest distance of that part, currents below
+the stop threshold to the stop position. The height of the surface is
+the height of the pipette minus that distance, in the units of the
+hopping modes: the position at which an approach would have stopped.
+
+A tilted or drifting sample is followed by a slow servo: after each line,
+the height of the pipette is corrected by the fraction Servo of the
+deviation of the median distance of the line from Distance. With Servo 0,
+all lines are scanned at the same height. The pipette is lifted by
+Distance while it moves back to the start of the next line.
+
+The data is transmitted line by line: y followed by the x-px heights
+(uint16 each), with the heights scaled so that 65535 corresponds to
+100 micm.'''
+
+import pySICM.sicm
+from pySICM.error import PySICMError
+import pySICM.worker as Worker
+import pySICM.ramps as Ramps
+from pySICM.converter import UNIT
+from twisted.internet import defer
+from scanmodes.approach import PiezoScan
+import numpy as np
+import time
+
+
+class ConstantHeight (PiezoScan):
+
+    queueable = True
+
+    _options = [['ConstantHeight.x-Size', 1, float, 
+                 'Scan dimension in x-direction in micm (float)',
+                 0, 0],
+                ['ConstantHeight.y-Size', 1, float, 
+                 'Scan dimension in y-direction in micm (float)',
+                 0, 1],
+                ['ConstantHeight.x-px', 1, int, 
+                 'number of pixels in x-direction (int)',
+                 0, 2],
+                ['ConstantHeight.y-px', 1, int, 
+                 'number of pixels in y-direction (int)',
+                 0, 3],
+                ['ConstantHeight.LineSpeed', 1, int, 
+                 'Speed of the pipette along a line in nm/ms (int)',
+                 0, 4],
+                ['ConstantHeight.Distance', 1, int, 
+                 'Distance between pipette and surface in nm (int)',
+                 1, 0],
+                ['ConstantHeight.Servo', 1, float, 
+                 'Fraction of the height error corrected after each line'+
+                 ' (float, 0: constant height)',
+                 1, 1],
+                ['ConstantHeight.FallRate', 1, int, 
+                 'Fall rate in nm/ms (int)',
+                 1, 2],
+                ['ConstantHeight.LateralSpeed', 1, int, 
+                 'Lateral movement rate in nm/ms (int)',
+                 1, 3],
+                ['ConstantHeight.Threshold', 1, float, 
+                 'Stop threshold in percent (float)',
+                 1, 4],
+                ['ConstantHeight.Filter', 1, float, 
+                 'Output filter of the approach in kHz (float)',
+                 1, 5]
+        ]
+
+    mode = 'constantHeight'
+
+    def scan(self, settings, writeResponse):
+        self.writeResponse = writeResponse
+        self.initPiezos()
+        if not self.checkAndSetConfig(settings):
+            print "Config was not correct"
+            self.notifyFailed(PySICMError('Configuration not correct'))
+            return
+        if self._aiStartTrigger() is None:
+            print ("No aistarttrigger configured for the device of the "+
+                   "input signal, cannot scan at constant height.")
+            self.notifyFailed(PySICMError('No aistarttrigger configured'))
+            return
+        self._config['Threshold']/=100
+        self.stop = False
+        self.retract = False
+        self.boost = False
+        self.streaming = True
+        self.deltay = 1e3*self.getConfig('y-Size')/float(self.getConfig('y-px'))
+        self.prepareLine()
+        if self.getConfig('x-px') > len(self.lineRamp):
+            print ("A line has " + str(len(self.lineRamp)) + " steps of "+
+                   "the x-piezo, less than x-px.")
+            self.notifyFailed(PySICMError(
+                'x-px exceeds the ' + str(len(self.lineRamp)) +
+                ' steps of the x-piezo in a line'))
+            return
+        self.worker = Worker.getWorker()
+        d = defer.Deferred()
+        d.addCallback(self.scanFinished)
+        d.addErrback(self.handleError)
+        self.worker.submit(d, self.do_scan)
+
+    def prepareLine(self):
+        '''Computes the AO samples of a line and the pixel of each of
+        them.'''
+        conv = self.xpiezo.converter
+        start = conv.getConvertedNumber(0, UNIT.nm).get_oBits()
+        end = conv.getConvertedNumber(
+            1e3*self.getConfig('x-Size'), UNIT.nm).get_oBits()
+        self.lineRamp = Ramps.ramp(start, end)
+        steps = len(self.lineRamp)
+        duration = 1e-3 * 1e3*self.getConfig('x-Size') / self.getConfig(
+            'LineSpeed')
+        self.lineFrequency = steps / duration
+        self.stepPixel = np.arange(steps) * self.getConfig('x-px') // steps
+        print ("Constant height line: " + str(steps) + " steps at " +
+               str(self.lineFrequency) + " Hz")
+
+    def do_scan(self):
+        '''Approaches at the first pixel and scans all lines. Blocks, has
+        to be called in the worker thread. Returns False if the scan has
+        been stopped.'''
+        self.zpiezo.ramp_to_nm_target(1e5, self.getConfig('LateralSpeed'),
+                                      block = True)
+        self.xpiezo.ramp_to_nm_target(0, self.getConfig('LateralSpeed'),
+                                      block = True)
+        self.ypiezo.ramp_to_nm_target(0, self.getConfig('LateralSpeed'),
+                                      block = True)
+        self.calibrate(self._detectSurface(returnPos = True,
+                                           updateFrequency = False))
+        distance = self.getConfig('Distance')
+        z = self.surface + distance
+        for y in xrange(self.getConfig('y-px')):
+            if self.stop:
+                return False
+            if y > 0:
+                self.zpiezo.ramp_to_nm_target(
+                    min(z + distance, 1e5), self.getConfig('LateralSpeed'),
+                    block = True)
+                self.xpiezo.ramp_to_nm_target(
+                    0, self.getConfig('LateralSpeed'), block = True)
+                self.ypiezo.ramp_to_nm_target(
+                    y * self.deltay, self.getConfig('LateralSpeed'),
+                    block = True)
+            self.zpiezo.ramp_to_nm_target(z, self.getConfig('FallRate'),
+                                          block = True)
+            gaps = self.gap(self.measureLine())
+            heights = np.clip(z - gaps, 0, 1e5)
+            s = self.mkByte(y)
+            for h in heights:
+                s += self.mkByte(int(round(np.iinfo(np.uint16).max*h/1e5)))
+            self.worker.deliver(self.writeResponse, s)
+            error = np.median(gaps) - distance
+            z = min(max(z - self.getConfig('Servo') * error, 0), 1e5)
+        return True
+
+    def calibrate(self, approach):
+        '''Stores the current (in bits) as a function of the distance to
+        the surface (in nm) from the result of an approach
+        (see Approach._detectSurface with returnPos set).'''
+        if not approach['threshold_detected']:
+            raise PySICMError('Surface not found at the first pixel.')
+        current = np.asarray(approach['data'][4:], np.float64)
+        start = approach['start_pos']
+        self.surface = approach['end_pos']
+        # The averages are taken at equal distances, each one at the end
+        # of its window
+        gap = (start - self.surface) * (1 - np.arange(
+            1, len(current) + 1) / float(len(current)))
+        # The bulk current is the median of the farthest tenth of the
+        # curve. Beyond the distance at which it is reached first, the
+        # current does not depend on the distance.
+        level = np.median(current[:max(1, len(current) // 10)])
+        # Order by increasing distance, the current must not decrease
+        current = np.maximum.accumulate(current[::-1])
+        gap = gap[::-1]
+        bulk = min(np.searchsorted(current, level), len(current) - 1)
+        current, first = np.unique(current[:bulk + 1], return_index = True)
+        self.calibration = (current, gap[first])
+        print ("Constant height: sensitive up to " + str(gap[bulk]) +
+               " nm above the surface")
+
+    def gap(self, current):
+        '''Returns the distance to the surface (in nm) at which the
+        approach curve has the given current (in bits).'''
+        return np.interp(current, *self.calibration)
+
+    def measureLine(self):
+        '''Scans a line by a timed AO command of the x-piezo and returns
+        the ion current (in bits) averaged over each pixel.'''
+        steps = len(self.lineRamp)
+        self.xpiezo._prepare_command(self.lineFrequency, steps)
+        ao = self.xpiezo._ao
+        m, ai_period = self._prepareStreamCommand(
+            float(ao.cmd.scan_begin_arg), steps)
+        ai = self.signal.channel.subdevice
+        ai.command()
+        ao.command()
+        self.xpiezo.load_ramp(self.lineRamp)
+        time.sleep(0.001)
+        self.xpiezo.trigger_ramp()
+        samples = self._readStream(steps * m, ai_period)
+        ai.cancel()
+        self.xpiezo._finish_ramp(None)
+        if len(samples) < steps * m:
+            raise PySICMError('Line incomplete, got ' + str(len(samples)) +
+                              ' of ' + str(steps * m) + ' samples.')
+        pixel = np.repeat(self.stepPixel, m)
+        n = self.getConfig('x-px')
+        return (np.bincount(pixel, samples, n) /
+                np.bincount(pixel, minlength = n))
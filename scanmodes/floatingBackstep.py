@@ -17,20 +17,25 @@
 from pySICM.setup import pysicmsetup as SETUP
 import pySICM.sicm
 import pySICM.piezo as Piezo
-import pySICM.error as PySICMError
+from pySICM.error import PySICMError
 import pySICM.converter as Converter 
+import pySICM.scanengine as ScanEngine
+import pySICM.scanorder as ScanOrder
+import pySICM.checkpoint as Checkpoint
+import pySICM.backsteps as Backsteps
+import pySICM.linetransition as LineTransition
 from scanmodes.approach import Approach
-from twisted.internet import defer, reactor, threads
+from twisted.internet import defer, reactor
 import struct
-import pycomedi.device as Device
-import pycomedi.subdevice as Subdevice
-import pycomedi.channel as Channel
-import pycomedi.constant as CONSTANTS
-import pycomedi.utility as Util
+from pySICM.comedi import device as Device, subdevice as Subdevice, \
+    channel as Channel, constant as CONSTANTS, utility as Util
 import numpy as np
 import time
+import itertools
 
-class FloatingBackstep (Approach):
+class FloatingBackstep (Approach, ScanEngine.PixelStrategy):
+
+    queueable = True
 
     _options = [['FloatingBackstep.x-Size', 1, float, 
                  'Scan dimension in x-direction in micm (float)',
@@ -94,7 +99,19 @@ class FloatingBackstep (Approach):
                  1,9],
                 ['FloatingBackstep.SmallResolution', 1,int,
                  'Resolution for small resolution areas in pixels (int)',
-                 0,10]
+                 0,10],
+                ['FloatingBackstep.ScanPath', 1,int,
+                 'Scan path [0: Line by line, 1: Serpentine, 2: Hilbert] (int)',
+                 1,10],
+                ['FloatingBackstep.BackstepRadius', 1,int,
+                 'Neighbourhood of the backstep in pixels [0: prescan pixel] (int)',
+                 0,11],
+                ['FloatingBackstep.NoiseMargin', 1,float,
+                 'Added to the backstep in micm (float)',
+                 1,11],
+                ['FloatingBackstep.Thresholds', 1,str,
+                 'Additional thresholds of the main scan in percent, comma separated (0: none)',
+                 0,12]
                 
         ]
 
@@ -147,174 +164,211 @@ class FloatingBackstep (Approach):
 
     def handleError(self, error):
         print str(error)
+        self.notifyFailed(error)
         raise PySICMError('An error occured.')
 
     def scan(self, settings, writeResponse):
-        self.initPiezos()
-        self.writeResponse = writeResponse
-        self.retract = False
-        
-        if self.checkAndSetConfig(settings):
-            self.xoffset = self.getConfig('XOffset') * 1e3
-            self.yoffset = self.getConfig('YOffset') * 1e3
-            self._config['Threshold']/=100
-            self.boost = self.getConfig('Boost') == 1
-            self.x = None
-            self.deltax = 1000*self.getConfig('x-Size')/float(self.getConfig('x-px-pre'))
-            self.y = None
-            self.deltay = 1000*self.getConfig('y-Size')/float(self.getConfig('y-px-pre'))
-
-            self.y_is_sync = False
-            self.x_is_sync = False
-            self.maxLine = 0
-            self.isPrescan = True
-            self.startFrom = None
-            self.maxX = self.getConfig('x-px-pre')
-            self.maxY = self.getConfig('y-px-pre')
-            self.data = np.zeros((self.getConfig('x-px-pre'),
-                                  self.getConfig('y-px-pre')), np.int32)
-            self.readFrequency = self.getReadFrequency()
-            
-            #self.debugCounter = 0
-            r = self._detectSurface()
-            
-            self.nextDataPoint(
-                self.piezo.converter.getConvertedNumber(r, Converter.UNIT.nm)
-                )
+        if self._configure(settings, writeResponse):
+            self._startPrescan(self._startScan)
         else:
             print "Config was not correct"
-        
-    def nextDataPoint(self, args):
+            self.notifyFailed(PySICMError('Configuration not correct'))
 
-        pos = args
-        if self.isPrescan:
-            pos2 = pos + Converter.UNumber(self.getConfig('BackstepL')*1e3, Converter.UNIT.nm)
+    def resume(self, settings, state, writeResponse):
+        '''Continues the scan saved in a checkpoint (see
+        pySICM.checkpoint and getState). Returns False if the settings are
+        not correct.'''
+        if not self._configure(settings, writeResponse):
+            print "Config was not correct"
+            return False
+        self.data = np.array(state['data'], np.int32)
+        self.heights = np.array(state['heights'], np.int32)
+        self.lastPos = self.piezo.converter.getConvertedNumber(
+            float(state['lastPos']), Converter.UNIT.nm)
+        self.resumeFrom = float(state['startFrom'])
+        cursor = int(state['cursor'])
+        print "Resuming at pixel " + str(cursor)
+        if int(state['prescan']):
+            self._startPrescan(self._resumeScan, cursor)
         else:
-            pos2 = pos + Converter.UNumber(self.getBackstep(), Converter.UNIT.nm)
-            
-        self.piezo.set_pos(pos2, wait=self.getConfig('StartXMoveFraction')/100, overshoot = 000)
-
-        print "Pos aimed:"+ str(pos2)
-
-        print "Pos reached:" + str(self.piezo.current_pos())
+            self.isPrescan = False
+            self.calculateBacksteps()
+            self._startMainScan(self._resumeScan, cursor)
+        return True
 
-        if self.isPrescan:
-            if self.x is not None and self.y is not None:
-                self.data[self.x, self.y] = pos.getValue(Converter.UNIT.nm)
-
-        if self.maxLine < pos.getValue(Converter.UNIT.nm):
-            self.maxLine = pos.getValue(Converter.UNIT.nm)
-#        if self.boost:
-#            self.booster.home()
-        self.startFrom = pos2
-        self._proceed()
-
-    def _proceed(self):
-        if not self.stop:
-            if self.y is None:
-                self.y = 0
-                self.y_is_sync = False
-                
-            if self.x is None:
-                self.x = 0
-                self.x_is_sync = False
-            else:
-                self.x += 1
-                self.x_is_sync = False
-
-            if self.x+1 > self.maxX:
-                self.x = 0
-                self.y+=1
-                self.x_is_sync = False
-                self.y_is_sync = False
-                
-            if self.y  < self.maxY:
-                self.d=None;
-                self.generateDeferred()
-                self.setXYposAndDetectSurface()
-            elif self.y == self.maxY and self.isPrescan:
-                self.isPrescan = False
-                self.x = 0
-                self.y = 0
-                self.x_is_sync = False
-                self.y_is_sync = False
-                self.calculateBacksteps()
-                self.maxLine = np.max(self.data) 
-                if self.maxLine > 1e5/1.1:
-                    self.maxLine = 1e5/1.1
-                self.startFrom = self.piezo.converter.getConvertedNumber(
-                    1.1 * self.maxLine, Converter.UNIT.nm)
-                self.deltax = 1e3*self.getConfig('x-Size')/float(self.getConfig('x-px'))
-                self.deltay = 1e3*self.getConfig('y-Size')/float(self.getConfig('y-px'))
-                self.maxX = self.getConfig('x-px')
-                self.maxY = self.getConfig('y-px')
-                self.setXYposAndDetectSurface()
-
-            else:
-                self.piezo.home()
-                self.xpiezo.set_nm(0)
-                self.ypiezo.set_nm(0)
-                print "Scan finished"
+    def _configure(self, settings, writeResponse):
+        self.initPiezos()
+        self.writeResponse = writeResponse
+        self.retract = False
+        
+        if not self.checkAndSetConfig(settings):
+            return False
+        self.xoffset = self.getConfig('XOffset') * 1e3
+        self.yoffset = self.getConfig('YOffset') * 1e3
+        self._config['Threshold']/=100
+        self.boost = self.getConfig('Boost') == 1
+        self.x = None
+        self.y = None
+
+        self.lines = None
+        self.isPrescan = True
+        self.startFrom = None
+        self.lastPos = None
+        self.data = np.zeros((self.getConfig('x-px-pre'),
+                              self.getConfig('y-px-pre')), np.int32)
+        self.heights = np.zeros((self.getConfig('x-px'),
+                                 self.getConfig('y-px')), np.int32)
+        self.backsteps = None
+        # The additional thresholds are used in the main scan only
+        self.thresholds = []
+        self.crossings = None
+        self.checkpointer = Checkpoint.Checkpointer(
+            self.mode, settings, self.getState)
+        return True
+
+    def _startPrescan(self, before, skip = 0):
+        self.deltax = 1000*self.getConfig('x-Size')/float(self.getConfig('x-px-pre'))
+        self.deltay = 1000*self.getConfig('y-Size')/float(self.getConfig('y-px-pre'))
+        order = ScanOrder.getPath(self.getConfig('ScanPath'),
+                                  self.getConfig('x-px-pre'),
+                                  self.getConfig('y-px-pre'))
+        self.lines = LineTransition.LinePlanner(
+            self.getConfig('x-px-pre'), self.getConfig('y-px-pre'),
+            self.getConfig('BackstepL')*1e3)
+        self._recordDone(order, skip, self.data)
+        self.engine = ScanEngine.ScanEngine(
+            order, self, self.writeResponse, skip = skip)
+        d = self.engine.start(before)
+        d.addCallback(self.prescanFinished)
+        d.addErrback(self.handleError)
+
+    def _startMainScan(self, before = None, skip = 0):
+        self.deltax = 1e3*self.getConfig('x-Size')/float(self.getConfig('x-px'))
+        self.deltay = 1e3*self.getConfig('y-Size')/float(self.getConfig('y-px'))
+        order = ScanOrder.getPath(self.getConfig('ScanPath'),
+                                  self.getConfig('x-px'),
+                                  self.getConfig('y-px'))
+        self.lines = LineTransition.LinePlanner(
+            self.getConfig('x-px'), self.getConfig('y-px'),
+            self.getConfig('BackstepL')*1e3, prescan = self.data)
+        self._recordDone(order, skip, self.heights)
+        self.setThresholds(self.getConfig('Thresholds'))
+        self.engine = ScanEngine.ScanEngine(
+            order, self, self.writeResponse, skip = skip)
+        self.checkpointer.save()
+        d = self.engine.start(before)
+        d.addCallback(self.scanFinished)
+        d.addErrback(self.handleError)
+        
+    def _recordDone(self, order, skip, heights):
+        # The heights of the pixels scanned before a resume
+        for pixel in itertools.islice(order, skip):
+            self.lines.record(pixel, heights[pixel])
+
+    def _startScan(self):
+        self.readFrequency = self.getReadFrequency()
+        # Approach at the current position to know where to start from
+        self.leavePixel(None, self._detectSurface())
+
+    def _resumeScan(self):
+        self.readFrequency = self.getReadFrequency()
+        # The pipette may be anywhere, the move to the next pixel starts
+        # above everything measured and the height of the checkpoint
+        p = max(self.lines.safeTop(), min(self.resumeFrom, 1e5))
+        self.startFrom = self.piezo.converter.getConvertedNumber(
+            p, Converter.UNIT.nm)
+        self.piezo.set_pos(self.startFrom, wait=1)
+
+    def getState(self):
+        '''Returns the state of the scan saved in checkpoints.'''
+        state = {'prescan': int(self.isPrescan),
+                 'cursor': self.engine.done,
+                 'data': self.data,
+                 'heights': self.heights,
+                 'lastPos': 0,
+                 'startFrom': 0}
+        if self.lastPos is not None:
+            state['lastPos'] = self.lastPos.getValue(Converter.UNIT.nm)
+        if self.startFrom is not None:
+            state['startFrom'] = self.startFrom.getValue(Converter.UNIT.nm)
+        return state
+
+    def prescanFinished(self, completed):
+        if not completed:
+            self.scanFinished(completed)
+            return
+        self.isPrescan = False
+        self.calculateBacksteps()
+        self._startMainScan()
+
+    def scanFinished(self, completed):
+        if completed:
+            print "Scan finished"
+            self.checkpointer.clear()
         else:
             print "Stop"
-            self.piezo.home()
-            self.xpiezo.set_nm(0)
-            self.ypiezo.set_nm(0)
-
-            
-    def setXYposAndDetectSurface(self):
-
-        if self.y_is_sync == False:
-
-            if self.x == 0 and self.y == 0:
-                self._setYPos()
-            else:
-                self.piezo._ao.cancel()
-                
-                p = self.piezo.converter.getConvertedNumber(
-                        1.1*self.maxLine,Converter.UNIT.nm)
-                print "Retracting due to unsynced y"
-                self.piezo.set_pos(p,
-                    wait=self.getConfig('StartXMoveFraction')/100)
-                self.startFrom=p
-                self._setYPos()
-                
-        else:
-            self._setXYpos()
-
-    def _setYPos(self):
-
-        self.y_is_sync = True
-        self.maxLine = 0
-        self.ypiezo.set_pos(
-            self.ypiezo.converter.getConvertedNumber(
-                self.yoffset + self.y * self.deltay, Converter.UNIT.nm),
-            wait=self.getConfig('StartApproachFraction')/100)
-        self._setXYpos()
-
-
-    def _setXYpos(self):
-
-        if self.x_is_sync == False:
-
-            self.x_is_sync = True
+            self.checkpointer.save()
+        self.piezo.home()
+        self.xpiezo.set_nm(0)
+        self.ypiezo.set_nm(0)
+        self.notifyFinished(completed)
+
+    def moveToPixel(self, pixel, previous):
+        self.x, self.y = pixel
+        # The prescan starts at the current height, the main scan above
+        # everything known. Flying back over a line, the pipette follows
+        # the predicted surface (see pySICM.linetransition). Moves to
+        # adjacent pixels (e.g. line changes of a serpentine path) only
+        # need the backstep, which accounts for the direction of the move.
+        if previous is None and not self.isPrescan:
+            self.piezo._ao.cancel()
+            p = self.lines.safeTop()
+            if self.startFrom is not None:
+                # A resumed scan starts above the height of the checkpoint
+                p = max(p, self.startFrom.getValue(Converter.UNIT.nm))
+            self.startFrom = self.piezo.converter.getConvertedNumber(
+                p, Converter.UNIT.nm)
+            self.piezo.set_pos(self.startFrom,
+                wait=self.getConfig('StartXMoveFraction')/100)
+        elif previous is not None and not ScanOrder.adjacent(previous, pixel):
+            self.piezo._ao.cancel()
+            wait = self.getConfig('StartXMoveFraction')/100
+            for axis, target, z in self.lines.path(previous, pixel):
+                self.startFrom = self.piezo.converter.getConvertedNumber(
+                    z, Converter.UNIT.nm)
+                self.piezo.set_pos(self.startFrom, wait=wait)
+                # Within the path, the height is reached before moving on
+                wait = 1
+                if axis == 'y':
+                    self.ypiezo.set_pos(
+                        self.ypiezo.converter.getConvertedNumber(
+                            self.yoffset + target * self.deltay,
+                            Converter.UNIT.nm), wait=1)
+                else:
+                    self.xpiezo.set_pos(
+                        self.xpiezo.converter.getConvertedNumber(
+                            self.xoffset + target * self.deltax,
+                            Converter.UNIT.nm), wait=1)
+            return
+        if previous is None or previous[1] != self.y:
+            self.ypiezo.set_pos(
+                self.ypiezo.converter.getConvertedNumber(
+                    self.yoffset + self.y * self.deltay, Converter.UNIT.nm),
+                wait=self.getConfig('StartApproachFraction')/100)
+        if previous is None or previous[0] != self.x:
             self.xpiezo.set_pos(
                 self.xpiezo.converter.getConvertedNumber(
                     self.xoffset + self.x * self.deltax, Converter.UNIT.nm),
-                wait=.999)
-            self.detectSurface()
+                wait=1)
+
+    def measurePixel(self, pixel):
+        pos = self._detectSurface()
+        if self.isPrescan:
+            self.data[pixel] = pos
         else:
-            self.detectSurface()
-    def detectSurface(self):
-        # wait for piezo to move to x pos:
-
-#        time.sleep(.001)
-        self.generateDeferred()
-        self.d = threads.deferToThread(self._detectSurface)
-        self.d.addCallback(self._writeResponse)
-        self.d.addCallback(self.nextDataPoint)
-        self.d.addErrback(self.handleError)
-        
+            self.heights[pixel] = pos
+        self.lines.record(pixel, pos)
+        return pos
 
     def _detectSurface(self):
         r =  super(FloatingBackstep, self)._detectSurface(
@@ -323,17 +377,45 @@ class FloatingBackstep (Approach):
             currPos = self.startFrom)
         
         pos = r['end_pos']
+        self.crossings = r['crossings']
 
         return pos
 
-    def _writeResponse(self, pos):
+    def encodePixel(self, pixel, pos):
+        # With additional thresholds, the heights at all thresholds are
+        # sent, starting with the one at Threshold. A threshold that has
+        # not been crossed gets the height at which the approach stopped.
+        heights = [pos]
+        if self.thresholds:
+            heights = [pos if h is None else h for h in self.crossings]
+        s = ''
+        for h in heights:
+            h = min(h, 100000)
+            s += self.mkByte(int(round(np.iinfo(np.uint16).max*h/100000)))
+        return s
+
+    def leavePixel(self, pixel, pos, nextPixel = None):
+        # Retracts by the backstep (pixel is None for the approach before
+        # the scan)
+        pos = self.piezo.converter.getConvertedNumber(
+            min(pos, 100000), Converter.UNIT.nm)
+        if self.isPrescan:
+            pos2 = pos + Converter.UNumber(self.getConfig('BackstepL')*1e3, Converter.UNIT.nm)
+        else:
+            pos2 = pos + Converter.UNumber(self.getBackstep(pixel, nextPixel), Converter.UNIT.nm)
+            
+        self.piezo.set_pos(pos2, wait=self.getConfig('StartXMoveFraction')/100, overshoot = 000)
+
+        print "Pos aimed:"+ str(pos2)
 
-        if pos > 100000:
-            pos = 100000
+        print "Pos reached:" + str(self.piezo.current_pos())
 
-        self.writeResponse(
-            self.mkByte(int(round(np.iinfo(np.uint16).max*(pos)/100000))))
-        return self.piezo.converter.getConvertedNumber(pos, Converter.UNIT.nm)
+#        if self.boost:
+#            self.booster.home()
+        self.lastPos = pos
+        self.startFrom = pos2
+        if pixel is not None:
+            self.checkpointer.periodic()
         
     def destroy(self):
         self.runs=0
@@ -341,11 +423,6 @@ class FloatingBackstep (Approach):
         self.device.close()
 
 
-    def generateDeferred(self):
-        self.d = defer.Deferred()
-        self.d.addCallback(self.writeResponse)
-        self.d.addCallback(self.nextDataPoint)
-
 
     def mkByte(self, number):
         # little endian
@@ -363,33 +440,25 @@ class FloatingBackstep (Approach):
         self.stop = True
 
     def calculateBacksteps(self):
-        BACKSTEP_SET = True
-        BACKSTEP_NONE = False
-
-        
-        sh = self.data.shape
-        print sh
-        bs = np.empty(sh, np.float64)
-        bs.fill(np.float64(self.getConfig('BackstepL')*1e-3))
-
-        for y in xrange(0,sh[1]-1):
-            for x in xrange(0,sh[0]-1):
-                d = self.data[x+1,y] - self.data[x,y]
-                if d < 0:
-                    d = 0
-                bs[x,y] = np.float64(d)
-
-        self.backsteps = bs
-        print self.backsteps
-        
-    def getBackstep(self):
-        x = self.x//self.getConfig('x-px-pre')
-        y = self.y//self.getConfig('y-px-pre')
-        bs = self.backsteps[x, y]
-        if bs > self.getConfig('BackstepS') * 5e2:
-            print "Returnig " + str(bs)
-            return bs
-        else:
-            print "Returnig " + str(self.getConfig('BackstepS')*5e2)
-            return self.getConfig('BackstepS')*5e2
- 
+        # backsteps[dx+1, dy+1, x, y]: the backstep before the move by
+        # (dx, dy) from pixel (x, y), see pySICM.backsteps. A move that
+        # is not to an adjacent pixel (0, 0) only needs to lift off.
+        radius = self.getConfig('BackstepRadius')
+        if radius <= 0:
+            # The distance of the prescan pixels
+            radius = int(np.ceil(max(
+                self.getConfig('x-px')/float(self.getConfig('x-px-pre')),
+                self.getConfig('y-px')/float(self.getConfig('y-px-pre')))))
+        self.backsteps = Backsteps.plan(
+            self.data, self.getConfig('x-px'), self.getConfig('y-px'),
+            radius, self.getConfig('NoiseMargin')*1e3,
+            self.getConfig('BackstepS')*5e2)
+
+    def getBackstep(self, pixel, nextPixel = None):
+        # Direction of the next move. Non-adjacent moves retract above
+        # the line in moveToPixel, the backstep only needs to lift off.
+        dx, dy = 0, 0
+        if nextPixel is not None and ScanOrder.adjacent(pixel, nextPixel):
+            dx = cmp(nextPixel[0], pixel[0])
+            dy = cmp(nextPixel[1], pixel[1])
+        return float(self.backsteps[dx+1, dy+1, pixel[0], pixel[1]])
@@ -0,0 +1,102 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''IZ map: a backstep scan which keeps the approach curve of every pixel.
+
+The pixels are scanned like in the backstep scan. For each pixel, the
+current recorded during the approach is compressed by pySICM.izcurves:
+the last Tail values before the stop are kept, the values before are
+reduced to an envelope of one (min, max) pair per Decimation values.
+Each pixel is transmitted as one record (see pySICM.izcurves), which
+also contains the start and end position of the approach. With
+additional Thresholds, the approach goes on to the lowest threshold, so
+that the curves contain the crossings of all of them.'''
+
+import pySICM.izcurves as IzCurves
+from scanmodes.backstepScan import BackstepScan
+from scanmodes.approach import Approach
+import numpy as np
+
+
+class IzMap (BackstepScan):
+
+    _options = [['IzMap.x-Size', 1, float, 
+                 'Scan dimension in x-direction in micm (float)',
+                 0, 0],
+                ['IzMap.y-Size', 1, float, 
+                 'Scan dimension in y-direction in micm (float)',
+                 0, 1],
+                ['IzMap.x-px', 1, int, 
+                 'number of pixels in x-direction (int)',
+                 0, 2],
+                ['IzMap.y-px', 1, int, 
+                 'number of pixels in y-direction (int)',
+                 0, 3],
+                ['IzMap.Tail', 1, int, 
+                 'Number of values kept before the stop (int)',
+                 0, 4],
+                ['IzMap.Decimation', 1, int, 
+                 'Values per envelope point before the tail (int)',
+                 0, 5],
+                ['IzMap.Backstep', 1, int, 
+                 'Vertical retraction distance in micm (int)',
+                 1, 0],
+                ['IzMap.FallRate', 1, int, 
+                 'Fall rate in nm/ms (int)',
+                 1, 1],
+                ['IzMap.LateralSpeed', 1, int, 
+                 'Lateral movement rate in nm/ms (int)',
+                 1, 2],
+                ['IzMap.Threshold', 1, float, 
+                 'Stop threshold in percent (float)',
+                 1, 3],
+                ['IzMap.Sensitivity', 1, float, 
+                 'Sensitivity in V/nA (float)',
+                 1, 4],
+                ['IzMap.Filter', 1, float, 
+                 'Output filter in kHz (float)',
+                 1, 5],
+                ['IzMap.ScanPath', 1, int, 
+                 'Scan path [0: Line by line, 1: Serpentine, 2: Hilbert] (int)',
+                 1, 6],
+                ['IzMap.Thresholds', 1, str, 
+                 'Additional thresholds in percent, comma separated (0: none)',
+                 1, 7]
+        ]
+
+    mode = 'izMap'
+
+    def measurePixel(self, pixel):
+        '''Returns the end position of the approach and the record of its
+        curve.'''
+        r = Approach._detectSurface(self, returnPos = True,
+                                    returnData = True,
+                                    updateFrequency = False)
+        pos = r['end_pos']
+        self.lines.record(pixel, pos)
+        # The first four values are the positions
+        values = r['data'][4:]
+        envelope, tail = IzCurves.compress(
+            values, self.getConfig('Tail'), self.getConfig('Decimation'))
+        return pos, IzCurves.encode(pixel[0], pixel[1],
+                                    max(r['start_pos'], 0), max(pos, 0),
+                                    len(values), envelope, tail)
+
+    def encodePixel(self, pixel, result):
+        record = np.concatenate((result[1], IzCurves.STOP))
+        return record.astype('<u2').tostring()
+
+    def leavePixel(self, pixel, result, nextPixel):
+        super(IzMap, self).leavePixel(pixel, result[0], nextPixel)
@@ -0,0 +1,150 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''Masked scan: a hopping scan of the pixels selected by a mask only.
+
+The option Mask holds a boolean mask of y-px times x-px pixels, encoded
+by pySICM.scanorder.encodeMask. The pixels are visited along the Hilbert
+curve (pySICM.scanorder.Masked), so that each region is scanned before
+moving to the next one.
+
+Each measured pixel is transmitted as three uint16: x, y and the height
+(65535 corresponding to 100 micm), so that clients can put the pixels
+into a previous image.'''
+
+import pySICM.sicm
+from pySICM.error import PySICMError
+import pySICM.scanengine as ScanEngine
+import pySICM.scanorder as ScanOrder
+from scanmodes.approach import PiezoScan
+import numpy as np
+
+
+class MaskedScan (PiezoScan, ScanEngine.PixelStrategy):
+
+    queueable = True
+
+    _options = [['MaskedScan.x-Size', 1, float, 
+                 'Scan dimension in x-direction in micm (float)',
+                 0, 0],
+                ['MaskedScan.y-Size', 1, float, 
+                 'Scan dimension in y-direction in micm (float)',
+                 0, 1],
+                ['MaskedScan.x-px', 1, int, 
+                 'number of pixels in x-direction (int)',
+                 0, 2],
+                ['MaskedScan.y-px', 1, int, 
+                 'number of pixels in y-direction (int)',
+                 0, 3],
+                ['MaskedScan.XOffset', 1, float,
+                 'X-Offset in micm (float)',
+                 0, 4],
+                ['MaskedScan.YOffset', 1, float,
+                 'Y-Offset in micm (float)',
+                 0, 5],
+                ['MaskedScan.Mask', 1, str,
+                 'Pixels to scan, encoded mask (str)',
+                 0, 6],
+                ['MaskedScan.Backstep', 1, float, 
+                 'Vertical retraction distance in micm (float)',
+                 1, 0],
+                ['MaskedScan.FallRate', 1, int, 
+                 'Fall rate in nm/ms (int)',
+                 1, 1],
+                ['MaskedScan.LateralSpeed', 1, int, 
+                 'Lateral movement rate in nm/ms (int)',
+                 1, 2],
+                ['MaskedScan.Threshold', 1, float, 
+                 'Stop threshold in percent (float)',
+                 1, 3],
+                ['MaskedScan.Filter', 1, float, 
+                 'Output filter in kHz (float)',
+                 1, 4]
+        ]
+
+    mode = 'maskedScan'
+
+    def scan(self, settings, writeResponse):
+        self.writeResponse = writeResponse
+        self.initPiezos()
+        if self.checkAndSetConfig(settings):
+            self._config['Threshold']/=100
+            self.stop = False
+            self.retract = False
+            self.boost = False
+            self.deltax = 1e3*self.getConfig('x-Size')/float(self.getConfig('x-px'))
+            self.deltay = 1e3*self.getConfig('y-Size')/float(self.getConfig('y-px'))
+            self.xoffset = 1e3*self.getConfig('XOffset')
+            self.yoffset = 1e3*self.getConfig('YOffset')
+            order = ScanOrder.getOrder('masked', self.getConfig('x-px'),
+                                       self.getConfig('y-px'),
+                                       mask = self.getConfig('Mask'))
+            print "Scanning " + str(len(order)) + " pixels"
+            self.maxHeight = 0
+            self.engine = ScanEngine.ScanEngine(order, self,
+                                                self.writeResponse)
+            d = self.engine.start(self._startScan)
+            d.addCallback(self.scanFinished)
+            d.addErrback(self.handleError)
+        else:
+            print "Config was not correct"
+            self.notifyFailed(PySICMError('Configuration not correct'))
+
+    def _startScan(self):
+        self.readFrequency = self.getReadFrequency()
+
+    def moveToPixel(self, pixel, previous):
+        x, y = pixel
+        if previous is None:
+            # Nothing is known about the surface yet
+            if self.zpiezo.current_nm() + 20 < 1e5:
+                self.zpiezo.ramp_to_nm_target(
+                    1e5, self.getConfig('LateralSpeed'), block = True)
+        elif not ScanOrder.adjacent(previous, pixel):
+            # Moving to another region, pass above everything measured
+            # so far
+            self.zpiezo.ramp_to_nm_target(
+                min(self.maxHeight + self.getConfig('Backstep')*1e3, 1e5),
+                self.getConfig('LateralSpeed'), block = True)
+        if previous is None or previous[1] != y:
+            self.ypiezo.ramp_to_nm_target(
+                self.yoffset + y * self.deltay,
+                self.getConfig('LateralSpeed'), block = True)
+        if previous is None or previous[0] != x:
+            self.xpiezo.ramp_to_nm_target(
+                self.xoffset + x * self.deltax,
+                self.getConfig('LateralSpeed'), block = True)
+
+    def measurePixel(self, pixel):
+        r = self._detectSurface(returnPos = True, returnData = False,
+                                updateFrequency = False)
+        pos = r['end_pos']
+        if self.maxHeight < pos:
+            self.maxHeight = pos
+        return pos
+
+    def encodePixel(self, pixel, pos):
+        if pos > 100000:
+            pos = 100000
+        return (self.mkByte(pixel[0]) + self.mkByte(pixel[1]) +
+                self.mkByte(int(round(np.iinfo(np.uint16).max*pos/100000))))
+
+    def leavePixel(self, pixel, pos, nextPixel):
+        pos += self.getConfig('Backstep')*1e3
+        if pos > 1e5:
+            pos = 1e5
+        self.zpiezo.ramp_to_nm_target(pos,
+                                      self.getConfig('LateralSpeed'),
+                                      block = True)
@@ -0,0 +1,182 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''Progressive scan: a hopping scan from coarse to fine resolution.
+
+The pixels are visited in passes (pySICM.scanorder.Progressive): every
+CoarseStep-th pixel of every CoarseStep-th line first, then the pixels
+in between at half the distance, and so on, so that the client can show
+an image of the entire field after the first pass.
+
+Before each pixel, the pipette is lifted by the backstep above the
+heights measured around the pixel in the previous passes, and approaches
+from there. During the first pass, nothing is known about the surface
+between the pixels, and the pipette passes above everything measured so
+far.
+
+The heights are transmitted as uint16 in the order of the pixels (65535
+corresponding to 100 micm).'''
+
+import pySICM.sicm
+from pySICM.error import PySICMError
+import pySICM.scanengine as ScanEngine
+import pySICM.scanorder as ScanOrder
+from scanmodes.approach import PiezoScan
+import numpy as np
+
+
+class ProgressiveScan (PiezoScan, ScanEngine.PixelStrategy):
+
+    queueable = True
+
+    _options = [['ProgressiveScan.x-Size', 1, float, 
+                 'Scan dimension in x-direction in micm (float)',
+                 0, 0],
+                ['ProgressiveScan.y-Size', 1, float, 
+                 'Scan dimension in y-direction in micm (float)',
+                 0, 1],
+                ['ProgressiveScan.x-px', 1, int, 
+                 'number of pixels in x-direction (int)',
+                 0, 2],
+                ['ProgressiveScan.y-px', 1, int, 
+                 'number of pixels in y-direction (int)',
+                 0, 3],
+                ['ProgressiveScan.CoarseStep', 1, int, 
+                 'Pixel distance of the first pass, e.g. 8 (int)',
+                 0, 4],
+                ['ProgressiveScan.XOffset', 1, float,
+                 'X-Offset in micm (float)',
+                 0, 5],
+                ['ProgressiveScan.YOffset', 1, float,
+                 'Y-Offset in micm (float)',
+                 0, 6],
+                ['ProgressiveScan.Backstep', 1, float, 
+                 'Vertical retraction distance in micm (float)',
+                 1, 0],
+                ['ProgressiveScan.FallRate', 1, int, 
+                 'Fall rate in nm/ms (int)',
+                 1, 1],
+                ['ProgressiveScan.LateralSpeed', 1, int, 
+                 'Lateral movement rate in nm/ms (int)',
+                 1, 2],
+                ['ProgressiveScan.Threshold', 1, float, 
+                 'Stop threshold in percent (float)',
+                 1, 3],
+                ['ProgressiveScan.Filter', 1, float, 
+                 'Output filter in kHz (float)',
+                 1, 4]
+        ]
+
+    mode = 'progressiveScan'
+
+    def scan(self, settings, writeResponse):
+        self.writeResponse = writeResponse
+        self.initPiezos()
+        if self.checkAndSetConfig(settings):
+            self._config['Threshold']/=100
+            self.stop = False
+            self.retract = False
+            self.boost = False
+            self.deltax = 1e3*self.getConfig('x-Size')/float(self.getConfig('x-px'))
+            self.deltay = 1e3*self.getConfig('y-Size')/float(self.getConfig('y-px'))
+            self.xoffset = 1e3*self.getConfig('XOffset')
+            self.yoffset = 1e3*self.getConfig('YOffset')
+            self.order = ScanOrder.getOrder(
+                'progressive', self.getConfig('x-px'), self.getConfig('y-px'),
+                step = self.getConfig('CoarseStep'))
+            # Measured heights in nm, indexed [x, y]
+            self.heights = np.empty((self.getConfig('x-px'),
+                                     self.getConfig('y-px')))
+            self.heights.fill(np.nan)
+            self.maxHeight = None
+            self.lastPos = None
+            self.engine = ScanEngine.ScanEngine(self.order, self,
+                                                self.writeResponse)
+            d = self.engine.start(self._startScan)
+            d.addCallback(self.scanFinished)
+            d.addErrback(self.handleError)
+        else:
+            print "Config was not correct"
+            self.notifyFailed(PySICMError('Configuration not correct'))
+
+    def _startScan(self):
+        self.readFrequency = self.getReadFrequency()
+
+    def neighbourHeight(self, pixel):
+        '''Returns the highest surface measured within the distance of
+        the pass of pixel, or None if there is none.'''
+        s = self.order.stepOf(pixel)
+        x, y = pixel
+        h = self.heights[max(x - s, 0):x + s + 1, max(y - s, 0):y + s + 1]
+        if np.isnan(h).all():
+            return None
+        return np.nanmax(h)
+
+    def startHeight(self, pixel):
+        '''Returns the height from which pixel is approached.'''
+        h = self.neighbourHeight(pixel)
+        if h is None or self.order.stepOf(pixel) == self.order.step:
+            # First pass
+            h = self.maxHeight
+        if h is None:
+            return 1e5
+        return min(h + self.getConfig('Backstep')*1e3, 1e5)
+
+    def moveToPixel(self, pixel, previous):
+        x, y = pixel
+        start = self.startHeight(pixel)
+        # The lateral move starts above the previous pixel and ends above
+        # the neighbours of pixel
+        travel = start
+        if self.lastPos is not None:
+            travel = max(travel, min(
+                self.lastPos + self.getConfig('Backstep')*1e3, 1e5))
+        if previous is None or travel > self.zpiezo.current_nm():
+            self.zpiezo.ramp_to_nm_target(
+                travel, self.getConfig('LateralSpeed'), block = True)
+        if previous is None or previous[1] != y:
+            self.ypiezo.ramp_to_nm_target(
+                self.yoffset + y * self.deltay,
+                self.getConfig('LateralSpeed'), block = True)
+        if previous is None or previous[0] != x:
+            self.xpiezo.ramp_to_nm_target(
+                self.xoffset + x * self.deltax,
+                self.getConfig('LateralSpeed'), block = True)
+        if start < travel:
+            self.zpiezo.ramp_to_nm_target(
+                start, self.getConfig('LateralSpeed'), block = True)
+
+    def measurePixel(self, pixel):
+        r = self._detectSurface(returnPos = True, returnData = False,
+                                updateFrequency = False)
+        pos = r['end_pos']
+        self.heights[pixel] = pos
+        if self.maxHeight is None or self.maxHeight < pos:
+            self.maxHeight = pos
+        return pos
+
+    def encodePixel(self, pixel, pos):
+        if pos > 100000:
+            pos = 100000
+        return self.mkByte(int(round(np.iinfo(np.uint16).max*pos/100000)))
+
+    def leavePixel(self, pixel, pos, nextPixel):
+        self.lastPos = pos
+        pos += self.getConfig('Backstep')*1e3
+        if pos > 1e5:
+            pos = 1e5
+        self.zpiezo.ramp_to_nm_target(pos,
+                                      self.getConfig('LateralSpeed'),
+                                      block = True)
@@ -15,13 +15,12 @@
 # pySICM. If not, see <http://www.gnu.org/licenses/>.
 
 import pySICM.sicm 
+from pySICM.setup import pysicmsetup as SETUP
+import pySICM.recorder as Recorder
 from twisted.internet import defer, reactor
 import struct
-import pycomedi.device as Device
-import pycomedi.subdevice as Subdevice
-import pycomedi.channel as Channel
-import pycomedi.constant as CONSTANTS
-import pycomedi.utility as Util
+from pySICM.comedi import device as Device, subdevice as Subdevice, \
+    channel as Channel, constant as CONSTANTS, utility as Util
 import numpy as np
 import time
 
@@ -60,7 +59,7 @@ class ReadVIn (pySICM.sicm._SICMMeasurement):
         super(ReadVIn, self).__init__()
         
         
-        self._setRequired('InputSignal', 1, pySICM.sicm.InputSignal)
+        self._setRequired('InputSignal', 1, int)
         self._setRequiredOptions('ReadVIn.InputSignal', 1, int, 'Id of the InputSignal to use. (int)')
         self._setRequired('Samples', 1, int)
         self._setRequiredOptions('ReadVIn.Samples', 1, int, 'Number of samples to be read in one run. (int)')
@@ -154,25 +153,11 @@ class ReadVIn (pySICM.sicm._SICMMeasurement):
 
     def scan(self, settings, writeResponse):
         self.writeResponse = writeResponse
-        self.device = Device.Device('/dev/comedi0')
-        self.device.open()
-        
-        self.ai = self.device.find_subdevice_by_type(
-            CONSTANTS.SUBDEVICE_TYPE.ai,
-            factory = Subdevice.StreamingSubdevice)
-        channel = self.ai.channel(
-            3,
-            factory = Channel.AnalogChannel, 
-            aref = CONSTANTS.AREF.ground)
-        best_range = channel.find_range(
-            unit=CONSTANTS.UNIT.volt, 
-            min = -5,
-            max = 5)
-        self.channel = self.ai.channel(
-            3, 
-            factory = Channel.AnalogChannel, 
-            aref = CONSTANTS.AREF.ground,
-            range = best_range)
+        for inp in SETUP.instrument['inputsignals'].itervalues():
+            self.signal = inp
+        self.channel = self.signal.channel
+        self.ai = self.channel.subdevice
+        self.device = self.ai.device
         if self.checkAndSetConfig(settings):
             self.frequency = 1e3*(
                 float(self.getConfig('Samples'))/float(self.getConfig('Duration')))
@@ -183,7 +168,6 @@ class ReadVIn (pySICM.sicm._SICMMeasurement):
             command.stop_src = CONSTANTS.TRIG_SRC.count
             command.stop_arg = self.getConfig('Samples')
             self.command=command
-            buf = np.zeros(self.getConfig('Samples'), np.uint16)
             self.nextDataPoint('');
 
     def nextDataPoint(self, args):
@@ -215,17 +199,18 @@ class ReadVIn (pySICM.sicm._SICMMeasurement):
 #        self.nextDataPoint()
 
     def _scan(self):
-        buf = np.zeros(self.getConfig('Samples'),np.uint16);
-        reader = Util.Reader(self.ai, buf);
-        reader.start()
-        reader.join()
-        print "Length after reader joined: %i" % len(reader.buffer)
+        n = self.getConfig('Samples')
+        raw = self.device.file.read(n * np.dtype(np.uint16).itemsize)
+        buf = np.frombuffer(raw, np.uint16)
+        Recorder.record(Recorder.AI_STREAM, self.device, self.channel.index,
+                        buf, 1.0 / self.frequency)
+        print "Samples read: %i" % len(buf)
         s = ''
-        for i in reader.buffer:
+        for i in buf:
             s = s + self.mkByte(i)
         self.d.callback(s)
         
     def destroy(self):
         self.runs=0
         super(ReadVIn, self).destroy()
-        self.device.close()
+        self.ai.cancel()
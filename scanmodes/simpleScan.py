@@ -16,17 +16,16 @@
 
 import pySICM.sicm 
 import pySICM.piezo as Piezo
-from twisted.internet import defer, reactor, threads
+import pySICM.scanengine as ScanEngine
+import pySICM.scanorder as ScanOrder
+from twisted.internet import defer, reactor
 import struct
-import pycomedi.device as Device
-import pycomedi.subdevice as Subdevice
-import pycomedi.channel as Channel
-import pycomedi.constant as CONSTANTS
-import pycomedi.utility as Util
+from pySICM.comedi import device as Device, subdevice as Subdevice, \
+    channel as Channel, constant as CONSTANTS, utility as Util
 import numpy as np
 import time
 
-class SimpleScan (pySICM.sicm._SICMMeasurement):
+class SimpleScan (pySICM.sicm._SICMMeasurement, ScanEngine.PixelStrategy):
     
     def __init__(self):
         super(SimpleScan, self).__init__()
@@ -226,62 +225,40 @@ class SimpleScan (pySICM.sicm._SICMMeasurement):
             self.y = None
             self.deltay = 1000*self.getConfig('y-Size')/float(self.getConfig('y-px'))
 
-            self.y_is_sync = False
-            self.x_is_sync = False
-            self.nextDataPoint('')
-    def _callNextDataPoint(self):
-        print "In callback from setting to StartPos"
-        self.nextDataPoint('')
-
-    def nextDataPoint(self, args):
-            self.zpiezo.ramp_to_nm_target(1000*self.getConfig('StartPos'),
-                                          self.getConfig('LateralSpeed'),
-                                          self._proceed)
-    def _proceed(self):
-        if self.y is None:
-            self.y = 0
-            self.y_is_sync = False
-        if self.x is None:
-            self.x = 0
-            self.x_is_sync = False
-        else:
-            self.x += 1
-            self.x_is_sync = False
-        if self.x+1 > self.getConfig('x-px'):
-            self.x = 0
-            self.y+=1
-            self.x_is_sync = False
-            self.y_is_sync = False
-        if self.y  < self.getConfig('y-px'):
-            self.d=None;
-            self.generateDeferred()
-            self.setXYposAndDetectSurface()
-
-    def setXYposAndDetectSurface(self):
-        if self.y_is_sync == False:
+            self.engine = ScanEngine.ScanEngine(
+                ScanOrder.Raster(self.getConfig('x-px'),
+                                 self.getConfig('y-px')),
+                self, self.writeResponse)
+            self.engine.start()
+
+    def _retract(self):
+        self.zpiezo.ramp_to_nm_target(1000*self.getConfig('StartPos'),
+                                      self.getConfig('LateralSpeed'),
+                                      block = True)
+
+    def moveToPixel(self, pixel, previous):
+        self.x, self.y = pixel
+        if previous is None:
+            self._retract()
+        if previous is None or previous[1] != self.y:
             print "Ramping to y-pos"
-            self.y_is_sync = True
-            self.ypiezo.ramp_to_nm_target(self.y * self.deltay, self.getConfig('LateralSpeed'), self._setXYpos)
-        else:
-            self._setXYpos()
-
-
-    def _setXYpos(self):
-        # wait for piezo to move to y pos:
-        time.sleep(.01)
-        if self.x_is_sync == False:
+            self.ypiezo.ramp_to_nm_target(self.y * self.deltay, self.getConfig('LateralSpeed'), block = True)
+            # wait for piezo to move to y pos:
+            time.sleep(.01)
+        if previous is None or previous[0] != self.x:
             print "Ramping to x-pos"
-            self.x_is_sync = True
-            self.xpiezo.ramp_to_nm_target(self.x * self.deltax, self.getConfig('LateralSpeed'), self.detectSurface)
-        else:
-            self.detectSurface()
-    def detectSurface(self):
+            self.xpiezo.ramp_to_nm_target(self.x * self.deltax, self.getConfig('LateralSpeed'), block = True)
         # wait for piezo to move to x pos:
         time.sleep(.1)
-        self.generateDeferred()
-        self.d = threads.deferToThread(self._detectSurface)
-        self.d.addCallback(self.writeResponse)
-        self.d.addCallback(self.nextDataPoint)
+
+    def measurePixel(self, pixel):
+        return self._detectSurface()
+
+    def encodePixel(self, pixel, data):
+        return data
+
+    def leavePixel(self, pixel, data, nextPixel):
+        self._retract()
 
     def _detectSurface(self):
         
@@ -314,17 +291,6 @@ class SimpleScan (pySICM.sicm._SICMMeasurement):
 
 
         
-    def updateXY(self):
-        self.x+=1
-        if self.x +1 > self.getConfig('x-px'):
-            self.x = 0
-            self.y+=1
-        self.writeResponse(self.mkByte(int(round(1e-3*self.pos/100.0))))
-        global reactor
-        reactor.callLater(0.001, self.nextDataPoint,'')
-        
-        
-
     def dataMeasured(self, data):
 #        print "Runs is: %i"% self.runs
 #        print "Data Received: %i"%time.time()
@@ -362,10 +328,6 @@ class SimpleScan (pySICM.sicm._SICMMeasurement):
         else:
             self.writeResponse("NACK\r\n")
 
-    def generateDeferred(self):
-        self.d = defer.Deferred()
-        self.d.addCallback(self.writeResponse)
-        self.d.addCallback(self.nextDataPoint)
     def generateFakeDeferred(self):
         self.d = defer.Deferred()
         self.d.addCallback(self.writeResponse)
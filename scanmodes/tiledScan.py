@@ -0,0 +1,224 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''Tiled scan: hopping scans of fields larger than the range of the
+piezos.
+
+The field is divided into TilesX x TilesY tiles of the size of a normal
+scan, which overlap by Overlap percent. Each tile is scanned as a
+hopping scan on a serpentine path. Between the tiles, the coarse stage
+(the xcoarse and ycoarse axes of a controllable, see the CoarseStage
+entries of setup.ini) moves the sample by the distance of the tiles; the
+tiles are visited on a serpentine path as well.
+
+The stage move runs in its own thread, while the worker hands the data
+of the last tile to the reactor for transmission and moves the x- and
+y-piezo back to the first pixel of the next tile. Right after the move,
+the pipette is lowered from the retracted position to the backstep above
+the highest point measured so far (pre-approach); it is not lowered
+during the move, when it passes over unknown parts of the sample.
+
+The data is transmitted as records of four uint16 (tile, x, y, height)
+with tile = row * TilesX + column and the height scaled so that 65535
+corresponds to 100 micm. The tiles are assembled by pySICM.stitching,
+which corrects the imprecision of the stage move by cross-correlating
+the overlaps.'''
+
+from pySICM.setup import pysicmsetup as SETUP
+import pySICM.sicm
+from pySICM.error import PySICMError
+import pySICM.scanengine as ScanEngine
+import pySICM.scanorder as ScanOrder
+import pySICM.worker as Worker
+from twisted.internet import defer
+from scanmodes.approach import PiezoScan
+import numpy as np
+import threading
+
+
+class TiledScan (PiezoScan, ScanEngine.PixelStrategy):
+
+    queueable = True
+
+    _options = [['TiledScan.x-Size', 1, float, 
+                 'Tile dimension in x-direction in micm (float)',
+                 0, 0],
+                ['TiledScan.y-Size', 1, float, 
+                 'Tile dimension in y-direction in micm (float)',
+                 0, 1],
+                ['TiledScan.x-px', 1, int, 
+                 'number of pixels of a tile in x-direction (int)',
+                 0, 2],
+                ['TiledScan.y-px', 1, int, 
+                 'number of pixels of a tile in y-direction (int)',
+                 0, 3],
+                ['TiledScan.TilesX', 1, int, 
+                 'number of tiles in x-direction (int)',
+                 0, 4],
+                ['TiledScan.TilesY', 1, int, 
+                 'number of tiles in y-direction (int)',
+                 0, 5],
+                ['TiledScan.Overlap', 1, float,
+                 'Overlap of neighbouring tiles in percent (float)',
+                 0, 6],
+                ['TiledScan.Backstep', 1, float, 
+                 'Vertical retraction distance in micm (float)',
+                 1, 0],
+                ['TiledScan.FallRate', 1, int, 
+                 'Fall rate in nm/ms (int)',
+                 1, 1],
+                ['TiledScan.LateralSpeed', 1, int, 
+                 'Lateral movement rate in nm/ms (int)',
+                 1, 2],
+                ['TiledScan.Threshold', 1, float, 
+                 'Stop threshold in percent (float)',
+                 1, 3],
+                ['TiledScan.Filter', 1, float, 
+                 'Output filter in kHz (float)',
+                 1, 4]
+        ]
+
+    mode = 'tiledScan'
+
+    def initPiezos(self):
+        super(TiledScan, self).initPiezos()
+        self.xstage = None
+        self.ystage = None
+        for con in SETUP.instrument['controllables'].itervalues():
+            if con.xcoarse():
+                self.xstage = con.xcoarse()
+            if con.ycoarse():
+                self.ystage = con.ycoarse()
+
+    def scan(self, settings, writeResponse):
+        self.writeResponse = writeResponse
+        self.initPiezos()
+        if not self.checkAndSetConfig(settings):
+            print "Config was not correct"
+            self.notifyFailed(PySICMError('Configuration not correct'))
+            return
+        if ((self.getConfig('TilesX') > 1 and not self.xstage) or
+            (self.getConfig('TilesY') > 1 and not self.ystage)):
+            print "No coarse stage for the tiles"
+            self.notifyFailed(PySICMError('No coarse stage for the tiles'))
+            return
+        self._config['Threshold']/=100
+        self.stop = False
+        self.retract = False
+        self.boost = False
+        self.deltax = 1e3*self.getConfig('x-Size')/float(self.getConfig('x-px'))
+        self.deltay = 1e3*self.getConfig('y-Size')/float(self.getConfig('y-px'))
+        # Distance of the tiles in nm
+        self.stepx = (1e3*self.getConfig('x-Size') *
+                      (1 - self.getConfig('Overlap')/100))
+        self.stepy = (1e3*self.getConfig('y-Size') *
+                      (1 - self.getConfig('Overlap')/100))
+        self.order = ScanOrder.getOrder(
+            'serpentine', self.getConfig('x-px'), self.getConfig('y-px'))
+        # Heights of the tiles in nm, indexed [column, row][y, x]
+        self.tiles = {}
+        self.tile = None
+        self.maxHeight = None
+        self.worker = Worker.getWorker()
+        d = defer.Deferred()
+        d.addCallback(self.scanFinished)
+        d.addErrback(self.handleError)
+        self.worker.submit(d, self.do_scan)
+
+    def tileOrder(self):
+        '''Returns the (column, row) of the tiles in the order of the
+        scan.'''
+        tiles = ScanOrder.getOrder('serpentine', self.getConfig('TilesX'),
+                                   self.getConfig('TilesY'))
+        return list(tiles)
+
+    def do_scan(self):
+        '''Scans all tiles. Blocks, has to be called in the worker thread.
+        Returns False if the scan has been stopped.'''
+        self.readFrequency = self.getReadFrequency()
+        self.zpiezo.ramp_to_nm_target(1e5, self.getConfig('LateralSpeed'),
+                                      block = True)
+        tiles = self.tileOrder()
+        for i, tile in enumerate(tiles):
+            self.tile = tile
+            self.tiles[tile] = np.empty((self.getConfig('y-px'),
+                                         self.getConfig('x-px')))
+            self.tiles[tile].fill(np.nan)
+            engine = ScanEngine.ScanEngine(self.order, self,
+                                           self.writeResponse, self.worker)
+            if not engine.run():
+                return False
+            if i + 1 < len(tiles):
+                self.changeTile(tile, tiles[i + 1])
+        return True
+
+    def changeTile(self, tile, nextTile):
+        '''Moves the stage from tile to nextTile, while the data of tile is
+        transmitted and the pipette is brought above the first pixel of
+        nextTile.'''
+        self.zpiezo.ramp_to_nm_target(1e5, self.getConfig('LateralSpeed'),
+                                      block = True)
+        # Stages are controlled in mm
+        dx = 1e-6 * self.stepx * (nextTile[0] - tile[0])
+        dy = 1e-6 * self.stepy * (nextTile[1] - tile[1])
+        mover = threading.Thread(target = self.moveStage, args = (dx, dy))
+        mover.start()
+        self.worker.flush()
+        self.moveToPixel(self.order.pixels()[0], None)
+        mover.join()
+        if self.maxHeight is not None:
+            self.zpiezo.ramp_to_nm_target(
+                min(self.maxHeight + self.getConfig('Backstep')*1e3, 1e5),
+                self.getConfig('LateralSpeed'), block = True)
+
+    def moveStage(self, dx, dy):
+        if dx != 0:
+            self.xstage.move(dx)
+        if dy != 0:
+            self.ystage.move(dy)
+
+    def moveToPixel(self, pixel, previous):
+        x, y = pixel
+        if previous is None or previous[1] != y:
+            self.ypiezo.ramp_to_nm_target(
+                y * self.deltay, self.getConfig('LateralSpeed'), block = True)
+        if previous is None or previous[0] != x:
+            self.xpiezo.ramp_to_nm_target(
+                x * self.deltax, self.getConfig('LateralSpeed'), block = True)
+
+    def measurePixel(self, pixel):
+        r = self._detectSurface(returnPos = True, returnData = False,
+                                updateFrequency = False)
+        pos = r['end_pos']
+        self.tiles[self.tile][pixel[1], pixel[0]] = pos
+        if self.maxHeight is None or self.maxHeight < pos:
+            self.maxHeight = pos
+        return pos
+
+    def encodePixel(self, pixel, pos):
+        if pos > 100000:
+            pos = 100000
+        column, row = self.tile
+        return (self.mkByte(row * self.getConfig('TilesX') + column) +
+                self.mkByte(pixel[0]) + self.mkByte(pixel[1]) +
+                self.mkByte(int(round(np.iinfo(np.uint16).max*pos/100000))))
+
+    def leavePixel(self, pixel, pos, nextPixel):
+        pos += self.getConfig('Backstep')*1e3
+        if pos > 1e5:
+            pos = 1e5
+        self.zpiezo.ramp_to_nm_target(pos,
+                                      self.getConfig('LateralSpeed'),
+                                      block = True)
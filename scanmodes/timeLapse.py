@@ -0,0 +1,299 @@
+# Copyright (C) 2015 Patrick Happel <patrick.happel@rub.de>
+#
+# This file is part of pySICM.
+#
+# pySICM is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 2 of the License, or (at your option) any later
+# version.
+#
+# pySICM is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pySICM. If not, see <http://www.gnu.org/licenses/>.
+'''Time-lapse scan: the same field scanned repeatedly, where later frames
+only rescan what has changed.
+
+The first frame is a complete hopping scan on a serpentine path. Each
+later frame starts Interval seconds after the previous one and
+
+  - measures a sparse lattice of every SparseStep-th pixel of every
+    SparseStep-th line,
+  - marks the surroundings (SparseStep pixels in each direction) of the
+    lattice pixels whose height changed by more than Tolerance as
+    changed, and
+  - rescans all pixels of the changed regions along the Hilbert curve
+    (pySICM.scanorder.Masked).
+
+The other pixels keep the height of the previous frame. The previous
+frame serves as predicted surface: each approach starts Backstep plus
+Tolerance above the predicted height of the pixel, and moves between
+pixels far apart pass Backstep plus Tolerance above the highest
+predicted point on the way. In changed regions, the prediction is raised
+to the heights measured on the lattice.
+
+Frames are transmitted as deltas: records of four uint16 (frame, x, y,
+height), where height is scaled so that 65535 corresponds to 100 micm.
+The first frame contains all pixels, later frames the pixels of the
+changed regions. Each frame ends with a record (frame, 65535, 65535,
+65535).'''
+
+import pySICM.sicm
+from pySICM.error import PySICMError
+import pySICM.recorder as Recorder
+import pySICM.scanengine as ScanEngine
+import pySICM.scanorder as ScanOrder
+import pySICM.worker as Worker
+from scanmodes.approach import PiezoScan
+from twisted.internet import defer
+import numpy as np
+import time
+
+
+class TimeLapse (PiezoScan, ScanEngine.PixelStrategy):
+
+    queueable = True
+
+    _options = [['TimeLapse.x-Size', 1, float, 
+                 'Scan dimension in x-direction in micm (float)',
+                 0, 0],
+                ['TimeLapse.y-Size', 1, float, 
+                 'Scan dimension in y-direction in micm (float)',
+                 0, 1],
+                ['TimeLapse.x-px', 1, int, 
+                 'number of pixels in x-direction (int)',
+                 0, 2],
+                ['TimeLapse.y-px', 1, int, 
+                 'number of pixels in y-direction (int)',
+                 0, 3],
+                ['TimeLapse.XOffset', 1, float,
+                 'X-Offset in micm (float)',
+                 0, 4],
+                ['TimeLapse.YOffset', 1, float,
+                 'Y-Offset in micm (float)',
+                 0, 5],
+                ['TimeLapse.Frames', 1, int,
+                 'Number of frames (int)',
+                 0, 6],
+                ['TimeLapse.Interval', 1, float,
+                 'Time between the starts of the frames in s (float)',
+                 0, 7],
+                ['TimeLapse.SparseStep', 1, int,
+                 'Pixel distance of the lattice of later frames (int)',
+                 0, 8],
+                ['TimeLapse.Tolerance', 1, float,
+                 'Height change regarded as change in micm (float)',
+                 0, 9],
+                ['TimeLapse.Backstep', 1, float, 
+                 'Vertical retraction distance in micm (float)',
+                 1, 0],
+                ['TimeLapse.FallRate', 1, int, 
+                 'Fall rate in nm/ms (int)',
+                 1, 1],
+                ['TimeLapse.LateralSpeed', 1, int, 
+                 'Lateral movement rate in nm/ms (int)',
+                 1, 2],
+                ['TimeLapse.Threshold', 1, float, 
+                 'Stop threshold in percent (float)',
+                 1, 3],
+                ['TimeLapse.Filter', 1, float, 
+                 'Output filter in kHz (float)',
+                 1, 4]
+        ]
+
+    mode = 'timeLapse'
+
+    ENDFRAME = np.iinfo(np.uint16).max
+
+    def scan(self, settings, writeResponse):
+        self.writeResponse = writeResponse
+        self.initPiezos()
+        if self.checkAndSetConfig(settings):
+            self._config['Threshold']/=100
+            self.stop = False
+            self.retract = False
+            self.boost = False
+            self.deltax = 1e3*self.getConfig('x-Size')/float(self.getConfig('x-px'))
+            self.deltay = 1e3*self.getConfig('y-Size')/float(self.getConfig('y-px'))
+            self.xoffset = 1e3*self.getConfig('XOffset')
+            self.yoffset = 1e3*self.getConfig('YOffset')
+            shape = (self.getConfig('x-px'), self.getConfig('y-px'))
+            # Heights of the current frame and predicted surface in nm,
+            # indexed [x, y]; NaN where unknown
+            self.heights = np.empty(shape)
+            self.heights.fill(np.nan)
+            self.predicted = self.heights.copy()
+            self.frame = 0
+            self.margin = 0
+            self.lastPixel = None
+            self.lastPos = None
+            self.worker = Worker.getWorker()
+            d = defer.Deferred()
+            d.addCallback(self.scanFinished)
+            d.addErrback(self.handleError)
+            self.worker.submit(d, self.do_scan)
+        else:
+            print "Config was not correct"
+            self.notifyFailed(PySICMError('Configuration not correct'))
+
+    def do_scan(self):
+        '''Scans all frames. Blocks, has to be called in the worker
+        thread. Returns False if the scan has been stopped.'''
+        self.readFrequency = self.getReadFrequency()
+        for frame in xrange(self.getConfig('Frames')):
+            self.frame = frame
+            start = Recorder.now()
+            if self.frame == 0:
+                ok = self._scanPixels(ScanOrder.getOrder(
+                    'serpentine', self.getConfig('x-px'),
+                    self.getConfig('y-px')), True)
+            else:
+                ok = self.rescan()
+            self.worker.deliver(self.writeResponse, self.mkByte(self.frame) +
+                                self.mkByte(self.ENDFRAME) * 3)
+            if not ok:
+                return False
+            print ("Frame " + str(self.frame) + " finished after " +
+                   str(Recorder.now() - start) + " s")
+            self.predicted = self.heights.copy()
+            if self.frame + 1 < self.getConfig('Frames'):
+                self.zpiezo.ramp_to_nm_target(
+                    1e5, self.getConfig('LateralSpeed'), block = True)
+                self.lastPos = None
+                if not self.waitUntil(start + self.getConfig('Interval')):
+                    return False
+        return True
+
+    def waitUntil(self, t):
+        '''Waits until the time t (see pySICM.recorder.now). Returns False
+        if the scan has been stopped meanwhile.'''
+        self.worker.flush()
+        while Recorder.now() < t:
+            if self.stop:
+                return False
+            time.sleep(min(0.1, max(t - Recorder.now(), 0)))
+        return not self.stop
+
+    def lattice(self):
+        '''The pixels of the sparse lattice on a serpentine path.'''
+        s = self.getConfig('SparseStep')
+        xpx, ypx = self.getConfig('x-px'), self.getConfig('y-px')
+        return [(x * s, y * s) for x, y in ScanOrder.getOrder(
+            'serpentine', (xpx + s - 1) // s, (ypx + s - 1) // s)]
+
+    def rescan(self):
+        '''Scans the lattice and rescans the changed regions. Returns False
+        if the scan has been stopped.'''
+        s = self.getConfig('SparseStep')
+        self.margin = self.getConfig('Tolerance')*1e3
+        previous = self.heights.copy()
+        lattice = self.lattice()
+        if not self._scanPixels(lattice, False):
+            return False
+        changed = np.zeros(self.heights.shape, bool)
+        for x, y in lattice:
+            if abs(self.heights[x, y] - previous[x, y]) > self.margin:
+                region = (slice(max(x - s, 0), x + s + 1),
+                          slice(max(y - s, 0), y + s + 1))
+                changed[region] = True
+                # The surface may have grown anywhere in the region
+                self.predicted[region] = np.fmax(self.predicted[region],
+                                                 self.heights[x, y])
+        # Lattice pixels outside of the changed regions keep the height
+        # of the previous frame, the ones inside are transmitted now
+        rescan = changed.copy()
+        for x, y in lattice:
+            if changed[x, y]:
+                rescan[x, y] = False
+                self.worker.deliver(self.writeResponse,
+                                    self._encode((x, y), self.heights[x, y]))
+            else:
+                self.heights[x, y] = previous[x, y]
+        print ("Frame " + str(self.frame) + ": " +
+               str(np.count_nonzero(changed)) + " pixels changed")
+        return self._scanPixels(ScanOrder.Masked(
+            self.getConfig('x-px'), self.getConfig('y-px'), rescan.T), True)
+
+    def _scanPixels(self, pixels, transmit):
+        self.transmit = transmit
+        engine = ScanEngine.ScanEngine(pixels, self, self.writeResponse,
+                                       self.worker)
+        return engine.run()
+
+    def startHeight(self, pixel):
+        '''Height from which pixel is approached.'''
+        h = self.predicted[pixel]
+        if np.isnan(h):
+            return None
+        return min(h + self.getConfig('Backstep')*1e3 + self.margin, 1e5)
+
+    def travelHeight(self, a, b):
+        '''Height of a lateral move from pixel a to pixel b above the
+        predicted surface.'''
+        part = self.predicted[min(a[0], b[0]):max(a[0], b[0]) + 1,
+                              min(a[1], b[1]):max(a[1], b[1]) + 1]
+        if np.isnan(part).any():
+            return 1e5
+        return min(np.max(part) + self.getConfig('Backstep')*1e3 +
+                   self.margin, 1e5)
+
+    def moveToPixel(self, pixel, previous):
+        # The passes of a frame are scanned by engines of their own, so
+        # previous is taken from the last pixel of the entire scan
+        previous = self.lastPixel
+        x, y = pixel
+        start = self.startHeight(pixel)
+        if previous is None or self.lastPos is None:
+            travel = 1e5
+        elif ScanOrder.adjacent(previous, pixel):
+            travel = min(self.lastPos + self.getConfig('Backstep')*1e3, 1e5)
+        else:
+            travel = self.travelHeight(previous, pixel)
+        if start is not None:
+            travel = max(travel, start)
+        if travel > self.zpiezo.current_nm() + 20:
+            self.zpiezo.ramp_to_nm_target(
+                travel, self.getConfig('LateralSpeed'), block = True)
+        if previous is None or previous[1] != y:
+            self.ypiezo.ramp_to_nm_target(
+                self.yoffset + y * self.deltay,
+                self.getConfig('LateralSpeed'), block = True)
+        if previous is None or previous[0] != x:
+            self.xpiezo.ramp_to_nm_target(
+                self.xoffset + x * self.deltax,
+                self.getConfig('LateralSpeed'), block = True)
+        if start is not None and start < self.zpiezo.current_nm():
+            self.zpiezo.ramp_to_nm_target(
+                start, self.getConfig('LateralSpeed'), block = True)
+
+    def measurePixel(self, pixel):
+        r = self._detectSurface(returnPos = True, returnData = False,
+                                updateFrequency = False)
+        pos = r['end_pos']
+        self.heights[pixel] = pos
+        self.predicted[pixel] = pos
+        return pos
+
+    def _encode(self, pixel, pos):
+        if pos > 100000:
+            pos = 100000
+        return (self.mkByte(self.frame) + self.mkByte(pixel[0]) +
+                self.mkByte(pixel[1]) +
+                self.mkByte(int(round(np.iinfo(np.uint16).max*pos/100000))))
+
+    def encodePixel(self, pixel, pos):
+        if self.transmit:
+            return self._encode(pixel, pos)
+        return None
+
+    def leavePixel(self, pixel, pos, nextPixel):
+        self.lastPixel = pixel
+        self.lastPos = pos
+        pos += self.getConfig('Backstep')*1e3
+        if pos > 1e5:
+            pos = 1e5
+        self.zpiezo.ramp_to_nm_target(pos,
+                                      self.getConfig('LateralSpeed'),
+                                      block = True)
@@ -7,12 +7,16 @@ from pySICM.setup import pysicmsetup as SETUP
 import pySICM.helpers as Helpers
 import pySICM.commands as Com
 import pySICM.commanddef
+import pySICM.jobqueue as JobQueue
 import os
 import json
 
 
 class SicmXProt(LineReceiver, Com._CommandManager):
 
+    # Settings may be long, e.g. the mask of a masked scan
+    MAX_LENGTH = 2**20
+
 #    knownCommands = ['GET','SET','SCAN','READY', 'FAKE', 'STOP']    
 
     
@@ -74,7 +78,11 @@ class SicmXFactory(Factory):
             return defer.succeed("NAK")
     def decrease_clients(self):
         self.num_connections -= 1
-        if self.protocol.modeobj is not None:
+        # Queued jobs continue without a client
+        queue = JobQueue.getQueue()
+        queue.detach()
+        if (self.protocol.modeobj is not None and
+            not queue.isRunning(self.protocol.modeobj)):
             self.protocol.modeobj.setStop()
             self.protocol.modeobj=None
        